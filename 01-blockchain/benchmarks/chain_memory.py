@@ -0,0 +1,94 @@
+""" Shows that the memory held by a `Blockchain` stays flat as its chain grows when only
+the last `--live-blocks` blocks are kept in memory (see `stored_chain.StoredChain`),
+compared with keeping every block in memory once it was read.
+
+For each chain length, a synthetic valid chain is saved in a temporary directory and
+loaded into a `Blockchain`, which then verifies the whole chain (signatures included)
+and walks `Blockchain.chain`. The memory still allocated afterwards and the peak during
+these reads are measured with `tracemalloc`. The block log itself is memory mapped and
+only takes page cache, which the operating system can reclaim.
+
+Run from the `01-blockchain` directory:
+
+    python -m benchmarks.chain_memory [--blocks 1000,5000,20000] [--live-blocks 1024]
+"""
+import gc
+import os
+import tracemalloc
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+
+from benchmarks.synthetic import make_chain, make_transactions, make_wallets
+from blockchain import Blockchain
+from storage import ChainStorage
+from stored_chain import LIVE_BLOCKS
+
+# Number of distinct signed transactions the synthetic chains are made of
+DISTINCT_SIGNED = 200
+
+
+def measure(node_id, live_blocks):
+    """ Load the chain saved for `node_id`, verify it and walk it.
+
+    Returns:
+        A tuple of the bytes still allocated afterwards and the peak number of bytes.
+    """
+    gc.collect()
+    tracemalloc.start()
+    blockchain = Blockchain(None, node_id, live_blocks=live_blocks)
+    assert blockchain.verify_chain(full=True)
+    for _ in blockchain.chain:
+        pass
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blockchain.close()
+    return current, peak
+
+
+def run(block_counts, live_blocks, block_size=10):
+    """ Measure the memory of chains of `block_counts` blocks, keeping `live_blocks`
+    blocks in memory or all of them.
+
+    Returns:
+        A list with one `dict` per chain length.
+    """
+    wallets = make_wallets(3)
+    results = []
+    with TemporaryDirectory() as directory:
+        working_directory = os.getcwd()
+        os.chdir(directory)
+        try:
+            for count in block_counts:
+                transactions = make_transactions((count - 1) * block_size, wallets,
+                                                 distinct=DISTINCT_SIGNED)
+                storage = ChainStorage(f'memory-{count}')
+                storage.load()
+                storage.append_blocks(make_chain(transactions, wallets, block_size))
+                storage.close()
+                del transactions
+                results.append({
+                    'blocks': count,
+                    'window': measure(f'memory-{count}', live_blocks),
+                    'all': measure(f'memory-{count}', count)
+                })
+        finally:
+            os.chdir(working_directory)
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        prog="Chain memory benchmark",
+        usage="python -m benchmarks.chain_memory [--blocks 1000,5000] [--live-blocks count]",
+    )
+    parser.add_argument('--blocks', type=str, default='1000,5000,20000',
+                        help='comma separated chain lengths')
+    parser.add_argument('--live-blocks', type=int, default=LIVE_BLOCKS)
+    args = parser.parse_args()
+    block_counts = [int(count) for count in args.blocks.split(',') if count]
+    print(f'{"blocks":>8}{"live MiB":>12}{"live peak":>12}{"all MiB":>12}{"all peak":>12}')
+    for result in run(block_counts, args.live_blocks):
+        window, every = result['window'], result['all']
+        print(f'{result["blocks"]:>8}{window[0] / 2 ** 20:>12.1f}{window[1] / 2 ** 20:>12.1f}'
+              f'{every[0] / 2 ** 20:>12.1f}{every[1] / 2 ** 20:>12.1f}')
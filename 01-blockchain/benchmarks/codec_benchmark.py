@@ -0,0 +1,64 @@
+""" Compares the size and the encode/decode speed of the binary block encoding (`codec`)
+with the JSON encoding of `Block.to_dict`.
+
+Run from the `01-blockchain` directory: `python -m benchmarks.codec_benchmark [-n 1000]`
+"""
+import json
+from argparse import ArgumentParser
+from timeit import repeat
+
+from benchmarks.synthetic import make_chain, make_transactions, make_wallets
+from block import Block
+from codec import decode_blocks, encode_blocks
+
+
+def best_time(func, number):
+    """ Return the best of 5 runs of `number` calls of `func`, in seconds per call. """
+    return min(repeat(func, number=number, repeat=5)) / number
+
+
+def run(transaction_count, block_size=100):
+    """ Measure both encodings on a synthetic chain of `transaction_count` transactions.
+
+    Returns:
+        A `dict` with the encoded size in bytes and the encode/decode seconds of each format.
+    """
+    wallets = make_wallets(5)
+    chain = make_chain(make_transactions(transaction_count, wallets), wallets, block_size)
+
+    json_data = json.dumps([block.to_dict() for block in chain]).encode('utf-8')
+    binary_data = encode_blocks(chain)
+    assert [block.hash for block in decode_blocks(binary_data)] == [block.hash for block in chain]
+
+    number = max(1, 10000 // max(transaction_count, 1))
+    return {
+        'transactions': transaction_count,
+        'json': {
+            'bytes': len(json_data),
+            'encode_seconds': best_time(
+                lambda: json.dumps([block.to_dict() for block in chain]).encode('utf-8'), number),
+            'decode_seconds': best_time(
+                lambda: [Block.from_dict(block) for block in json.loads(json_data)], number)
+        },
+        'binary': {
+            'bytes': len(binary_data),
+            'encode_seconds': best_time(lambda: encode_blocks(chain), number),
+            'decode_seconds': best_time(lambda: decode_blocks(binary_data), number)
+        }
+    }
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        prog="Codec benchmark",
+        usage="python -m benchmarks.codec_benchmark [-n transactions]",
+    )
+    parser.add_argument('-n', '--transactions', type=int, default=1000)
+    args = parser.parse_args()
+    result = run(args.transactions)
+    print(f'{"format":<8}{"bytes":>12}{"encode ms":>12}{"decode ms":>12}')
+    for name in ('json', 'binary'):
+        values = result[name]
+        print(f'{name:<8}{values["bytes"]:>12,}{values["encode_seconds"] * 1000:>12.2f}'
+              f'{values["decode_seconds"] * 1000:>12.2f}')
+    print(f'binary/json size: {result["binary"]["bytes"] / result["json"]["bytes"]:.2%}')
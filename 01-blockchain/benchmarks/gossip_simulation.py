@@ -0,0 +1,153 @@
+""" Simulates how fast a new transaction or block spreads through networks of growing size,
+with the gossip relay (see `gossip.GossipRelay`) and with broadcasting to all peers.
+
+The nodes run in this process: each has its own `GossipRelay` and a list of peers, and
+sending a message is an event delivered after a random network latency. A node sends
+its copies one after the other, each taking `--send-ms` milliseconds of its time, so
+the node creating a message pays for every peer it sends it to.
+
+In gossip mode every node only knows `--peers` random other nodes and sends each new
+message to `--fanout` of them with a time to live of `--ttl` hops. Broadcasting needs
+every node to know all the others, since messages are not relayed. A node the gossip
+misses gets the blocks it lacks when it resolves conflicts on the next block it
+receives, and the transactions it lacks with these blocks.
+
+Run from the `01-blockchain` directory:
+
+    python -m benchmarks.gossip_simulation [--nodes 16,64,256,1024] [--fanout 8] [--ttl 8]
+"""
+import heapq
+import random
+from argparse import ArgumentParser
+
+from gossip import GOSSIP_TTL, GossipRelay
+
+
+def make_network(node_count, peer_count, rng):
+    """ Connect every node to `peer_count` random other nodes (in both directions) and to
+    the next node of a ring, which keeps the network connected.
+
+    Returns:
+        A list with the list of peers of each node.
+    """
+    peers = [set() for _ in range(node_count)]
+    for node in range(node_count):
+        neighbour = (node + 1) % node_count
+        others = rng.sample(range(node_count), min(peer_count, node_count))
+        for other in others + [neighbour]:
+            if other != node:
+                peers[node].add(other)
+                peers[other].add(node)
+    return [sorted(node_peers) for node_peers in peers]
+
+
+def spread(peers, relays, send_cost, latency, rng):
+    """ Send one message from node 0 and deliver it until no node sends it further.
+
+    Returns:
+        A `dict` with the time in seconds each reached node received the message first,
+        the number of hops it took, and the number of copies sent in total and by node 0.
+    """
+    message_id = '%032x' % rng.getrandbits(128)
+    arrivals = {0: 0.0}
+    hops = {0: 0}
+    sent = {'total': 0, 'origin': 0}
+    events = []
+
+    def send(node, now, ttl):
+        targets, remaining = relays[node].targets(peers[node], ttl)
+        for position, target in enumerate(targets):
+            departure = now + (position + 1) * send_cost
+            heapq.heappush(events, (departure + rng.uniform(*latency), target, remaining,
+                                    hops[node] + 1))
+        sent['total'] += len(targets)
+        if node == 0:
+            sent['origin'] += len(targets)
+
+    relays[0].see(message_id)
+    send(0, 0.0, None)
+    while events:
+        now, node, ttl, hop = heapq.heappop(events)
+        if not relays[node].see(message_id):
+            continue
+        arrivals[node] = now
+        hops[node] = hop
+        # Without a time to live the message came from a broadcast and is not relayed
+        send(node, now + send_cost, 0 if ttl is None else ttl)
+    return {'arrivals': arrivals, 'hops': max(hops.values()), 'sent': sent}
+
+
+def simulate(node_count, fanout, ttl, peer_count, trials, send_cost, latency, seed=0):
+    """ Average the spreading of `trials` messages over networks of `node_count` nodes.
+
+    Arguments:
+        fanout (`int`): The number of peers each message is sent to, 0 to broadcast it to
+            all nodes (which then know each other).
+
+    Returns:
+        A `dict` with the average share of nodes reached, the average times in seconds
+        until 90% and 99% of the nodes received the message (None when some message
+        did not get that far), the average number of hops and of copies sent per node
+        and by the node creating the message.
+    """
+    rng = random.Random(seed)
+    totals = {'coverage': 0.0, 'hops': 0.0, 'sent_per_node': 0.0, 'origin_sent': 0.0}
+    reach_times = {'t90': [], 't99': []}
+    for _ in range(trials):
+        if fanout:
+            peers = make_network(node_count, peer_count, rng)
+        else:
+            peers = [[other for other in range(node_count) if other != node]
+                     for node in range(node_count)]
+        relays = [GossipRelay(fanout, ttl, rng=random.Random(rng.random()))
+                  for _ in range(node_count)]
+        outcome = spread(peers, relays, send_cost, latency, rng)
+        times = sorted(outcome['arrivals'].values())
+        totals['coverage'] += len(times) / node_count
+        totals['hops'] += outcome['hops']
+        totals['sent_per_node'] += outcome['sent']['total'] / node_count
+        totals['origin_sent'] += outcome['sent']['origin']
+        for key, share in (('t90', 90), ('t99', 99)):
+            reached = -(-node_count * share // 100)
+            reach_times[key].append(times[reached - 1] if len(times) >= reached else None)
+    results = {key: value / trials for key, value in totals.items()}
+    for key, values in reach_times.items():
+        results[key] = None if None in values else sum(values) / trials
+    return results
+
+
+def format_ms(seconds):
+    return f'{seconds * 1000:.0f}' if seconds is not None else '-'
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        prog="Gossip simulation",
+        usage="python -m benchmarks.gossip_simulation [--nodes 16,64,256] [--fanout k] [--ttl hops]",
+    )
+    parser.add_argument('--nodes', type=str, default='16,64,256,1024',
+                        help='comma separated numbers of nodes')
+    parser.add_argument('--fanout', type=int, default=8)
+    parser.add_argument('--ttl', type=int, default=GOSSIP_TTL)
+    parser.add_argument('--peers', type=int, default=8,
+                        help='number of random peers each node knows in gossip mode')
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--send-ms', type=float, default=1.0,
+                        help='milliseconds a node spends sending one copy of a message')
+    parser.add_argument('--latency-ms', type=str, default='10,50',
+                        help='range of the network latency of a copy in milliseconds')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    latency = tuple(float(value) / 1000 for value in args.latency_ms.split(','))
+
+    print(f'{"nodes":>6} {"mode":<12}{"reached":>9}{"90% ms":>9}{"99% ms":>9}'
+          f'{"hops":>6}{"sent/node":>11}{"by origin":>11}')
+    for node_count in [int(count) for count in args.nodes.split(',') if count]:
+        for fanout in (args.fanout, 0):
+            result = simulate(node_count, fanout, args.ttl, args.peers, args.trials,
+                              args.send_ms / 1000, latency, args.seed)
+            mode = f'gossip k={fanout}' if fanout else 'broadcast'
+            print(f'{node_count:>6} {mode:<12}{result["coverage"]:>9.1%}'
+                  f'{format_ms(result["t90"]):>9}{format_ms(result["t99"]):>9}'
+                  f'{result["hops"]:>6.1f}{result["sent_per_node"]:>11.1f}'
+                  f'{result["origin_sent"]:>11.0f}')
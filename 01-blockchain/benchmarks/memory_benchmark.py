@@ -0,0 +1,118 @@
+""" Measures the memory taken by the blocks and transactions of a loaded chain, compared
+with the previous representation which kept the attributes of every `Block` and
+`Transaction` in a `__dict__` and did not share the public keys between transactions.
+
+Run from the `01-blockchain` directory: `python -m benchmarks.memory_benchmark [-n 100000]`
+"""
+import gc
+import json
+import tracemalloc
+from argparse import ArgumentParser
+
+from benchmarks.synthetic import make_transactions, make_wallets
+from block import Block
+from codec import decode_blocks, encode_blocks
+from transaction import Transaction
+
+# Number of distinct signed transactions the synthetic chain is made of. Signing is
+# slow, so larger chains repeat them (the copies are still separate objects).
+SIGNED_TRANSACTIONS = 200
+
+
+class DictTransaction:
+    """ A `Transaction` as it was stored before it had `__slots__`. """
+
+    def __init__(self, sender, recipient, signature, amount):
+        self.sender = sender
+        self.recipient = recipient
+        self.amount = amount
+        self.signature = signature
+        self._tx_id = None
+
+
+class DictBlock:
+    """ A `Block` as it was stored before it had `__slots__`. """
+
+    def __init__(self, index, previous_hash, transactions, proof, timestamp):
+        self.index = index
+        self.previous_hash = previous_hash
+        self.timestamp = timestamp
+        self.transactions = transactions
+        self.proof = proof
+        self._hash = None
+
+
+def load(json_data, block_cls, transaction_cls):
+    """ Create block objects from the JSON form of a chain, as a node does when loading it. """
+    return [block_cls(block['index'], block['previous_hash'],
+                      [transaction_cls(tx['sender'], tx['recipient'], tx['signature'], tx['amount'])
+                       for tx in block['transactions']],
+                      block['proof'], block['timestamp'])
+            for block in json.loads(json_data)]
+
+
+def measure(func):
+    """ Return the number of bytes still allocated by the objects `func` returns. """
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def run(transaction_count, block_size=100):
+    """ Measure the memory of a synthetic chain of `transaction_count` transactions.
+
+    Returns:
+        A `dict` with the bytes taken by the previous and the current representation,
+        both in total and per 100,000 transactions.
+    """
+    wallets = make_wallets(5)
+    signed = [tx.to_dict() for tx in make_transactions(SIGNED_TRANSACTIONS, wallets)]
+    blocks = []
+    for start in range(0, transaction_count, block_size):
+        count = min(block_size, transaction_count - start)
+        blocks.append({
+            'index': len(blocks), 'previous_hash': '%064x' % len(blocks),
+            'timestamp': 1600000000.0 + len(blocks), 'proof': len(blocks),
+            'transactions': [signed[(start + i) % len(signed)] for i in range(count)]
+        })
+    json_data = json.dumps(blocks)
+    binary_data = encode_blocks(load(json_data, Block, Transaction))
+
+    sizes = {
+        'dict': measure(lambda: load(json_data, DictBlock, DictTransaction)),
+        'slots': measure(lambda: load(json_data, Block, Transaction)),
+        'slots_binary': measure(lambda: decode_blocks(binary_data))
+    }
+    scale = 100000 / max(transaction_count, 1)
+    return {
+        'transactions': transaction_count,
+        'bytes': sizes,
+        'bytes_per_100k_transactions': {name: round(size * scale) for name, size in sizes.items()}
+    }
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        prog="Memory benchmark",
+        usage="python -m benchmarks.memory_benchmark [-n transactions]",
+    )
+    parser.add_argument('-n', '--transactions', type=int, default=100000)
+    args = parser.parse_args()
+    result = run(args.transactions)
+    baseline = result['bytes']['dict']
+    print(f'{"representation":<28}{"MiB":>10}{"MiB/100k tx":>14}{"saved":>8}')
+    labels = {
+        'dict': 'dict objects (previous)',
+        'slots': 'slotted objects from JSON',
+        'slots_binary': 'slotted objects from binary'
+    }
+    for name, label in labels.items():
+        size = result['bytes'][name]
+        per_100k = result['bytes_per_100k_transactions'][name]
+        print(f'{label:<28}{size / 2 ** 20:>10.1f}{per_100k / 2 ** 20:>14.1f}'
+              f'{1 - size / baseline:>8.0%}')
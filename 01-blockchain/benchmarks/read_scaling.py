@@ -0,0 +1,231 @@
+""" Stress test of concurrent reads of a node while transactions are being added (see
+`utility.rwlock.ReadWriteLock` and `Blockchain`).
+
+Run from the `01-blockchain` directory:
+
+    python -m benchmarks.read_scaling                   # both parts below
+    python -m benchmarks.read_scaling --clients 1,2,4,8,16 --duration 5 --writer
+
+The `blockchain` part builds a real `Blockchain` with a few hundred blocks and has 1, 2,
+4, ... threads call `get_balance`, read ranges of `Blockchain.chain` (recent and old
+blocks, which are read from the block log) and `get_open_transactions` for `--duration`
+seconds. With `--writer` another thread adds signed transactions meanwhile. The reads
+are Python code sharing one core under the GIL, so their total throughput is bounded by
+that core and does not grow linearly with the threads. What the table shows is that
+readers do not queue behind each other beyond that (the read throughput stays flat while
+the 99th percentile latency grows with the threads sharing the core), and that the
+writer keeps adding transactions while readers run, since the lock prefers writers.
+
+The `http` part starts a node served by waitress with `--threads` threads, mines a few
+blocks and has 1, 2, 4, ... client processes call `GET /chain`, `/balance`,
+`/transactions` and `/nodes` for `--duration` seconds. With `--writer` another process
+posts transactions meanwhile. Request handling shares one core under the GIL as well, so
+this part scales until that core is busy rather than linearly.
+"""
+import os
+import random
+import subprocess
+import sys
+import threading
+from argparse import ArgumentParser
+from multiprocessing import Pool, Process
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep
+
+import requests
+
+from benchmarks.synthetic import make_chain, make_transactions, make_wallets
+from blockchain import Blockchain
+from storage import ChainStorage
+
+# Directory of node.py
+NODE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Paths of the read requests sent round-robin by each client
+READ_PATHS = ('/chain?start=1', '/balance', '/transactions', '/nodes')
+
+# Number of blocks of the synthetic chain of the blockchain part, of transactions in each of
+# them and of blocks read by each range read
+CHAIN_BLOCKS = 300
+BLOCK_TRANSACTIONS = 5
+RANGE_BLOCKS = 10
+# Number of distinct signed transactions the synthetic chain is made of
+DISTINCT_SIGNED = 100
+
+
+def make_blockchain(node_id):
+    """ Save a synthetic valid chain of `CHAIN_BLOCKS` blocks in the current directory and
+    load it into a `Blockchain` keeping only the last few blocks in memory, so range reads
+    also hit the block log.
+
+    Returns:
+        A tuple of the `Blockchain` and the `Wallet` of its node, which owns coins.
+    """
+    wallets = make_wallets(2)
+    transactions = make_transactions((CHAIN_BLOCKS - 1) * BLOCK_TRANSACTIONS, wallets,
+                                     distinct=DISTINCT_SIGNED)
+    storage = ChainStorage(node_id)
+    storage.load()
+    storage.append_blocks(make_chain(transactions, wallets, BLOCK_TRANSACTIONS))
+    storage.close()
+    return Blockchain(wallets[0].public_key, node_id, live_blocks=16), wallets[0]
+
+
+def run_blockchain_readers(blockchain, wallet, readers, duration, writer):
+    """ Have `readers` threads read from `blockchain` for `duration` seconds, and another
+    thread add transactions meanwhile if `writer` is True.
+
+    Returns:
+        A tuple of the number of reads per second, the 99th percentile read latency in
+        seconds and the number of transactions added per second.
+    """
+    latencies = [[] for _ in range(readers)]
+    written = [0]
+    deadline = perf_counter() + duration
+
+    def read(reader):
+        rng = random.Random(reader)
+        chain = blockchain.chain
+        while perf_counter() < deadline:
+            started = perf_counter()
+            blockchain.get_balance()
+            start = rng.randrange(len(chain) - RANGE_BLOCKS)
+            chain[start:start + RANGE_BLOCKS]
+            blockchain.get_open_transactions()
+            latencies[reader].append(perf_counter() - started)
+
+    def write():
+        while perf_counter() < deadline:
+            recipient = f'readers-{readers}-{written[0]}'
+            signature = wallet.sign_transaction(wallet.public_key, recipient, 0.01)
+            blockchain.add_transaction(wallet.public_key, recipient, signature, 0.01)
+            written[0] += 1
+
+    threads = [threading.Thread(target=read, args=(reader,)) for reader in range(readers)]
+    if writer:
+        threads.append(threading.Thread(target=write))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    all_latencies = sorted(latency for reader in latencies for latency in reader)
+    p99 = all_latencies[int(len(all_latencies) * 0.99)] if all_latencies else 0.0
+    return len(all_latencies) / duration, p99, written[0] / duration
+
+
+def run_blockchain(clients, duration, writer):
+    """ Measure the reads of a `Blockchain` for each number of reader threads. """
+    rows = []
+    with TemporaryDirectory() as directory:
+        working_directory = os.getcwd()
+        os.chdir(directory)
+        try:
+            blockchain, wallet = make_blockchain('read-scaling')
+            for count in clients:
+                rows.append((count, *run_blockchain_readers(blockchain, wallet, count,
+                                                            duration, writer)))
+            blockchain.close()
+        finally:
+            os.chdir(working_directory)
+    return rows
+
+
+def read_client(url, duration):
+    """ Send read requests to the node for `duration` seconds and return their number. """
+    session = requests.Session()
+    deadline = perf_counter() + duration
+    count = 0
+    while perf_counter() < deadline:
+        response = session.get(url + READ_PATHS[count % len(READ_PATHS)])
+        assert response.status_code == 200, response.status_code
+        count += 1
+    return count
+
+
+def write_client(url, duration):
+    """ Post transactions to the node for `duration` seconds. """
+    session = requests.Session()
+    deadline = perf_counter() + duration
+    count = 0
+    while perf_counter() < deadline:
+        session.post(url + '/transaction', json={'recipient': f'reader-{count}', 'amount': 0.01})
+        count += 1
+
+
+def start_node(directory, port, threads):
+    """ Start a node with a new wallet and a few mined blocks in `directory`. """
+    node = subprocess.Popen(
+        [sys.executable, os.path.join(NODE_DIRECTORY, 'node.py'), '-p', str(port),
+         '-s', 'waitress', '-t', str(threads)],
+        cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://localhost:{port}'
+    for _ in range(100):
+        try:
+            requests.get(url + '/nodes')
+            break
+        except requests.ConnectionError:
+            sleep(0.1)
+    requests.post(url + '/wallet')
+    for _ in range(5):
+        requests.post(url + '/mine')
+    return node, url
+
+
+def run_http(clients, duration, port, threads, writer):
+    """ Measure the read requests per second served for each number of clients. """
+    rates = []
+    with TemporaryDirectory() as directory:
+        node, url = start_node(directory, port, threads)
+        try:
+            for count in clients:
+                writer_process = None
+                if writer:
+                    writer_process = Process(target=write_client, args=(url, duration))
+                    writer_process.start()
+                with Pool(count) as pool:
+                    started = perf_counter()
+                    total = sum(pool.starmap(read_client, [(url, duration)] * count))
+                    rates.append((count, total / (perf_counter() - started)))
+                if writer_process is not None:
+                    writer_process.join()
+        finally:
+            node.terminate()
+            node.wait()
+    return rates
+
+
+def print_rates(title, rates):
+    print(title)
+    print(f'{"readers":>8}{"reads/s":>12}{"speedup":>10}')
+    for readers, rate in rates:
+        print(f'{readers:>8}{rate:>12.0f}{rate / rates[0][1]:>10.2f}')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        prog="Read scaling stress test",
+        usage="python -m benchmarks.read_scaling [--clients 1,2,4,8] [--part blockchain|http]",
+    )
+    parser.add_argument('--clients', type=str, default='1,2,4,8',
+                        help='comma separated numbers of concurrent readers')
+    parser.add_argument('--duration', type=float, default=3.0,
+                        help='seconds each number of readers runs')
+    parser.add_argument('--part', choices=('blockchain', 'http', 'all'), default='all')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--threads', type=int, default=16,
+                        help='request threads of the node of the http part')
+    parser.add_argument('--writer', action='store_true',
+                        help='add transactions while the readers run')
+    args = parser.parse_args()
+    clients = [int(count) for count in args.clients.split(',') if count]
+
+    if args.part in ('blockchain', 'all'):
+        print(f'Blockchain: {CHAIN_BLOCKS} blocks'
+              f'{", one thread adding transactions" if args.writer else ""}')
+        print(f'{"readers":>8}{"reads/s":>12}{"p99 ms":>10}{"writes/s":>10}')
+        for readers, rate, p99, writes in run_blockchain(clients, args.duration, args.writer):
+            print(f'{readers:>8}{rate:>12.0f}{p99 * 1000:>10.2f}{writes:>10.0f}')
+    if args.part in ('http', 'all'):
+        print_rates(f'HTTP: waitress with {args.threads} threads'
+                    f'{", one client posting transactions" if args.writer else ""}',
+                    run_http(clients, args.duration, args.port, args.threads, args.writer))
@@ -0,0 +1,319 @@
+""" Times the hot paths of the blockchain on synthetic signed chains and compares the
+results with a stored baseline.
+
+Run from the `01-blockchain` directory:
+
+    python -m benchmarks.run --save-baseline          # record the baseline of this machine
+    python -m benchmarks.run                          # compare against it, exit 1 on regressions
+    python -m benchmarks.run --sizes 1000,10000,100000 --output results.json
+
+Every benchmark is run `--repeat` times and the best time is kept. Results are compared
+per operation (e.g. per block hashed or per signature verified), so chains of different
+sizes can be compared with each other and with the baseline.
+"""
+import json
+import os
+import platform
+import sys
+from argparse import ArgumentParser
+from collections import OrderedDict
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from benchmarks.synthetic import make_chain, make_transactions, make_wallets
+from blockchain import Blockchain
+from ledger import Ledger
+from storage import ChainStorage
+from utility.hash_util import hash_block
+from utility.merkle import merkle_root
+from utility.mining import ProofOfWorkMiner
+from utility.verification import Verification
+from wallet import Wallet
+
+# Default file holding the baseline results
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Number of transactions which are actually signed; larger chains repeat them
+DISTINCT_SIGNED = 1000
+
+# Number of blocks mined again by the proof-of-work benchmark
+MINED_BLOCKS = 20
+
+# Number of transactions verified one by one by the signature benchmark
+VERIFIED_TRANSACTIONS = 500
+
+# Minimum duration in seconds of each timing
+MIN_TIMING = 0.2
+
+# A benchmark slower than its baseline by more than this fraction is a regression
+DEFAULT_TOLERANCE = 0.25
+
+
+class SyntheticChain:
+    """ A valid synthetic chain and the data prepared once for the benchmarks using it. """
+
+    def __init__(self, transaction_count, block_size=100):
+        self.wallets = make_wallets(5)
+        self.transactions = make_transactions(
+            transaction_count, self.wallets, distinct=DISTINCT_SIGNED)
+        self.chain = make_chain(self.transactions, self.wallets, block_size)
+        self.ledger = Ledger()
+        self.ledger.rebuild(self.chain, [])
+        self.stored = ChainStorage(f'benchmark-{transaction_count}')
+        self.stored.load()
+        self.stored.append_blocks(self.chain)
+        self.stored.close()
+        # Copies of the block log for the startup benchmarks, with and without a snapshot
+        for suffix in ('replay', 'snapshot'):
+            storage = ChainStorage(f'benchmark-{transaction_count}-{suffix}')
+            storage.load()
+            storage.append_blocks(self.chain)
+            storage.close()
+        blockchain = Blockchain(None, f'benchmark-{transaction_count}-snapshot')
+        blockchain.verify_chain()
+        blockchain.close()
+        self.node_id = f'benchmark-{transaction_count}'
+
+
+def bench_hash_block(data):
+    for block in data.chain:
+        hash_block(block)
+    return len(data.chain)
+
+
+def bench_valid_proof(data):
+    for block in data.chain[1:]:
+        Verification.valid_header_proof(block.header(), block.target)
+    return len(data.chain) - 1
+
+
+def bench_merkle_root(data):
+    for block in data.chain[1:]:
+        merkle_root([tx.tx_id for tx in block.transactions])
+    return len(data.transactions)
+
+
+def bench_proof_of_work(data):
+    miner = ProofOfWorkMiner(1)
+    hashes = 0
+    for block in data.chain[1:MINED_BLOCKS + 1]:
+        miner.find_header_proof(block.header_prefix(), block.target)
+        hashes += miner.last_hashes
+    return hashes
+
+
+def bench_ledger_rebuild(data):
+    Ledger().rebuild(data.chain, [])
+    return len(data.transactions)
+
+
+def bench_get_balance(data):
+    for tx in data.transactions:
+        data.ledger.get_balance(tx.sender)
+    return len(data.transactions)
+
+
+def bench_verify_chain(data):
+    assert Verification.verify_chain(data.chain)
+    return len(data.chain)
+
+
+def bench_verify_chain_signatures(data):
+    assert Verification.verify_chain(data.chain, check_signatures=True)
+    return len(data.transactions)
+
+
+def bench_verify_transaction(data):
+    transactions = data.transactions[:VERIFIED_TRANSACTIONS]
+    for tx in transactions:
+        assert Wallet.verify_transaction(tx)
+    return len(transactions)
+
+
+def bench_startup_replay(data):
+    # Not closed, so that no snapshot is saved
+    Blockchain(None, f'{data.node_id}-replay').verify_chain()
+    return len(data.chain)
+
+
+def bench_startup_snapshot(data):
+    Blockchain(None, f'{data.node_id}-snapshot').verify_chain()
+    return len(data.chain)
+
+
+def bench_save_blocks(data):
+    with TemporaryDirectory(dir='.') as directory:
+        storage = ChainStorage(os.path.join(os.path.basename(directory), 'save'))
+        storage.load()
+        storage.append_blocks(data.chain)
+        storage.close()
+    return len(data.chain)
+
+
+def bench_load_blocks(data):
+    storage = ChainStorage(data.stored.directory[len('blockchain-'):])
+    storage.load()
+    count = sum(1 for _ in storage.iter_blocks())
+    storage.close()
+    return count
+
+
+BENCHMARKS = OrderedDict([
+    ('hash_block', bench_hash_block),
+    ('valid_proof', bench_valid_proof),
+    ('merkle_root', bench_merkle_root),
+    ('proof_of_work', bench_proof_of_work),
+    ('ledger_rebuild', bench_ledger_rebuild),
+    ('get_balance', bench_get_balance),
+    ('verify_chain', bench_verify_chain),
+    ('verify_chain_signatures', bench_verify_chain_signatures),
+    ('verify_transaction', bench_verify_transaction),
+    ('startup_replay', bench_startup_replay),
+    ('startup_snapshot', bench_startup_snapshot),
+    ('save_blocks', bench_save_blocks),
+    ('load_blocks', bench_load_blocks)
+])
+
+
+def time_benchmark(func, data, repeat):
+    """ Return the number of operations of one call of `func` and the best of `repeat`
+    timings of one call. Fast benchmarks are called several times per timing, so that
+    each timing lasts at least `MIN_TIMING` seconds and is not dominated by noise. """
+    started = perf_counter()
+    operations = func(data)
+    loops = max(1, int(MIN_TIMING / max(perf_counter() - started, 1e-9)) + 1)
+    best = None
+    for _ in range(repeat):
+        started = perf_counter()
+        for _ in range(loops):
+            func(data)
+        elapsed = (perf_counter() - started) / loops
+        best = elapsed if best is None else min(best, elapsed)
+    return operations, best
+
+
+def run(sizes, repeat=5, names=None):
+    """ Run the benchmarks on a synthetic chain of each size.
+
+    Arguments:
+        sizes (:obj:`list` of `int`): The numbers of transactions of the synthetic chains.
+        repeat (`int`): How many times each benchmark is run; the best time is kept.
+        names (:obj:`list` of `str`, optional): The benchmarks to run (default all).
+
+    Returns:
+        A JSON-serializable `dict` with the environment and, for each size and benchmark,
+        the number of operations, the seconds taken and the seconds per operation.
+    """
+    results = OrderedDict()
+    cwd = os.getcwd()
+    with TemporaryDirectory() as directory:
+        # The block storage is created relative to the working directory
+        os.chdir(directory)
+        try:
+            for size in sizes:
+                print(f'Generating a chain of {size} transactions...', file=sys.stderr)
+                data = SyntheticChain(size)
+                results[str(size)] = OrderedDict()
+                for name, func in BENCHMARKS.items():
+                    if names and name not in names:
+                        continue
+                    operations, seconds = time_benchmark(func, data, repeat)
+                    results[str(size)][name] = {
+                        'operations': operations,
+                        'seconds': seconds,
+                        'seconds_per_operation': seconds / max(operations, 1)
+                    }
+                    print(f'  {name}: {seconds:.4f}s', file=sys.stderr)
+        finally:
+            os.chdir(cwd)
+    return {
+        'environment': environment(),
+        'repeat': repeat,
+        'results': results
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ Compare the results of `report` with those of `baseline`.
+
+    Returns:
+        A list of (size, name, baseline seconds per operation, current seconds per
+        operation, relative change, regressed) tuples for the benchmarks found in both.
+    """
+    rows = []
+    for size, benchmarks in report['results'].items():
+        for name, result in benchmarks.items():
+            previous = baseline['results'].get(size, {}).get(name)
+            if previous is None:
+                continue
+            old = previous['seconds_per_operation']
+            new = result['seconds_per_operation']
+            change = new / old - 1 if old > 0 else 0.0
+            rows.append((size, name, old, new, change, change > tolerance))
+    return rows
+
+
+def save_json(path, report):
+    with open(path, mode='w') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        prog="Benchmark suite",
+        usage="python -m benchmarks.run [--sizes 1000,10000] [--save-baseline]",
+    )
+    parser.add_argument('--sizes', type=str, default='1000,10000',
+                        help='comma separated numbers of transactions of the synthetic chains')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', type=str, default='',
+                        help='comma separated names of the benchmarks to run')
+    parser.add_argument('--baseline', type=str, default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed slowdown per operation before failing (0.25 = 25%%)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.only.split(',') if name and name not in BENCHMARKS]
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(unknown)}')
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    report = run(sizes, args.repeat, [name for name in args.only.split(',') if name])
+    if args.output:
+        save_json(args.output, report)
+    if args.save_baseline:
+        save_json(args.baseline, report)
+        print(f'Saved the baseline to {args.baseline}.')
+        sys.exit(0)
+    if not os.path.exists(args.baseline):
+        print(f'No baseline found at {args.baseline}; run with --save-baseline to record one.')
+        sys.exit(0)
+    with open(args.baseline, mode='r') as f:
+        baseline = json.load(f)
+    if baseline.get('environment') != report['environment']:
+        print('Warning: the baseline was recorded in a different environment.')
+    rows = compare(report, baseline, args.tolerance)
+    print(f'{"size":>8}  {"benchmark":<26}{"baseline us/op":>16}{"current us/op":>16}{"change":>9}')
+    for size, name, old, new, change, regressed in rows:
+        print(f'{size:>8}  {name:<26}{old * 1e6:>16.3f}{new * 1e6:>16.3f}{change:>+9.0%}'
+              f'{"  REGRESSION" if regressed else ""}')
+    regressions = [row for row in rows if row[5]]
+    if regressions:
+        print(f'{len(regressions)} benchmark(s) regressed by more than {args.tolerance:.0%}.')
+        sys.exit(1)
+    print('No regressions.')
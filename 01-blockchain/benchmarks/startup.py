@@ -0,0 +1,196 @@
+""" Measures how quickly the app starts and compares the results with a stored baseline.
+
+Run from the `01-blockchain` directory:
+
+    python -m benchmarks.startup --save-baseline      # record the baseline of this machine
+    python -m benchmarks.startup                      # compare against it, exit 1 on regressions
+
+Three things are measured, each in fresh Python processes:
+
+* the import time of `node`, `node_console`, `blockchain` and `wallet`, as reported by
+  `python -X importtime` (the interpreter's own start-up is not included);
+* the time from starting `node.py` until it answers its first request (`GET /nodes`);
+* the time from starting `node_console.py` until it prompts for the first command,
+  which includes generating the keys of its wallet.
+
+Every measurement is repeated `--repeat` times and the best time is kept.
+"""
+import json
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser
+from collections import OrderedDict
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep
+from urllib.error import URLError
+from urllib.request import urlopen
+
+from benchmarks.run import DEFAULT_TOLERANCE, compare, environment, save_json
+
+# Directory of node.py and node_console.py
+NODE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Default file holding the baseline results
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'startup_baseline.json')
+
+# Modules whose import time is measured
+MEASURED_IMPORTS = ('node', 'node_console', 'blockchain', 'wallet')
+
+# Text of the first prompt of the console
+CONSOLE_PROMPT = b'Your choice'
+
+# Seconds a node or console may take to start before the measurement fails
+START_TIMEOUT = 30
+
+
+def import_times(module):
+    """ Import `module` in a new process with `-X importtime`.
+
+    Returns:
+        A tuple of the cumulative import time of `module` in seconds and a `dict`
+        mapping each module it imports directly to its cumulative import time.
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             cwd=NODE_DIRECTORY, stderr=subprocess.PIPE, check=True)
+    children = {}
+    for line in process.stderr.decode('utf-8').splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        # Nested imports are indented by two spaces per level and listed before their parent
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        seconds = int(cumulative) / 1e6
+        if level == 0:
+            if name.strip() == module:
+                return seconds, children
+            children = {}
+        elif level == 1:
+            children[name.strip()] = seconds
+    raise RuntimeError(f'No import time was reported for {module}.')
+
+
+def first_request_time(port):
+    """ Start a node and return the seconds until it answers `GET /nodes`. """
+    with TemporaryDirectory() as directory:
+        started = perf_counter()
+        node = subprocess.Popen([sys.executable, os.path.join(NODE_DIRECTORY, 'node.py'),
+                                 '-p', str(port)],
+                                cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while perf_counter() - started < START_TIMEOUT:
+                try:
+                    with urlopen(f'http://localhost:{port}/nodes', timeout=1) as response:
+                        if response.status == 200:
+                            return perf_counter() - started
+                except (URLError, ConnectionError):
+                    sleep(0.005)
+            raise RuntimeError(f'The node did not answer within {START_TIMEOUT} seconds.')
+        finally:
+            node.terminate()
+            node.wait()
+
+
+def console_prompt_time(port):
+    """ Start a console node and return the seconds until it prompts for a command. """
+    with TemporaryDirectory() as directory:
+        started = perf_counter()
+        console = subprocess.Popen(
+            [sys.executable, os.path.join(NODE_DIRECTORY, 'node_console.py'), '-p', str(port)],
+            cwd=directory, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, env=dict(os.environ, PYTHONUNBUFFERED='1'))
+        try:
+            output = b''
+            while CONSOLE_PROMPT not in output:
+                chunk = console.stdout.read1(4096)
+                if not chunk:
+                    raise RuntimeError('The console stopped before prompting for a command.')
+                output += chunk
+            elapsed = perf_counter() - started
+            console.communicate(b'q\n', timeout=START_TIMEOUT)
+            return elapsed
+        finally:
+            if console.poll() is None:
+                console.kill()
+                console.wait()
+
+
+def run(repeat=5, port=5098):
+    """ Run all measurements `repeat` times.
+
+    Returns:
+        A JSON-serializable `dict` in the format of `benchmarks.run.run`, with a single
+        `startup` group holding the best seconds of each measurement.
+    """
+    best = OrderedDict()
+
+    def record(name, seconds):
+        best[name] = min(best.get(name, seconds), seconds)
+
+    for _ in range(repeat):
+        for module in MEASURED_IMPORTS:
+            record(f'import_{module}', import_times(module)[0])
+        record('first_request', first_request_time(port))
+        record('console_prompt', console_prompt_time(port))
+    return {
+        'environment': environment(),
+        'repeat': repeat,
+        'results': {
+            'startup': OrderedDict(
+                (name, {'operations': 1, 'seconds': seconds, 'seconds_per_operation': seconds})
+                for name, seconds in best.items())
+        }
+    }
+
+
+def heaviest_imports(module, count=5):
+    """ Return the `count` modules imported directly by `module` that take the longest. """
+    children = import_times(module)[1]
+    return sorted(children.items(), key=lambda item: item[1], reverse=True)[:count]
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        prog="Startup benchmark",
+        usage="python -m benchmarks.startup [--repeat 5] [--save-baseline]",
+    )
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--port', type=int, default=5098,
+                        help='port of the nodes started by the benchmark')
+    parser.add_argument('--baseline', type=str, default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed slowdown before failing (0.25 = 25%%)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    report = run(args.repeat, args.port)
+    print(f'{"measurement":<24}{"ms":>10}')
+    for name, result in report['results']['startup'].items():
+        print(f'{name:<24}{result["seconds"] * 1e3:>10.1f}')
+    print('Heaviest imports of node: ' + ', '.join(
+        f'{name} {seconds * 1e3:.0f} ms' for name, seconds in heaviest_imports('node')))
+    if args.output:
+        save_json(args.output, report)
+    if args.save_baseline:
+        save_json(args.baseline, report)
+        print(f'Saved the baseline to {args.baseline}.')
+        sys.exit(0)
+    if not os.path.exists(args.baseline):
+        print(f'No baseline found at {args.baseline}; run with --save-baseline to record one.')
+        sys.exit(0)
+    with open(args.baseline, mode='r') as f:
+        baseline = json.load(f)
+    if baseline.get('environment') != report['environment']:
+        print('Warning: the baseline was recorded in a different environment.')
+    regressions = [row for row in compare(report, baseline, args.tolerance) if row[5]]
+    for _, name, old, new, change, _ in regressions:
+        print(f'{name} regressed: {old * 1e3:.1f} ms -> {new * 1e3:.1f} ms ({change:+.0%})')
+    if regressions:
+        print(f'{len(regressions)} measurement(s) regressed by more than {args.tolerance:.0%}.')
+        sys.exit(1)
+    print('No regressions.')
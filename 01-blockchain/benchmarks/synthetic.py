@@ -0,0 +1,62 @@
+""" Generators of synthetic signed transactions and valid chains for the benchmarks. """
+import random
+
+from block import Block
+from transaction import Transaction
+from utility.merkle import merkle_root
+from utility.mining import ProofOfWorkMiner
+from utility.verification import TARGET_BLOCK_TIME, Verification
+from wallet import Wallet
+
+# Reward of the MINING transaction closing every synthetic block
+MINING_REWARD = 10
+
+
+def make_wallets(count):
+    """ Create `count` wallets with fresh RSA keys. """
+    wallets = []
+    for _ in range(count):
+        wallet = Wallet(None)
+        wallet.create_keys()
+        wallets.append(wallet)
+    return wallets
+
+
+def make_transactions(count, wallets, seed=0, distinct=None):
+    """ Create `count` transactions signed by randomly picked `wallets`.
+
+    Signing is slow, so when `distinct` is given only that many transactions are signed
+    and repeated to reach `count` (each copy is a separate, validly signed object).
+    """
+    rng = random.Random(seed)
+    transactions = []
+    for index in range(count):
+        if distinct is not None and index >= distinct:
+            tx = transactions[index % distinct]
+            transactions.append(Transaction(tx.sender, tx.recipient, tx.signature, tx.amount))
+            continue
+        sender, recipient = rng.sample(wallets, 2)
+        amount = round(rng.uniform(0.01, 5), 2)
+        signature = sender.sign_transaction(sender.public_key, recipient.public_key, amount)
+        transactions.append(Transaction(sender.public_key, recipient.public_key, signature, amount))
+    return transactions
+
+
+def make_chain(transactions, wallets, block_size=100):
+    """ Build a valid chain (genesis block first) whose blocks hold `block_size` of the
+    given `transactions` each, followed by a MINING reward for one of the `wallets`.
+    Blocks are spaced `TARGET_BLOCK_TIME` apart, so the difficulty stays the same. """
+    chain = [Block(index=0, previous_hash='', transactions=[], proof=100, timestamp=0)]
+    miner = ProofOfWorkMiner(1)
+    for start in range(0, len(transactions), block_size):
+        reward = Transaction('MINING', wallets[len(chain) % len(wallets)].public_key, '',
+                             MINING_REWARD)
+        block_transactions = transactions[start:start + block_size] + [reward]
+        block = Block(len(chain), chain[-1].hash, block_transactions, 0,
+                      timestamp=1600000000 + len(chain) * TARGET_BLOCK_TIME,
+                      target=Verification.next_target(chain, len(chain)),
+                      merkle_root=merkle_root([tx.tx_id for tx in block_transactions]))
+        proof = miner.find_header_proof(block.header_prefix(), block.target)
+        chain.append(Block(block.index, block.previous_hash, block.transactions, proof,
+                           block.timestamp, block.target, block.merkle_root))
+    return chain
@@ -1,12 +1,27 @@
+import struct
 from time import time
 
+from transaction import Transaction
+from utility.hash_util import hash_block
 from utility.printable import Printable
 
+# Layout of the fixed-size header of blocks committing to their transactions through a
+# Merkle root: header version, index, previous hash, Merkle root, timestamp, target and
+# proof. The proof comes last so that miners hash the rest of the header only once.
+HEADER = struct.Struct('>IQ32s32sd32sQ')
+HEADER_VERSION = 2
+
 
 class Block(Printable):
     """ Represent each block in the blockchain. """
 
-    def __init__(self, index, previous_hash, transactions, proof, timestamp=None):
+    # Blocks are created in large numbers when a chain is loaded, so they keep their
+    # attributes in slots instead of a per-object `__dict__`
+    __slots__ = ('index', 'previous_hash', 'timestamp', 'transactions', 'proof', 'target',
+                 'merkle_root', '__hash')
+
+    def __init__(self, index, previous_hash, transactions, proof, timestamp=None, target=None,
+                 merkle_root=None):
         """
         Constructor.
 
@@ -21,18 +36,77 @@ class Block(Printable):
                 that suffices a condition defined by the creator(s) of the blockchain.
             timestamp (`float`, optional): The timestamp in seconds since the Epoch when the
                 block was added to the blockchain.
+            target (`int`, optional): The target the proof of work of the block had to meet
+                (see `Verification.next_target`). Blocks mined by older versions of the app
+                have none.
+            merkle_root (`str`, optional): The Merkle root of the ids of the transactions
+                (see `utility.merkle`). Blocks with a Merkle root are hashed and mined over
+                their fixed-size `header` only. Blocks mined by older versions have none.
         """
         self.index = index
         self.previous_hash = previous_hash
         self.timestamp = time() if timestamp is None else timestamp
         self.transactions = transactions
         self.proof = proof
+        self.target = target
+        self.merkle_root = merkle_root
+        self.__hash = None
+
+    @property
+    def hash(self):
+        """ The hash of the block. Blocks do not change once they are added to the
+        blockchain, so the hash is only calculated the first time it is needed. """
+        if self.__hash is None:
+            self.__hash = hash_block(self)
+        return self.__hash
+
+    def __pack_header(self, proof):
+        return HEADER.pack(HEADER_VERSION, self.index, bytes.fromhex(self.previous_hash),
+                           bytes.fromhex(self.merkle_root), float(self.timestamp),
+                           self.target.to_bytes(32, 'big'), proof)
+
+    def header(self):
+        """ Return the fixed-size binary header of a block with a Merkle root. Its
+        SHA256 is both the hash of the block and the hash checked by the proof of work. """
+        return self.__pack_header(self.proof)
+
+    def header_prefix(self):
+        """ Return the header without the proof at its end, which is what miners hash
+        before trying proofs. """
+        return self.__pack_header(0)[:-struct.calcsize('>Q')]
 
     def to_deep_dict(self):
         """ Convert the entire block object to a dictionary in which the `transactions` list
         is also an array of dictionaries. So this method could be seen as returning a deep copy
         of the block object as a dictionary. """
-        block = self.__dict__.copy()
+        block = self.to_dict()
         block['transactions'] = [tx.to_ordered_dict().copy()
-                                 for tx in block['transactions']]
+                                 for tx in self.transactions]
         return block
+
+    def to_dict(self):
+        """ Convert the block object into a JSON-serializable dictionary whose
+        transactions keep their signatures (unlike `to_deep_dict`). This is the form
+        used to store blocks and to send them to other nodes. """
+        return {
+            'index': self.index,
+            'previous_hash': self.previous_hash,
+            'timestamp': self.timestamp,
+            'transactions': [tx.to_dict() for tx in self.transactions],
+            'proof': self.proof,
+            'target': self.target,
+            'merkle_root': self.merkle_root
+        }
+
+    @classmethod
+    def from_dict(cls, block):
+        """ Create a block object from a dictionary made by `to_dict`. """
+        return cls(
+            block['index'],
+            block['previous_hash'],
+            [Transaction.from_dict(tx) for tx in block['transactions']],
+            block['proof'],
+            block['timestamp'],
+            block.get('target'),
+            block.get('merkle_root')
+        )
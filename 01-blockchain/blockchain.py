@@ -1,23 +1,56 @@
-import json
-import requests
+from collections import Counter
+from time import time
 
 from block import Block
+from codec import (BINARY_MIMETYPE, CodecError, decode_blocks, encode_block,
+                   encode_transaction, encode_transactions)
+from gossip import GOSSIP_TTL, TTL_HEADER, GossipRelay
+from ledger import Ledger
+from mempool import Mempool
+from metrics import metrics
+from peer_client import PeerClient
+from storage import DURABILITY_BATCHED, FLUSH_CHANGES, FLUSH_INTERVAL, ChainStorage
+from stored_chain import LIVE_BLOCKS, ChainView, SplicedChain, StoredChain
 from transaction import Transaction
-from utility.hash_util import hash_block
+from utility.merkle import merkle_proof, merkle_root
+from utility.mining import ProofOfWorkMiner
+from utility.rwlock import ReadWriteLock
 from utility.verification import Verification
 from wallet import Wallet
 
 # Number of coins rewarded for each mining
 MINING_REWARD = 10
+# Maximum number of block heights probed per request when locating a fork with a peer
+LOCATOR_PROBES = 16
+# Number of blocks added to the chain between two snapshots of the ledger
+SNAPSHOT_INTERVAL = 1000
+# Outcomes of adding a transaction (see `Blockchain.add_transaction` and
+# `Blockchain.add_transactions`)
+TX_ACCEPTED = 'accepted'
+TX_DUPLICATE = 'duplicate'
+TX_INVALID_SIGNATURE = 'invalid signature'
+TX_INSUFFICIENT_FUNDS = 'insufficient funds'
+TX_INVALID_AMOUNT = 'invalid amount'
+TX_INVALID_DATA = 'invalid data'
+TX_DECLINED = 'declined by a peer'
 
 
 class Blockchain:
     """ Represents the underlying blockchain.
 
+    A `Blockchain` can be shared by the threads of a multi-threaded server. Methods only
+    reading the state (the chain, the open transactions, balances and peer nodes) hold
+    the read side of `__lock` and run in parallel with each other. Methods changing the
+    state hold the write side, so changes are applied one at a time and never seen half
+    done. Slow work which does not touch the state, such as verifying signatures,
+    searching proofs of work and requests to peer nodes, runs outside of the lock.
+
     Attributes:
-        chain (`list` of `Block`): A list of `Block`s chained together to form
-            the blockchain.
-        __open_transactions (`list` of `Transaction`): A list of open `Transaction`s.
+        chain (`ChainView`): A read-only view of the `Block`s chained together to form
+            the blockchain. Internally the blocks are kept in a `StoredChain` which
+            keeps the last `live_blocks` blocks in memory and reads older blocks from
+            the block log on demand.
+        __open_transactions (`Mempool`): The open `Transaction`s keyed by their ids.
         public_key (`str`): The public key assigined to the `wallet` of the node
             owning this blockchain.
         __peer_nodes (`set` of `str`): `set` of `node URL`s of `Node`s that
@@ -26,122 +59,229 @@ class Blockchain:
             (equal to the `port` argument passed in when starting the app).
         resolve_conflicts (`bool`): False means there is no need to resolve blockchain
             conflicts. True means vice versa.
+        __ledger (`Ledger`): Running account totals kept in sync with the chain and
+            the open transactions so that balances are looked up in O(1).
+        __storage (`ChainStorage`): Persists blocks to an append-only log and the open
+            transactions and peer nodes to their own small files, which are written
+            in batches by a background thread unless `durability` is `always-fsync`.
+        __peer_client (`PeerClient`): Sends requests to the peer nodes, concurrently and
+            over reused connections when broadcasting.
+        miner (`ProofOfWorkMiner`): Searches proofs of work, on several CPU cores if
+            configured so, and reports the hash rate of the last search.
+        gossip (`GossipRelay`): Picks the peers new transactions and blocks are sent
+            to, and remembers the ids of the transactions and blocks already seen.
+        __verified_length (`int`): The number of blocks at the start of the chain that
+            were already checked by `verify_chain`.
+        __snapshot_height (`int`): The number of blocks accounted for by the newest
+            snapshot of the ledger. A snapshot is saved every `SNAPSHOT_INTERVAL` blocks
+            and when the blockchain is closed, so loading the blockchain only replays
+            the blocks added after it.
+        __live_blocks (`int`): The number of blocks at the tip of the chain kept in memory.
+        __lock (`ReadWriteLock`): Guards all of the above against concurrent changes.
     """
 
-    def __init__(self, public_key, node_id):
-        # Genesis block
-        # Note that, for the genesis block, proof can be initialized with any value
-        genesis_block = Block(index=0, previous_hash='',
-                              transactions=[], proof=100, timestamp=0)
-        # Initialize a blockchain as a list
-        self.chain = [genesis_block]
+    def __init__(self, public_key, node_id, mining_workers=1, durability=DURABILITY_BATCHED,
+                 flush_interval=FLUSH_INTERVAL, flush_changes=FLUSH_CHANGES,
+                 live_blocks=LIVE_BLOCKS, gossip_fanout=0, gossip_ttl=GOSSIP_TTL):
         # Unhandled transactions
-        self.__open_transactions = []
+        self.__open_transactions = Mempool()
         self.public_key = public_key
         self.__peer_nodes = set()
         self.node_id = node_id
         self.resolve_conflicts = False
+        self.__ledger = Ledger()
+        self.__storage = ChainStorage(node_id, durability, flush_interval, flush_changes)
+        self.__peer_client = PeerClient()
+        self.miner = ProofOfWorkMiner(mining_workers)
+        self.gossip = GossipRelay(gossip_fanout, gossip_ttl)
+        self.__verified_length = 0
+        self.__snapshot_height = 0
+        self.__live_blocks = live_blocks
+        self.__lock = ReadWriteLock()
         self.load_data()
 
     @property
     def chain(self):
-        """ Returns a copy of the list of blocks. Should only
-        use outside of the `Blockchain` class. """
-        return self.__chain[:]
+        """ Returns a read-only view of the blocks, which reads them on demand rather
+        than copying the chain. Should only use outside of the `Blockchain` class. """
+        return ChainView(self.__chain, self.__lock)
 
-    @chain.setter
-    def chain(self, val):
-        self.__chain = val
+    def get_length(self):
+        """ Returns the number of blocks in the blockchain. """
+        with self.__lock.read():
+            return len(self.__chain)
 
     def get_open_transactions(self):
         """ Returns a copy of the list of open transactions. """
-        return self.__open_transactions[:]
+        with self.__lock.read():
+            return self.__open_transactions.get_transactions()
 
     def load_data(self):
-        """ Loads and populates app data from file in hard disk. """
-        try:
-            with open(f'blockchain-{self.node_id}.txt', mode='r') as f:
-                file_content = f.readlines()
-                # eliminate the \n' at the end of line by using [:-1]
-                blockchain = json.loads(file_content[0][:-1])
-                open_transactions = json.loads(file_content[1][:-1])
-
-                updated_blockchain = []
-                for block in blockchain:
-                    updated_block = Block(
-                        block['index'],
-                        block['previous_hash'],
-                        [Transaction(tx['sender'], tx['recipient'], tx['signature'], tx['amount'])
-                         for tx in block['transactions']],
-                        block['proof'],
-                        block['timestamp']
-                    )
-                    updated_blockchain.append(updated_block)
-                self.__chain = updated_blockchain
-
-                updated_transactions = []
-                for tx in open_transactions:
-                    updated_transaction = Transaction(
-                        tx['sender'], tx['recipient'], tx['signature'], tx['amount'])
-                    updated_transactions.append(updated_transaction)
-                self.__open_transactions = updated_transactions
-
-                peer_nodes = json.loads(file_content[2])
-                self.__peer_nodes = set(peer_nodes)
-        except (IOError, IndexError):
-            pass
-        finally:
-            print('Clean up.')
-
-    def save_data(self):
-        """ Saves current app data into a file that will persist in the hard disk.
-
-        The data is saved in the form of separate line of JSONs
+        """ Loads and populates app data from the storage in hard disk. """
+        with self.__lock.write():
+            self.__load_data()
+
+    def __load_data(self):
+        open_transactions, height, peer_nodes = self.__storage.load()
+        self.__chain = StoredChain(self.__storage, self.__live_blocks)
+        if len(self.__chain) == 0:
+            # A brand new node: the genesis block starts the block log
+            # Note that, for the genesis block, proof can be initialized with any value
+            genesis_block = Block(index=0, previous_hash='',
+                                  transactions=[], proof=100, timestamp=0)
+            self.__chain.append(genesis_block)
+        self.__peer_nodes = set(peer_nodes)
+        self.__verified_length = 0
+        self.__snapshot_height = self.__restore_snapshot()
+        for block in self.__chain.iter_blocks(self.__snapshot_height):
+            self.__ledger.apply_block(block)
+        # Open transactions are written after the blocks, so a crash can leave behind
+        # transactions that were mined in the blocks saved after them
+        confirmed = Counter()
+        if height is not None:
+            confirmed.update(tx.tx_id for block in self.__chain.iter_blocks(height)
+                             for tx in block.transactions)
+        candidates = []
+        for tx in open_transactions:
+            try:
+                tx = Transaction.from_dict(tx)
+            except (KeyError, TypeError):
+                continue
+            if Verification.valid_fields(tx) and Verification.valid_amount(tx.amount):
+                candidates.append(tx)
+        # The saved copies of a repeated payment were all accepted
+        self.__reopen_transactions(candidates, confirmed, repeats=True)
+
+    def __reopen_transactions(self, candidates, confirmed, repeats):
+        """ Makes the given transactions the open transactions, except for the copies
+        confirmed by blocks and the ones their senders cannot afford.
+
+        Arguments:
+            candidates (:obj:`list` of `Transaction`s): The transactions, oldest first.
+            confirmed (`Counter` of `str`): How many copies of each transaction id are in
+                blocks already; that many copies are left out.
+            repeats (`bool`): Whether every copy of a transaction is kept, or only the
+                copies of payments of this node (another transaction may e.g. have come
+                back from a peer after it was mined).
+
+        Must be called holding the write side of `__lock`.
         """
-        try:
-            with open(f'blockchain-{self.node_id}.txt', mode='w') as f:
-                # Method 1: use the to_deep_dict() to convert each block to a form
-                # that can be dumped as JSON
-                # saveable_chain = [block.to_deep_dict() for block in blockchain]
-                # Method 2: use nested listcomp like below
-                saveable_chain = [block.__dict__ for block in
-                                  [Block(
-                                      block_el.index,
-                                      block_el.previous_hash,
-                                      [tx.__dict__ for tx in block_el.transactions],
-                                      block_el.proof,
-                                      block_el.timestamp)
-                                   for block_el in self.__chain]
-                                  ]
-                f.write(json.dumps(saveable_chain))
-                f.write('\n')
-                saveable_tx = [tx.__dict__ for tx in self.__open_transactions]
-                f.write(json.dumps(saveable_tx))
-                f.write('\n')
-                f.write(json.dumps(list(self.__peer_nodes)))
-        except IOError:
-            print('Saving app data failed.')
-
-    def proof_of_work(self):
+        self.__open_transactions = Mempool()
+        self.__ledger.clear_open_transactions()
+        for tx in candidates:
+            if confirmed[tx.tx_id] > 0:
+                confirmed[tx.tx_id] -= 1
+                continue
+            if (self.__ledger.get_balance(tx.sender) >= tx.amount and
+                    self.__open_transactions.add(tx, repeat=repeats or tx.sender == self.public_key)):
+                self.__ledger.add_open_transaction(tx)
+
+    def __restore_snapshot(self):
+        """ Restores the ledger and the verified length from the newest snapshot which
+        still matches the chain (its last block is in the chain).
+
+        Returns:
+            The number of blocks the restored snapshot accounts for, 0 if none matched
+            (the ledger is then empty).
+        """
+        for height, snapshot in self.__storage.load_snapshots():
+            try:
+                if not 0 < height <= len(self.__chain):
+                    continue
+                if self.__chain[height - 1].hash != snapshot['tip_hash']:
+                    continue
+                self.__ledger.restore(snapshot['ledger'])
+                self.__verified_length = min(int(snapshot['verified_length']), height)
+                return height
+            except (IOError, KeyError, TypeError, ValueError):
+                continue
+        self.__ledger.rebuild([], [])
+        return 0
+
+    def __save_snapshot(self):
+        """ Saves a snapshot of the ledger and the verified length at the current tip.
+        Must be called holding the write side of `__lock`. """
+        height = len(self.__chain)
+        self.__storage.save_snapshot(height, {
+            'height': height,
+            'tip_hash': self.__chain[-1].hash,
+            'verified_length': self.__verified_length,
+            'ledger': self.__ledger.snapshot()
+        })
+        self.__snapshot_height = height
+
+    def __chain_grown(self):
+        """ Saves a snapshot if `SNAPSHOT_INTERVAL` blocks were added since the last one.
+        Must be called holding the write side of `__lock`. """
+        if len(self.__chain) - self.__snapshot_height >= SNAPSHOT_INTERVAL:
+            self.__save_snapshot()
+
+    def close(self):
+        """ Saves a snapshot of the ledger, writes the changes still queued for the hard
+        disk and releases the storage. """
+        with self.__lock.write():
+            if len(self.__chain) != self.__snapshot_height:
+                self.__save_snapshot()
+            self.__storage.close()
+
+    def verify_chain(self, full=False):
+        """ Checks the integrity of the blockchain.
+
+        Only the blocks added since the last successful verification are checked,
+        unless `full` is True.
+
+        Returns:
+            True if the blockchain is valid, False otherwise.
+        """
+        with self.__lock.read():
+            start = 0 if full else self.__verified_length
+            length = len(self.__chain)
+            tip_hash = self.__chain[-1].hash
+            if not Verification.verify_chain(self.__chain, start):
+                return False
+        # Readers may verify at the same time, so the result is recorded with the write
+        # side held, unless the chain was replaced meanwhile
+        with self.__lock.write():
+            if length <= len(self.__chain) and self.__chain[length - 1].hash == tip_hash:
+                self.__verified_length = max(self.__verified_length, length)
+        return True
+
+    def save_open_transactions(self):
+        """ Saves the current open transactions into the hard disk. """
+        with self.__lock.write():
+            self.__storage.save_open_transactions(
+                self.__open_transactions.get_transactions(), len(self.__chain))
+
+    def save_peer_nodes(self):
+        """ Saves the current set of peer nodes into the hard disk. """
+        with self.__lock.write():
+            self.__storage.save_peer_nodes(list(self.__peer_nodes))
+
+    def proof_of_work(self, block):
         """ Finds a 'proof-of-work' number for a newly being mined block.
 
-        A 'proof-of-work' makes the hash of
-        current open transactions,
-        hash of the last block,
-        and this proof of work number itself
+        A 'proof-of-work' makes the hash of the block header, which holds
+        the hash of the last block,
+        the Merkle root of the block's transactions (including the MINING reward),
+        the target
+        and this proof of work number itself,
         satify the difficulty criteria.
         This 'proof-of-work' is then added to the new block to be mined. This hash value
         helps secure the blockchain from any cheat of modifying the previous blocks'
         :previous_hash: and/or :transactions:.
 
+        Arguments:
+            block (`Block`): The block to be mined, complete except for its proof.
+
         Returns:
             The found proof of work number
         """
-        last_block = self.__chain[-1]
-        last_hash = hash_block(last_block)
-        proof = 0
-        while not Verification.valid_proof(self.__open_transactions, last_hash, proof):
-            proof += 1
+        with metrics.timer('proof_of_work_seconds'):
+            proof = self.miner.find_header_proof(block.header_prefix(), block.target)
+        metrics.inc('proof_of_work_hashes_total', self.miner.last_hashes)
+        metrics.set('mining_hash_rate', self.miner.last_hash_rate)
+        print(f'Found proof {proof} after {self.miner.last_hashes} hashes '
+              f'({self.miner.last_hash_rate:,.0f} hashes/s on {self.miner.workers} worker(s)).')
         return proof
 
     def get_balance(self, sender=None):
@@ -164,29 +304,17 @@ class Blockchain:
             participant = self.public_key
         else:
             participant = sender
-        # Amounts sent in the past (already mined and put in blockchain blocks)
-        tx_sender = [[tx.amount for tx in block.transactions if tx.sender ==
-                      participant] for block in self.__chain]
-        # Amounts will be sent in the future (saved in the open_transactions)
-        open_tx_sender = [
-            tx.amount for tx in self.__open_transactions if tx.sender == participant]
-        tx_sender.append(open_tx_sender)
-        # Amounts received in the past (already finalized and put in blockchain blocks)
-        tx_recipient = [[tx.amount for tx in block.transactions if tx.recipient ==
-                         participant] for block in self.__chain]
-        # Note that amounts from MINING_REWARD will only be available when a mining is done
-
-        # Calculate the balance by flattening the 2 lists of lists,
-        # then sum up elements in the flatten lists
-        return sum([el for row in tx_recipient for el in row]) - sum([el for row in tx_sender for el in row])
+        with self.__lock.read():
+            return self.__ledger.get_balance(participant)
 
     def get_last_blockchain_value(self):
         """ Gets the last block value from the blockchain. """
-        if len(self.__chain) < 1:
-            return None
-        return self.__chain[-1]
+        with self.__lock.read():
+            if len(self.__chain) < 1:
+                return None
+            return self.__chain[-1]
 
-    def add_transaction(self, sender, recipient, signature, amount=1.0, is_receiving=False):
+    def add_transaction(self, sender, recipient, signature, amount=1.0, is_receiving=False, ttl=0):
         """ Appends a new transaction value as well as the last blockchain value
             to the blockchain.
 
@@ -197,105 +325,428 @@ class Blockchain:
             amount (`float` default = 1.0): The amount of coins sent with the transaction.
             is_receiving (`bool`): Flag indicating whether the transaction to be added
                 is received from broadcast.
+            ttl (`int`, default to 0): The time to live the received transaction came
+                with, i.e. how many more hops it may be relayed in gossip mode.
 
         Returns:
-            True if the transaction was add successfully, False otherwise.
+            The outcome: `TX_ACCEPTED`, `TX_DECLINED` (opened, but a peer node declined
+            it), `TX_DUPLICATE` (already open or seen, e.g. the same broadcast arrived
+            twice), `TX_INVALID_DATA`, `TX_INVALID_AMOUNT`, `TX_INVALID_SIGNATURE` or
+            `TX_INSUFFICIENT_FUNDS` (see `add_transactions`).
         """
         # if self.public_key == None:
         #     return False
         transaction = Transaction(sender, recipient, signature, amount)
-        if Verification.verify_transaction(transaction, self.get_balance):
-            self.__open_transactions.append(transaction)
-            self.save_data()
-            if not is_receiving:
-                for node in self.__peer_nodes:
-                    url = f'http://{node}/broadcast-transaction'
-                    try:
-                        response = requests.post(
-                            url, json=transaction.__dict__)
-                        if response.status_code == 400 or response.status_code == 500:
-                            print('Transaction declined, needs resolving')
-                            return False
-                    except requests.exceptions.ConnectionError:
-                        continue
+        if not Verification.valid_fields(transaction):
+            return TX_INVALID_DATA
+        if not Verification.valid_amount(transaction.amount):
+            return TX_INVALID_AMOUNT
+        # The signature is checked before taking the lock, the funds with it held
+        if not Verification.verify_transaction(transaction, self.get_balance, check_funds=False):
+            return TX_INVALID_SIGNATURE
+        with self.__lock.write():
+            if self.__is_known(transaction, is_receiving):
+                return TX_DUPLICATE
+            if self.__ledger.get_balance(transaction.sender) < transaction.amount:
+                return TX_INSUFFICIENT_FUNDS
+            self.__open_transactions.add(transaction, repeat=True)
+            self.__ledger.add_open_transaction(transaction)
+            self.gossip.see(transaction.tx_id)
+            self.save_open_transactions()
+            peer_nodes = list(self.__peer_nodes)
+        statuses = self.__send(peer_nodes, '/broadcast-transaction', transaction.to_dict(),
+                               encode_transaction(transaction), ttl if is_receiving else None)
+        if any(status == 400 or status == 500 for status in statuses.values()):
+            print('Transaction declined, needs resolving')
+            return TX_DECLINED
+        return TX_ACCEPTED
+
+    def add_transactions(self, transactions, is_receiving=False, ttl=0):
+        """ Adds a batch of transactions to the open transactions.
+
+        The signatures are verified together (in parallel for large batches), then each
+        transaction is checked against the balance of its sender, which includes the
+        transactions accepted before it in the batch. The open transactions are saved
+        once, and the accepted transactions are sent to the peer nodes in one message.
+
+        Arguments:
+            transactions (:obj:`list` of `Transaction`s): The signed transactions.
+            is_receiving (`bool`): Flag indicating whether the transactions to be added
+                are received from broadcast.
+            ttl (`int`, default to 0): The time to live the received transactions came
+                with, i.e. how many more hops they may be relayed in gossip mode.
+
+        Returns:
+            A list with the outcome of each transaction: `TX_ACCEPTED`, `TX_DUPLICATE`
+            (already open, e.g. the same broadcast arrived twice), `TX_INVALID_DATA` (the
+            sender, recipient or signature is not a string), `TX_INVALID_AMOUNT` (not a
+            positive number of coins the chain can hold), `TX_INVALID_SIGNATURE`
+            or `TX_INSUFFICIENT_FUNDS`.
+        """
+        valid_signatures = Wallet.verify_each(transactions)
+        results = []
+        accepted = []
+        with self.__lock.write():
+            for transaction, valid_signature in zip(transactions, valid_signatures):
+                if self.__is_known(transaction, is_receiving):
+                    results.append(TX_DUPLICATE)
+                elif not Verification.valid_fields(transaction):
+                    results.append(TX_INVALID_DATA)
+                elif not Verification.valid_amount(transaction.amount):
+                    results.append(TX_INVALID_AMOUNT)
+                elif not valid_signature:
+                    results.append(TX_INVALID_SIGNATURE)
+                elif self.__ledger.get_balance(transaction.sender) < transaction.amount:
+                    results.append(TX_INSUFFICIENT_FUNDS)
+                else:
+                    self.__open_transactions.add(transaction, repeat=True)
+                    self.__ledger.add_open_transaction(transaction)
+                    self.gossip.see(transaction.tx_id)
+                    accepted.append(transaction)
+                    results.append(TX_ACCEPTED)
+            if accepted:
+                self.save_open_transactions()
+            peer_nodes = list(self.__peer_nodes)
+        if accepted:
+            statuses = self.__send(
+                peer_nodes, '/broadcast-transactions',
+                {'transactions': [tx.to_dict() for tx in accepted]},
+                encode_transactions(accepted), ttl if is_receiving else None)
+            if any(status == 400 or status == 500 for status in statuses.values()):
+                print('Transactions declined, needs resolving')
+        return results
+
+    def __is_known(self, transaction, is_receiving):
+        """ Whether a transaction is open already or, when it was relayed in gossip mode,
+        was seen before (e.g. it arrives again through another path after being mined).
+
+        Signatures are deterministic, so paying the same amount to the same recipient
+        again gives the same transaction id. A payment of this node's wallet which is not
+        received from a peer is therefore never known: it is a new payment. """
+        if not is_receiving and transaction.sender == self.public_key:
+            return False
+        if transaction.tx_id in self.__open_transactions:
             return True
-        return False
+        return is_receiving and self.gossip.enabled and self.gossip.has_seen(transaction.tx_id)
 
     def mine_block(self):
         """ Puts all open transactions into a new block then chains that block into the blockchain.
 
+        The proof of work is searched without holding the lock, so the node keeps serving
+        requests meanwhile. If another block was added to the chain in the meantime, the
+        mined block is dropped.
+
         Returns:
             The `Block` mined if the whole process of mining block was successful, None otherwise.
         """
         if self.public_key == None:
             return None
-        last_block = self.__chain[-1]
-        hashed_block = hash_block(last_block)
-        proof = self.proof_of_work()
-        # The mining transaction is not signed (pass in signature as empty str)
+        with self.__lock.read():
+            hashed_block = self.__chain[-1].hash
+            copied_transactions = self.__open_transactions.get_transactions()
+            index = len(self.__chain)
+            target = Verification.next_target(self.__chain, index)
+            median_time = Verification.median_time_past(self.__chain, index)
+        # The mining transaction is not signed (pass in signature as empty str). It is
+        # part of the Merkle root, so it is created before the proof of work.
         reward_transaction = Transaction(
             'MINING', self.public_key, '', MINING_REWARD)
-        copied_transactions = self.__open_transactions[:]
-        for tx in copied_transactions:
-            if not Wallet.verify_transaction(tx):
-                return None
+        if not Wallet.verify_transactions(copied_transactions):
+            return None
         copied_transactions.append(reward_transaction)
-        block = Block(len(self.__chain), hashed_block,
-                      copied_transactions, proof)
-        self.__chain.append(block)
-        self.__open_transactions = []
-        self.save_data()
+        root = merkle_root([tx.tx_id for tx in copied_transactions])
+        # A clock running behind the miners of the last blocks still gives a valid timestamp
+        timestamp = max(time(), median_time + 0.001)
+        candidate = Block(index, hashed_block, copied_transactions, 0, timestamp, target, root)
+        proof = self.proof_of_work(candidate)
+        block = Block(index, hashed_block, copied_transactions, proof, timestamp, target, root)
+        with self.__lock.write():
+            if len(self.__chain) != index or self.__chain[-1].hash != hashed_block:
+                print('The blockchain changed while mining, the mined block is dropped.')
+                return None
+            if not self.__chain.append(block):
+                return None
+            self.__ledger.apply_block(block)
+            self.gossip.see(block.hash)
+            self.__chain_grown()
+            # Transactions which arrived while mining stay open for the next block
+            for tx in copied_transactions:
+                removed = self.__open_transactions.remove(tx.tx_id)
+                if removed is not None:
+                    self.__ledger.remove_open_transaction(removed)
+            self.save_open_transactions()
+            peer_nodes = list(self.__peer_nodes)
         # Broadcasting the newly added block to other nodes
-        for node in self.__peer_nodes:
-            url = f'http://{node}/broadcast-block'
-            converted_block = block.__dict__.copy()
-            converted_block['transactions'] = [
-                tx.__dict__ for tx in converted_block['transactions']]
-            try:
-                response = requests.post(url, json={'block': converted_block})
-                if response.status_code == 400 or response.status_code == 500:
-                    print('Block declined, needs resolving.')
-                if response.status_code == 409:
-                    self.resolve_conflicts = True
-            except requests.exceptions.ConnectionError:
-                continue
+        statuses = self.__send(
+            peer_nodes, '/broadcast-block', {'block': block.to_dict()}, encode_block(block))
+        for status in statuses.values():
+            if status == 400 or status == 500:
+                print('Block declined, needs resolving.')
+            if status == 409:
+                self.resolve_conflicts = True
         return block
 
-    def add_block(self, block):
+    def add_block(self, block, ttl=0):
         """ Adds a new block received from block broadcasting to the blockchain.
 
         Arguments:
             block (`dict`): The JSON format block to be added.
+            ttl (`int`, default to 0): The time to live the block came with, i.e. how
+                many more hops it may be relayed in gossip mode.
 
         Returns:
             True if adding the block succeeds, False otherwise.
         """
-        transactions = [Transaction(
-            tx['sender'], tx['recipient'], tx['signature'], tx['amount'])
-            for tx in block['transactions']]
-        # Note that we exclude the last transaction (which is the MINING reward)
-        # when verify the proof-of-work
-        proof_is_valid = Verification.valid_proof(
-            transactions[:-1], block['previous_hash'], block['proof'])
-        hashes_match = hash_block(self.chain[-1]) == block['previous_hash']
-        if not proof_is_valid or not hashes_match:
+        converted_block = Block.from_dict(block)
+        transactions = converted_block.transactions
+        # As in `resolve`, the signatures are verified before taking the lock. The last
+        # transaction is the unsigned MINING reward.
+        if not Wallet.verify_transactions(transactions[:-1]):
+            return False
+        with self.__lock.write():
+            # Checks the previous hash, the claimed target and the proof-of-work (which
+            # excludes the last transaction, the MINING reward)
+            if not Verification.verify_block(self.__chain, converted_block, len(self.__chain)):
+                return False
+            if not self.__chain.append(converted_block):
+                return False
+            self.__ledger.apply_block(converted_block)
+            self.gossip.see(converted_block.hash)
+            self.__chain_grown()
+            # Update open transactions on the peer node when a new broadcast block is added
+            for tx in transactions:
+                removed = self.__open_transactions.remove(tx.tx_id)
+                if removed is not None:
+                    self.__ledger.remove_open_transaction(removed)
+            self.save_open_transactions()
+            peer_nodes = list(self.__peer_nodes)
+        self.__send(peer_nodes, '/broadcast-block', {'block': converted_block.to_dict()},
+                    encode_block(converted_block), ttl)
+        return True
+
+    def __send(self, peer_nodes, path, payload, data, ttl=None):
+        """ Sends a new transaction or block to the peers picked by `gossip`.
+
+        Messages created by this node are sent with `PeerClient.broadcast`, which waits
+        for the answers. Messages received from a peer are relayed in the background.
+
+        Arguments:
+            peer_nodes (`list` of `str`): The peers of this node.
+            path (`str`): The path of the endpoint to call on each peer.
+            payload (`dict`): The JSON form of the message.
+            data (`bytes`): The binary form of the message.
+            ttl (`int`, optional): The time to live the message was received with, or
+                None if the message was created by this node.
+
+        Returns:
+            A `dict` mapping each peer to the HTTP status code of its response, empty
+            for relayed messages.
+        """
+        nodes, remaining = self.gossip.targets(peer_nodes, ttl)
+        if not nodes:
+            return {}
+        headers = {TTL_HEADER: str(remaining)} if remaining is not None else None
+        if ttl is None:
+            return self.__peer_client.broadcast(nodes, path, payload, data, headers)
+        self.__peer_client.relay(nodes, path, payload, data, headers)
+        return {}
+
+    def get_merkle_proof(self, tx_id, height=None):
+        """ Builds the proof that a transaction is included in a block of the blockchain.
+
+        Arguments:
+            tx_id (`str`): The id of the transaction.
+            height (`int`, optional): The index of the block holding the transaction.
+                Without it the blocks are searched from the newest to the oldest.
+
+        Returns:
+            A `dict` with the index, the hash, the header and the Merkle root of the block and
+            the inclusion proof made by `utility.merkle.merkle_proof`, or None if no block with
+            a Merkle root holds the transaction.
+        """
+        with self.__lock.read():
+            length = len(self.__chain)
+            if height is None:
+                heights = range(length - 1, 0, -1)
+            elif 0 <= height < length:
+                heights = [height]
+            else:
+                return None
+            for height in heights:
+                block = self.__chain[height]
+                if block.merkle_root is None:
+                    # Older blocks do not commit to their transactions through a Merkle root
+                    continue
+                tx_ids = [tx.tx_id for tx in block.transactions]
+                if tx_id in tx_ids:
+                    return {
+                        'tx_id': tx_id,
+                        'block_index': block.index,
+                        'block_hash': block.hash,
+                        'header': block.header().hex(),
+                        'merkle_root': block.merkle_root,
+                        'proof': merkle_proof(tx_ids, tx_ids.index(tx_id))
+                    }
+            return None
+
+    def get_block_hashes(self, heights):
+        """ Returns a `dict` mapping each of the given block `heights` (indexes) that exists
+        in the blockchain to the hash of the block at that height. """
+        with self.__lock.read():
+            length = len(self.__chain)
+            return {height: self.__chain[height].hash for height in heights if 0 <= height < length}
+
+    def __request_hashes(self, node, heights):
+        """ Asks a peer node for the hashes of its blocks at the given heights.
+
+        Returns:
+            A tuple of the length of the peer's chain and a `dict` mapping heights to
+            hashes, or None if the peer could not answer or sent a malformed answer.
+        """
+        response = self.__peer_client.get(
+            node, '/chain/hashes', params={'heights': ','.join(str(height) for height in heights)})
+        if response is None or response.status_code != 200:
+            return None
+        try:
+            values = response.json()
+            return int(values['length']), {int(height): block_hash
+                                           for height, block_hash in values['hashes'].items()}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            print(f'Invalid block hashes received from {node}.')
+            return None
+
+    def __locate_fork(self, node, min_length):
+        """ Finds the last block the local chain shares with the chain of a peer node.
+
+        The peer is first asked for the hashes at exponentially spaced heights below the
+        local tip (tip, tip - 1, tip - 3, tip - 7, ..., 0), which brackets the fork point
+        within a gap no larger than the divergence. That gap is then narrowed with up to
+        `LOCATOR_PROBES` evenly spaced heights per round trip.
+
+        Arguments:
+            node (`str`): The URL of the peer node.
+            min_length (`int`): Peers whose chain is not longer than this are ignored.
+
+        Returns:
+            The height of the last shared block, or None if the peer is unreachable,
+            its chain is not longer than `min_length` or does not share the genesis block.
+        """
+        local_length = self.get_length()
+        heights = []
+        height = local_length - 1
+        step = 1
+        while height > 0:
+            heights.append(height)
+            height -= step
+            step *= 2
+        heights.append(0)
+        answer = self.__request_hashes(node, heights)
+        if answer is None or answer[0] <= min_length:
+            return None
+        hashes = answer[1]
+        # The local chain may change meanwhile; `resolve` checks the result with the lock held
+        local_hashes = self.get_block_hashes(heights)
+        # `shared` is known to be in both chains, `diverged` is the first height known not to be
+        shared = None
+        diverged = local_length
+        for height in heights:
+            if height in local_hashes and hashes.get(height) == local_hashes[height]:
+                shared = height
+                break
+            diverged = height
+        if shared is None:
+            return None
+        while diverged - shared > 1:
+            gap = diverged - shared - 1
+            count = min(gap, LOCATOR_PROBES)
+            probes = sorted({shared + 1 + (gap * i) // count for i in range(count)})
+            answer = self.__request_hashes(node, probes)
+            if answer is None:
+                return None
+            hashes = answer[1]
+            local_hashes = self.get_block_hashes(probes)
+            for height in probes:
+                if height not in local_hashes or hashes.get(height) != local_hashes[height]:
+                    diverged = height
+                    break
+                shared = height
+        return shared
+
+    def __fetch_divergent_blocks(self, node, fork_height):
+        """ Downloads and validates the blocks of a peer node after `fork_height`.
+
+        Returns:
+            The list of validated `Block`s, or None if they could not be fetched or
+            do not form a valid continuation of the local block at `fork_height`.
+        """
+        response = self.__peer_client.get(
+            node, '/chain', params={'start': fork_height + 1},
+            headers={'Accept': f'{BINARY_MIMETYPE}, application/json;q=0.5'})
+        if response is None or response.status_code != 200:
+            print(f'Error while fetching the blocks of {node} to resolve blockchain conflicts...')
+            return None
+        try:
+            if response.headers.get('Content-Type', '').startswith(BINARY_MIMETYPE):
+                blocks = decode_blocks(response.content)
+            else:
+                blocks = [Block.from_dict(block) for block in response.json()]
+        except (CodecError, ValueError, KeyError, TypeError):
+            print(f'Invalid blocks received from {node}.')
+            return None
+        if any(block.index != fork_height + 1 + offset for offset, block in enumerate(blocks)):
+            return None
+        # The signatures are verified before taking the lock, which only covers checking
+        # the blocks against the local chain. The last transaction of each block is the
+        # unsigned MINING reward.
+        if not Wallet.verify_transactions([tx for block in blocks for tx in block.transactions[:-1]]):
+            return None
+        with self.__lock.read():
+            if fork_height >= len(self.__chain):
+                return None
+            candidate_chain = SplicedChain(self.__chain, fork_height + 1, blocks)
+            if not Verification.verify_chain(candidate_chain, start=fork_height + 1):
+                return None
+        return blocks
+
+    def __replace_blocks(self, fork_height, blocks):
+        """ Rolls the chain back to the block at `fork_height` and appends `blocks`.
+
+        Open transactions confirmed by the new blocks are dropped. Signed transactions of
+        the rolled back blocks which the new blocks do not contain are put back into the
+        open transactions, as long as their signatures are valid and their senders can
+        still afford them.
+
+        Must be called holding the write side of `__lock`.
+
+        Returns:
+            True if the chain was replaced, False if saving the new blocks failed (the
+            rolled back blocks are then saved again).
+        """
+        removed_blocks = self.__chain[fork_height + 1:]
+        for block in reversed(removed_blocks):
+            self.__ledger.revert_block(block)
+        self.__chain.truncate(fork_height + 1)
+        self.__snapshot_height = min(self.__snapshot_height, fork_height + 1)
+        if not self.__chain.extend(blocks):
+            self.__chain.extend(removed_blocks)
+            for block in removed_blocks:
+                self.__ledger.apply_block(block)
             return False
-        converted_block = Block(
-            block['index'], block['previous_hash'], transactions, block['proof'], block['timestamp'])
-        self.__chain.append(converted_block)
-        # Update open transactions on the peer node when a new broadcast block is added
-        stored_transactions = self.__open_transactions[:]
-        for itx in block['transactions']:
-            for opentx in stored_transactions:
-                if (opentx.sender == itx['sender'] and
-                    opentx.recipient == itx['recipient'] and
-                    opentx.amount == itx['amount'] and
-                        opentx.signature == itx['signature']):
-                    try:
-                        self.__open_transactions.remove(opentx)
-                    except ValueError:
-                        print('Transaction was already removed.')
-        self.save_data()
+        for block in blocks:
+            self.__ledger.apply_block(block)
+        self.__verified_length = min(self.__verified_length, fork_height + 1)
+        self.__chain_grown()
+
+        confirmed = Counter(tx.tx_id for block in blocks for tx in block.transactions)
+        removed = [tx for block in removed_blocks for tx in block.transactions[:-1]
+                   if tx.tx_id not in confirmed]
+        # A forged transaction in the open transactions would make every mined block
+        # invalid, and the blocks of the chain were not all checked for them (e.g. blocks
+        # saved by older versions)
+        candidates = [tx for tx, valid in zip(removed, Wallet.verify_each(removed)) if valid]
+        candidates.extend(self.__open_transactions)
+        self.__reopen_transactions(candidates, confirmed, repeats=False)
+        self.save_open_transactions()
         return True
 
     def resolve(self):
@@ -305,37 +756,34 @@ class Blockchain:
         The rule for resolving conflicts is:
             (1) Letting the longest valid blockchain win by replacing the current blockchain
             with that winner one.
+
+        Only the blocks after the last block shared with a peer are downloaded, validated
+        and replaced, so the cost grows with the divergence rather than the chain length.
+        Peers are queried without holding the lock; the winning blocks are only applied if
+        they still extend the local chain at that point.
+
+        Returns:
+            True if the local chain was replaced, False otherwise.
         """
-        winner_chain = self.chain
-        replace = False
-        for node in self.__peer_nodes:
-            url = f'http://{node}/chain'
-            try:
-                response = requests.get(url)
-                node_chain = response.json()
-                node_chain = [Block(
-                    block['index'],
-                    block['previous_hash'],
-                    [Transaction(tx['sender'], tx['recipient'], tx['signature'], tx['amount'])
-                     for tx in block['transactions']],
-                    block['proof'],
-                    block['timestamp']) for block in node_chain]
-                node_chain_length = len(node_chain)
-                local_chain_length = len(winner_chain)
-                if node_chain_length > local_chain_length and Verification.verify_chain(node_chain):
-                    winner_chain = node_chain
-                    replace = True
-            except requests.exceptions.ConnectionError:
-                print(
-                    'Error while sending request GET /chain to resolve blockchain conflicts...')
-                print(requests.exceptions.ConnectionError.message)
+        winner = None
+        winner_length = self.get_length()
+        for node in self.get_peer_nodes():
+            fork_height = self.__locate_fork(node, winner_length)
+            if fork_height is None:
                 continue
+            blocks = self.__fetch_divergent_blocks(node, fork_height)
+            if blocks is not None and fork_height + 1 + len(blocks) > winner_length:
+                winner = (fork_height, blocks)
+                winner_length = fork_height + 1 + len(blocks)
         self.resolve_conflicts = False
-        self.chain = winner_chain
-        if replace:
-            self.__open_transactions = []
-        self.save_data()
-        return replace
+        if winner is None:
+            return False
+        fork_height, blocks = winner
+        with self.__lock.write():
+            if (fork_height >= len(self.__chain) or winner_length <= len(self.__chain) or
+                    self.__chain[fork_height].hash != blocks[0].previous_hash):
+                return False
+            return self.__replace_blocks(fork_height, blocks)
 
     def add_peer_node(self, node):
         """ Adds a new node to the peer node set.
@@ -343,8 +791,9 @@ class Blockchain:
         Arguments:
             node: The node URL which should be added.
         """
-        self.__peer_nodes.add(node)
-        self.save_data()
+        with self.__lock.write():
+            self.__peer_nodes.add(node)
+            self.save_peer_nodes()
 
     def remove_peer_node(self, node):
         """ Removes a node from the peer node set.
@@ -352,9 +801,12 @@ class Blockchain:
         Arguments:
             node: The node URL which should be removed.
         """
-        self.__peer_nodes.discard(node)
-        self.save_data()
+        with self.__lock.write():
+            self.__peer_nodes.discard(node)
+            self.save_peer_nodes()
+        self.__peer_client.forget(node)
 
     def get_peer_nodes(self):
         """ Returns a list of all connected peer nodes. """
-        return list(self.__peer_nodes)[:]
+        with self.__lock.read():
+            return list(self.__peer_nodes)
@@ -0,0 +1,253 @@
+import struct
+
+from block import Block
+from transaction import Transaction
+
+__all__ = ['BINARY_MIMETYPE', 'CodecError', 'encode_transaction', 'decode_transaction',
+           'encode_transactions', 'decode_transactions', 'encode_block', 'decode_block',
+           'encode_blocks', 'decode_blocks']
+
+# Content type used to exchange binary encoded blocks and transactions between nodes
+BINARY_MIMETYPE = 'application/x-pycoin'
+
+# Version of the binary format, written as the first byte of every encoded block
+# and transaction. Version 2 added the target of blocks and version 3 their Merkle root;
+# data of older versions is still read.
+FORMAT_VERSION = 3
+SUPPORTED_VERSIONS = (1, 2, 3)
+
+# Kinds of encoded strings: public keys, signatures and hashes are hex strings which
+# are stored as their raw bytes, everything else (e.g. 'MINING') as UTF-8 text
+_RAW = 0
+_TEXT = 1
+
+# Kinds of encoded numbers. Integers and floats are kept apart because `10` and `10.0`
+# serialize differently and therefore lead to different hashes and signatures.
+_INT = 0
+_FLOAT = 1
+
+_U8 = struct.Struct('>B')
+_U32 = struct.Struct('>I')
+_U64 = struct.Struct('>Q')
+_I64 = struct.Struct('>q')
+_F64 = struct.Struct('>d')
+# Targets are 256-bit numbers and Merkle roots 256-bit hashes; a block without one
+# of them is written as zero bytes
+_TARGET_SIZE = 32
+_ROOT_SIZE = 32
+_NO_ROOT = bytes(_ROOT_SIZE)
+# Kind (u8) and length (u32) of an encoded string
+_STR_HEADER = struct.Struct('>BI')
+
+
+class CodecError(ValueError):
+    """ Raised when bytes cannot be decoded into a block or a transaction, or when a
+    block or a transaction holds a value the encoding cannot represent. """
+
+
+def _encode_str(value, out):
+    if not isinstance(value, str):
+        raise CodecError(f'Cannot encode {type(value).__name__} {value!r} as a string.')
+    try:
+        raw = bytes.fromhex(value)
+        kind = _RAW if raw.hex() == value else _TEXT
+    except ValueError:
+        kind = _TEXT
+    data = raw if kind == _RAW else value.encode('utf-8')
+    out += _STR_HEADER.pack(kind, len(data))
+    out += data
+
+
+def _encode_number(value, out):
+    if isinstance(value, int):
+        out += _U8.pack(_INT)
+        out += _I64.pack(value)
+    else:
+        out += _U8.pack(_FLOAT)
+        out += _F64.pack(value)
+
+
+def _encode_transaction(transaction, out):
+    _encode_str(transaction.sender, out)
+    _encode_str(transaction.recipient, out)
+    _encode_number(transaction.amount, out)
+    _encode_str(transaction.signature, out)
+
+
+def _encode_block(block, out):
+    out += _U64.pack(block.index)
+    _encode_str(block.previous_hash, out)
+    _encode_number(block.timestamp, out)
+    out += _U64.pack(block.proof)
+    out += (block.target or 0).to_bytes(_TARGET_SIZE, 'big')
+    out += _NO_ROOT if block.merkle_root is None else bytes.fromhex(block.merkle_root)
+    out += _U32.pack(len(block.transactions))
+    for tx in block.transactions:
+        _encode_transaction(tx, out)
+
+
+# The `_decode_*` functions read a value at `offset` of `data` and return it together
+# with the offset right after it. Running past the end of `data` raises `struct.error`
+# or `IndexError`, which the public decode functions turn into a `CodecError`.
+
+def _decode_str(data, offset):
+    kind, length = _STR_HEADER.unpack_from(data, offset)
+    offset += _STR_HEADER.size
+    end = offset + length
+    if end > len(data):
+        raise IndexError(offset)
+    if kind == _RAW:
+        return data[offset:end].hex(), end
+    if kind == _TEXT:
+        return bytes(data[offset:end]).decode('utf-8'), end
+    raise CodecError(f'Unknown string kind {kind}.')
+
+
+def _decode_number(data, offset):
+    kind = data[offset]
+    if kind == _INT:
+        return _I64.unpack_from(data, offset + 1)[0], offset + 1 + _I64.size
+    if kind == _FLOAT:
+        return _F64.unpack_from(data, offset + 1)[0], offset + 1 + _F64.size
+    raise CodecError(f'Unknown number kind {kind}.')
+
+
+def _decode_transaction(data, offset):
+    sender, offset = _decode_str(data, offset)
+    recipient, offset = _decode_str(data, offset)
+    amount, offset = _decode_number(data, offset)
+    signature, offset = _decode_str(data, offset)
+    return Transaction(sender, recipient, signature, amount), offset
+
+
+def _decode_block(data, offset, version):
+    index = _U64.unpack_from(data, offset)[0]
+    previous_hash, offset = _decode_str(data, offset + _U64.size)
+    timestamp, offset = _decode_number(data, offset)
+    proof = _U64.unpack_from(data, offset)[0]
+    offset += _U64.size
+    target = None
+    if version >= 2:
+        if offset + _TARGET_SIZE > len(data):
+            raise IndexError(offset)
+        target = int.from_bytes(data[offset:offset + _TARGET_SIZE], 'big') or None
+        offset += _TARGET_SIZE
+    merkle_root = None
+    if version >= 3:
+        if offset + _ROOT_SIZE > len(data):
+            raise IndexError(offset)
+        if data[offset:offset + _ROOT_SIZE] != _NO_ROOT:
+            merkle_root = bytes(data[offset:offset + _ROOT_SIZE]).hex()
+        offset += _ROOT_SIZE
+    count = _U32.unpack_from(data, offset)[0]
+    offset += _U32.size
+    transactions = []
+    for _ in range(count):
+        tx, offset = _decode_transaction(data, offset)
+        transactions.append(tx)
+    return Block(index, previous_hash, transactions, proof, timestamp, target,
+                 merkle_root), offset
+
+
+def _check_version(data):
+    if not data:
+        raise CodecError('No data to decode.')
+    if data[0] not in SUPPORTED_VERSIONS:
+        raise CodecError(f'Unsupported format version {data[0]}.')
+    return data[0]
+
+
+def encode_transaction(transaction):
+    """ Encode a `Transaction` into bytes.
+
+    Layout: version (u8), then sender, recipient, amount and signature. Strings are
+    written as kind (u8), length (u32) and data, where hex strings such as keys and
+    signatures are stored as raw bytes. Numbers are written as kind (u8) and a
+    big-endian 64-bit integer or float.
+    """
+    out = bytearray(_U8.pack(FORMAT_VERSION))
+    _encode_transaction(transaction, out)
+    return bytes(out)
+
+
+def decode_transaction(data):
+    """ Decode bytes made by `encode_transaction` back into a `Transaction`. """
+    _check_version(data)
+    try:
+        transaction, offset = _decode_transaction(data, 1)
+    except (struct.error, IndexError, UnicodeDecodeError) as error:
+        raise CodecError('Truncated or damaged transaction data.') from error
+    if offset != len(data):
+        raise CodecError('Unexpected data after the transaction.')
+    return transaction
+
+
+def encode_block(block):
+    """ Encode a `Block` into bytes.
+
+    Layout: version (u8), index (u64), previous hash, timestamp, proof (u64), target
+    (32 bytes big-endian, zero if the block has none), Merkle root (32 bytes, zero if the
+    block has none), number of transactions (u32) and the transactions (encoded as in `encode_transaction` but
+    without their own version byte).
+    """
+    out = bytearray(_U8.pack(FORMAT_VERSION))
+    _encode_block(block, out)
+    return bytes(out)
+
+
+def decode_block(data):
+    """ Decode bytes made by `encode_block` back into a `Block`. """
+    version = _check_version(data)
+    try:
+        block, offset = _decode_block(data, 1, version)
+    except (struct.error, IndexError, UnicodeDecodeError) as error:
+        raise CodecError('Truncated or damaged block data.') from error
+    if offset != len(data):
+        raise CodecError('Unexpected data after the block.')
+    return block
+
+
+def _encode_list(items, encode):
+    out = bytearray()
+    for item in items:
+        data = encode(item)
+        out += _U32.pack(len(data))
+        out += data
+    return bytes(out)
+
+
+def _decode_list(data, decode):
+    data = memoryview(data)
+    items = []
+    offset = 0
+    while offset < len(data):
+        if offset + _U32.size > len(data):
+            raise CodecError('Truncated list.')
+        length = _U32.unpack_from(data, offset)[0]
+        offset += _U32.size
+        if offset + length > len(data):
+            raise CodecError('Truncated list.')
+        items.append(decode(data[offset:offset + length]))
+        offset += length
+    return items
+
+
+def encode_transactions(transactions):
+    """ Encode a list of transactions as a sequence of length-prefixed (u32) encoded
+    transactions. """
+    return _encode_list(transactions, encode_transaction)
+
+
+def decode_transactions(data):
+    """ Decode bytes made by `encode_transactions` back into a list of transactions. """
+    return _decode_list(data, decode_transaction)
+
+
+def encode_blocks(blocks):
+    """ Encode a list of blocks as a sequence of length-prefixed (u32) encoded blocks. """
+    return _encode_list(blocks, encode_block)
+
+
+def decode_blocks(data):
+    """ Decode bytes made by `encode_blocks` back into a list of blocks. """
+    return _decode_list(data, decode_block)
@@ -0,0 +1,90 @@
+import random
+import threading
+from collections import OrderedDict
+
+# Number of hops a message may travel by default in gossip mode
+GOSSIP_TTL = 8
+# Number of message ids remembered to recognize messages that were already relayed
+SEEN_IDS = 100000
+# HTTP header carrying the remaining time to live of a relayed message
+TTL_HEADER = 'X-Gossip-TTL'
+
+
+class GossipRelay:
+    """ Decides which peers a new transaction or block is sent to.
+
+    With a `fanout` of 0 messages are broadcast to every peer by the node creating them
+    and not relayed further, so every node must know every other node. With a `fanout`
+    of k > 0 the node creating a message sends it to k randomly picked peers with a time
+    to live of `ttl` hops, and every node receiving a message it has not seen before
+    forwards it to k random peers of its own with one hop less. A message reaches every
+    node of a connected network with high probability once k is about the logarithm of
+    the number of nodes, while each node only sends k copies of it.
+
+    The ids of the messages seen last are remembered, so a message coming back through
+    another path is neither added nor relayed again. This stops loops together with the
+    time to live, which bounds how far a message travels.
+
+    Attributes:
+        fanout (`int`): The number of peers a message is sent to, 0 to send it to all.
+        ttl (`int`): The number of hops a message created by this node may travel.
+        __seen (`OrderedDict` of `str`: None): The ids of the messages seen last.
+        __lock (`threading.Lock`): Guards `__seen`.
+    """
+
+    def __init__(self, fanout=0, ttl=GOSSIP_TTL, seen_ids=SEEN_IDS, rng=None):
+        self.fanout = fanout
+        self.ttl = ttl
+        self.__seen_ids = seen_ids
+        self.__seen = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__random = rng if rng is not None else random.Random()
+
+    @property
+    def enabled(self):
+        """ Whether messages are gossiped to `fanout` random peers. """
+        return self.fanout > 0
+
+    def see(self, message_id):
+        """ Remembers that a message was seen.
+
+        Returns:
+            True if the message is new, False if it was seen before.
+        """
+        with self.__lock:
+            if message_id in self.__seen:
+                self.__seen.move_to_end(message_id)
+                return False
+            self.__seen[message_id] = None
+            if len(self.__seen) > self.__seen_ids:
+                self.__seen.popitem(last=False)
+            return True
+
+    def has_seen(self, message_id):
+        """ Returns True if the message was seen before. """
+        with self.__lock:
+            return message_id in self.__seen
+
+    def targets(self, peer_nodes, ttl=None):
+        """ Picks the peers a message is sent to and the time to live it is sent with.
+
+        Arguments:
+            peer_nodes (`list` of `str`): The peers of this node.
+            ttl (`int`, optional): The time to live the message was received with, or
+                None if the message was created by this node.
+
+        Returns:
+            A tuple of the list of peers and the time to live to send along, which is
+            None when gossiping is disabled. The list is empty if the message must not
+            be sent on.
+        """
+        if not self.enabled:
+            # Only the node creating a message broadcasts it
+            return (list(peer_nodes) if ttl is None else []), None
+        remaining = self.ttl if ttl is None else ttl - 1
+        if remaining <= 0:
+            return [], None
+        peer_nodes = list(peer_nodes)
+        if len(peer_nodes) > self.fanout:
+            peer_nodes = self.__random.sample(peer_nodes, self.fanout)
+        return peer_nodes, remaining
@@ -0,0 +1,47 @@
+import importlib
+import threading
+
+__all__ = ['lazy_import']
+
+
+class _LazyModule:
+    """ Stands in for a module which is only imported when one of its attributes is
+    first used. Accessing any attribute afterwards costs one extra function call. """
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+        self.__lock = threading.Lock()
+
+    def __load(self):
+        with self.__lock:
+            if self.__module is None:
+                self.__module = importlib.import_module(self.__name)
+        return self.__module
+
+    def __getattr__(self, attribute):
+        module = self.__module
+        if module is None:
+            module = self.__load()
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        state = 'loaded' if self.__module is not None else 'not loaded'
+        return f'<lazy module {self.__name!r} ({state})>'
+
+
+def lazy_import(name):
+    """ Returns a stand-in for the module `name` which imports it on first use.
+
+    Heavy third-party modules (the HTTP client, the cryptography library) are imported
+    this way, so that starting a node or a short-lived script does not pay for them
+    until they are needed. Only plain attribute access is supported, e.g.
+
+        requests = lazy_import('requests')
+        ...
+        session = requests.Session()
+
+    Arguments:
+        name (`str`): The absolute name of the module, e.g. `'Crypto.PublicKey.RSA'`.
+    """
+    return _LazyModule(name)
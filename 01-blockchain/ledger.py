@@ -0,0 +1,85 @@
+from collections import defaultdict
+
+
+class Ledger:
+    """ Keeps running account totals so balances can be looked up without walking the
+    whole blockchain.
+
+    The ledger is updated incrementally whenever a block is added to (or removed from)
+    the chain and whenever an open transaction is queued or dropped.
+
+    Attributes:
+        __received (`dict` of `str`: `float`): Confirmed amounts received by each account.
+        __sent (`dict` of `str`: `float`): Confirmed amounts sent by each account.
+        __pending (`dict` of `str`: `float`): Amounts each account is about to send
+            with transactions that are still open (not mined yet).
+    """
+
+    def __init__(self):
+        self.__received = defaultdict(float)
+        self.__sent = defaultdict(float)
+        self.__pending = defaultdict(float)
+
+    def rebuild(self, chain, open_transactions):
+        """ Recalculates the whole ledger from scratch.
+
+        Arguments:
+            chain (:obj:`list` of `Block`s): The blocks to be accounted for.
+            open_transactions (:obj:`list` of `Transaction`s): The open transactions.
+        """
+        self.__received.clear()
+        self.__sent.clear()
+        self.__pending.clear()
+        for block in chain:
+            self.apply_block(block)
+        for tx in open_transactions:
+            self.add_open_transaction(tx)
+
+    def apply_block(self, block):
+        """ Accounts for all transactions of a block appended to the chain. """
+        for tx in block.transactions:
+            self.__sent[tx.sender] += tx.amount
+            self.__received[tx.recipient] += tx.amount
+
+    def revert_block(self, block):
+        """ Undoes the effect of `apply_block` for a block removed from the chain. """
+        for tx in block.transactions:
+            self.__sent[tx.sender] -= tx.amount
+            self.__received[tx.recipient] -= tx.amount
+
+    def add_open_transaction(self, transaction):
+        """ Reserves the amount of a newly queued open transaction. """
+        self.__pending[transaction.sender] += transaction.amount
+
+    def remove_open_transaction(self, transaction):
+        """ Releases the amount reserved by an open transaction that was dropped
+        or put into a block. """
+        self.__pending[transaction.sender] -= transaction.amount
+
+    def clear_open_transactions(self):
+        """ Releases the amounts reserved by all open transactions. """
+        self.__pending.clear()
+
+    def snapshot(self):
+        """ Returns the confirmed totals as a JSON-serializable `dict`, to be passed to
+        `restore` later. Amounts reserved by open transactions are not included. """
+        return {
+            'received': dict(self.__received),
+            'sent': dict(self.__sent)
+        }
+
+    def restore(self, snapshot):
+        """ Replaces the ledger with the confirmed totals returned by `snapshot`.
+        No amounts are reserved by open transactions afterwards. """
+        received = defaultdict(float, snapshot['received'])
+        sent = defaultdict(float, snapshot['sent'])
+        self.__received = received
+        self.__sent = sent
+        self.__pending.clear()
+
+    def get_balance(self, participant):
+        """ Returns the confirmed amount received minus the confirmed and pending
+        amounts sent by `participant`. """
+        return (self.__received.get(participant, 0) -
+                self.__sent.get(participant, 0) -
+                self.__pending.get(participant, 0))
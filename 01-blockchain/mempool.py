@@ -0,0 +1,72 @@
+from collections import OrderedDict
+
+
+class Mempool:
+    """ The open transactions waiting to be mined, kept in the order they arrived.
+
+    Transactions are looked up and removed by their `tx_id` in O(1). Signatures are
+    deterministic, so paying the same amount to the same recipient twice gives two
+    transactions with the same id: such a repeated payment is kept as another copy when
+    added with `repeat`, and every removal by id takes out the oldest copy.
+
+    Attributes:
+        __transactions (`OrderedDict` of `int`: `Transaction`): The open transactions
+            by the number of their entry, in the order they were added.
+        __entries (`dict` of `str`: `list` of `int`): The entry numbers of the copies
+            of each transaction id, oldest first.
+        __next_entry (`int`): The number given to the next added transaction.
+    """
+
+    def __init__(self, transactions=()):
+        self.__transactions = OrderedDict()
+        self.__entries = {}
+        self.__next_entry = 0
+        for tx in transactions:
+            self.add(tx)
+
+    def __len__(self):
+        return len(self.__transactions)
+
+    def __iter__(self):
+        return iter(self.__transactions.values())
+
+    def __contains__(self, tx_id):
+        return tx_id in self.__entries
+
+    def add(self, transaction, repeat=False):
+        """ Adds a transaction to the pool.
+
+        Arguments:
+            transaction (`Transaction`): The transaction to be added.
+            repeat (`bool`, default to False): Whether a transaction already in the pool
+                is added again as another copy.
+
+        Returns:
+            True if the transaction was added, False if it was already in the pool.
+        """
+        entries = self.__entries.get(transaction.tx_id)
+        if entries is not None and not repeat:
+            return False
+        entry = self.__next_entry
+        self.__next_entry += 1
+        self.__transactions[entry] = transaction
+        self.__entries.setdefault(transaction.tx_id, []).append(entry)
+        return True
+
+    def remove(self, tx_id):
+        """ Removes the oldest copy of the transaction with the given id from the pool.
+
+        Returns:
+            The removed `Transaction`, or None if there was no such transaction in the pool.
+        """
+        entries = self.__entries.get(tx_id)
+        if entries is None:
+            return None
+        entry = entries.pop(0)
+        if not entries:
+            del self.__entries[tx_id]
+        return self.__transactions.pop(entry)
+
+    def get_transactions(self):
+        """ Returns a list of the transactions in the order they were added. """
+        return list(self.__transactions.values())
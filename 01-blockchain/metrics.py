@@ -0,0 +1,195 @@
+import threading
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+
+__all__ = ['CONTENT_TYPE', 'DEFAULT_BUCKETS', 'MetricsRegistry', 'metrics']
+
+# Upper bounds in seconds of the buckets of every latency histogram
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _NullTimer:
+    """ The timer handed out while metrics are disabled: it does nothing. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    """ Observes the time spent inside a `with` block in a histogram. """
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, perf_counter() - self.started, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """ Collects counters, gauges and latency histograms and renders them in the
+    Prometheus text format.
+
+    While the registry is disabled every method returns right away (and `timer` returns
+    a shared no-op context manager), so instrumented code costs almost nothing.
+
+    Attributes:
+        enabled (`bool`): Whether values are recorded.
+        __values (`dict`): The value of every counter and gauge, keyed by name and labels.
+        __histograms (`dict`): The bucket counts, sum and count of every histogram,
+            keyed by name and labels.
+        __kinds (`dict` of `str`: `tuple`): The type and help text of every metric name.
+    """
+
+    def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.__lock = threading.Lock()
+        self.__values = {}
+        self.__histograms = {}
+        self.__kinds = {}
+
+    def describe(self, name, kind, help_text):
+        """ Sets the type (`counter`, `gauge` or `histogram`) and help text of a metric. """
+        self.__kinds[name] = (kind, help_text)
+
+    def inc(self, name, amount=1, **labels):
+        """ Increases a counter. """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.__values[key] = self.__values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """ Sets a gauge. """
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.__values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, seconds, **labels):
+        """ Records a duration in a histogram. """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self.__histograms[key] = histogram
+            histogram[0][bisect_left(self.buckets, seconds)] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def timer(self, name, **labels):
+        """ Returns a context manager observing the time spent inside it. """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def timed(self, name, **labels):
+        """ Decorates a function so that the time spent in each call is observed. """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Timer(self, name, labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        """ Forgets all recorded values. """
+        with self.__lock:
+            self.__values.clear()
+            self.__histograms.clear()
+
+    @staticmethod
+    def __format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\')
+                                           .replace('"', '\\"').replace('\n', '\\n'))
+                              for key, value in pairs) + '}'
+
+    def __header(self, name, default_kind, lines, written):
+        if name in written:
+            return
+        written.add(name)
+        kind, help_text = self.__kinds.get(name, (default_kind, ''))
+        if help_text:
+            lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    def render(self):
+        """ Returns all recorded values in the Prometheus text exposition format. """
+        with self.__lock:
+            values = sorted(self.__values.items())
+            histograms = sorted((key, (list(counts), total, count))
+                                for key, (counts, total, count) in self.__histograms.items())
+        lines = []
+        written = set()
+        for (name, labels), value in values:
+            self.__header(name, 'untyped', lines, written)
+            lines.append(f'{name}{self.__format_labels(labels)} {value}')
+        for (name, labels), (counts, total, count) in histograms:
+            self.__header(name, 'histogram', lines, written)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{self.__format_labels(labels, [("le", bound)])} '
+                             f'{cumulative}')
+            lines.append(f'{name}_sum{self.__format_labels(labels)} {total}')
+            lines.append(f'{name}_count{self.__format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+# The registry shared by the whole node; the node enables it with --metrics
+metrics = MetricsRegistry()
+
+metrics.describe('http_requests_total', 'counter', 'HTTP requests handled, by route and status.')
+metrics.describe('http_request_duration_seconds', 'histogram',
+                 'Time spent handling HTTP requests, by route.')
+metrics.describe('proof_of_work_seconds', 'histogram', 'Time spent searching proofs of work.')
+metrics.describe('proof_of_work_hashes_total', 'counter', 'Proofs of work tried.')
+metrics.describe('mining_hash_rate', 'gauge', 'Hashes per second of the last proof-of-work search.')
+metrics.describe('signature_verify_seconds', 'histogram',
+                 'Time spent verifying a single transaction signature.')
+metrics.describe('signature_batch_verify_seconds', 'histogram',
+                 'Time spent verifying a batch of transaction signatures.')
+metrics.describe('signatures_verified_total', 'counter',
+                 'Transaction signatures verified in batches.')
+metrics.describe('key_cache_hits_total', 'counter',
+                 'Lookups answered by the parsed key caches of the node process, by cache.')
+metrics.describe('key_cache_misses_total', 'counter',
+                 'Keys parsed because they were not in the key caches, by cache.')
+metrics.describe('key_cache_size', 'gauge', 'Parsed keys held by the key caches, by cache.')
+metrics.describe('storage_seconds', 'histogram', 'Time spent persisting data, by operation.')
+metrics.describe('storage_changes_total', 'counter',
+                 'Changes of the open transactions and peer nodes files, by file.')
+metrics.describe('storage_writes_total', 'counter',
+                 'Writes of the open transactions and peer nodes files, by file.')
+metrics.describe('peer_request_seconds', 'histogram',
+                 'Time spent on requests to peer nodes, by method, path and outcome.')
+metrics.describe('peer_broadcast_seconds', 'histogram',
+                 'Time spent broadcasting to all peer nodes, by path.')
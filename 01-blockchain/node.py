@@ -1,11 +1,77 @@
-from flask import Flask, jsonify, request, send_from_directory
+import atexit
+import json
+import signal
+import struct
+import sys
+import threading
+from time import perf_counter
+
+from flask import Flask, Response, g, jsonify, request, send_from_directory
 from flask_cors import CORS
 
-from blockchain import Blockchain
+from block import Block
+from blockchain import (TX_ACCEPTED, TX_DECLINED, TX_DUPLICATE, TX_INVALID_AMOUNT, TX_INVALID_DATA,
+                        Blockchain)
+from codec import (BINARY_MIMETYPE, CodecError, decode_block, decode_transaction,
+                   decode_transactions, encode_blocks)
+from gossip import GOSSIP_TTL, TTL_HEADER
+from metrics import CONTENT_TYPE, metrics
+from storage import DURABILITY_BATCHED, DURABILITY_MODES, FLUSH_CHANGES, FLUSH_INTERVAL
+from stored_chain import LIVE_BLOCKS
+from transaction import Transaction
+from utility.verification import Verification
 from wallet import Wallet
 
+# Number of blocks serialized into each chunk of a streamed GET /chain response
+CHAIN_STREAM_CHUNK = 100
+# Maximum number of transactions accepted by one POST /transactions/batch request
+MAX_BATCH_SIZE = 1000
+# Number of threads handling requests when serving with waitress
+SERVER_THREADS = 8
+
 app = Flask(__name__)
 CORS(app)
+# Serializes the /wallet routes, which replace the keys of the node
+wallet_lock = threading.Lock()
+
+
+def create_app(port=5000, mining_workers=1, durability=DURABILITY_BATCHED,
+               flush_interval=FLUSH_INTERVAL, flush_changes=FLUSH_CHANGES, live_blocks=LIVE_BLOCKS,
+               gossip_fanout=0, gossip_ttl=GOSSIP_TTL):
+    """ Loads the wallet and the blockchain of the node listening on `port` and returns
+    the Flask app serving them, e.g. for a WSGI server:
+
+        gunicorn --workers 1 --threads 8 -b 0.0.0.0:5000 'node:create_app(port=5000)'
+
+    The node must run in a single process since its data is held in memory, but that
+    process may handle requests on many threads (see `Blockchain`).
+    """
+    global wallet, blockchain
+    wallet = Wallet(port)
+    blockchain = Blockchain(wallet.public_key, port, mining_workers, durability,
+                            flush_interval, flush_changes, live_blocks, gossip_fanout, gossip_ttl)
+    # Write the queued changes when the node stops
+    atexit.register(lambda: blockchain.close())
+    return app
+
+
+@app.before_request
+def start_request_timer():
+    if metrics.enabled:
+        g.request_started = perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """ Records the latency and the status of every handled request by route. """
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe('http_request_duration_seconds', perf_counter() - started,
+                        method=request.method, route=route)
+        metrics.inc('http_requests_total', method=request.method, route=route,
+                    status=response.status_code)
+    return response
 
 
 @app.route('/', methods=['GET'])
@@ -21,10 +87,14 @@ def get_network_ui():
 @app.route('/wallet', methods=['POST'])
 def create_keys():
     """ Generate a pair of public and private keys and save them into a file. """
-    wallet.create_keys()
-    if wallet.save_key():
-        global blockchain
-        blockchain = Blockchain(wallet.public_key, port)
+    with wallet_lock:
+        wallet.create_keys()
+        saved = wallet.save_key()
+        if saved:
+            # The blockchain does not depend on the wallet, only balances and mining
+            # rewards use its public key, so there is nothing to load again
+            blockchain.public_key = wallet.public_key
+    if saved:
         response = {
             'public_key': wallet.public_key,
             'private_key': wallet.private_key,
@@ -41,9 +111,11 @@ def create_keys():
 @app.route('/wallet', methods=['GET'])
 def load_keys():
     """ Load the public and private keys of the wallet. """
-    if wallet.load_keys():
-        global blockchain
-        blockchain = Blockchain(wallet.public_key, port)
+    with wallet_lock:
+        loaded = wallet.load_keys()
+        if loaded:
+            blockchain.public_key = wallet.public_key
+    if loaded:
         response = {
             'public_key': wallet.public_key,
             'private_key': wallet.private_key,
@@ -77,8 +149,20 @@ def get_balance():
 
 @app.route('/broadcast-transaction', methods=['POST'])
 def broadcast_transaction():
-    """ Handle broadcast transaction coming from other nodes. """
-    values = request.get_json()
+    """ Handle broadcast transaction coming from other nodes.
+    The transaction is sent either as JSON or in the binary encoding of `codec`, and
+    relayed further in gossip mode like blocks (see `broadcast_block`). """
+    if request.mimetype == BINARY_MIMETYPE:
+        try:
+            values = decode_transaction(request.get_data()).to_dict()
+        except CodecError:
+            response = {'message': 'Invalid binary data.'}
+            return jsonify(response), 400
+    elif request.is_json:
+        values = request.get_json()
+    else:
+        response = {'message': 'Unsupported content type.'}
+        return jsonify(response), 415
     if not values:
         response = {'message': 'No data found.'}
         return jsonify(response), 400
@@ -86,14 +170,19 @@ def broadcast_transaction():
     if not all(key in values for key in required):
         response = {'message': 'Some data is misssing'}
         return jsonify(response), 400
-    success = blockchain.add_transaction(
+    if not is_transaction(values):
+        response = {'message': 'Invalid transaction.'}
+        return jsonify(response), 400
+    result = blockchain.add_transaction(
         values['sender'],
         values['recipient'],
         values['signature'],
         values['amount'],
-        is_receiving=True
+        is_receiving=True,
+        ttl=request.headers.get(TTL_HEADER, 0, type=int)
     )
-    if success:
+    # The same broadcast may arrive twice, which is not an error of the sender
+    if result in (TX_ACCEPTED, TX_DUPLICATE):
         response = {
             'message': 'Successfully added transaction.',
             'transaction': {
@@ -111,10 +200,56 @@ def broadcast_transaction():
         return jsonify(response), 500
 
 
+@app.route('/broadcast-transactions', methods=['POST'])
+def broadcast_transactions():
+    """ Handle a batch of transactions broadcast by another node.
+    The transactions are sent either as JSON or in the binary encoding of `codec`. """
+    if request.mimetype == BINARY_MIMETYPE:
+        try:
+            values = {'transactions': [tx.to_dict()
+                                       for tx in decode_transactions(request.get_data())]}
+        except CodecError:
+            response = {'message': 'Invalid binary data.'}
+            return jsonify(response), 400
+    elif request.is_json:
+        values = request.get_json()
+    else:
+        response = {'message': 'Unsupported content type.'}
+        return jsonify(response), 415
+    if not values or not isinstance(values.get('transactions'), list):
+        response = {'message': 'No data found.'}
+        return jsonify(response), 400
+    required = ['sender', 'recipient', 'amount', 'signature']
+    if not all(isinstance(tx, dict) and all(key in tx for key in required)
+               and is_transaction(tx) for tx in values['transactions']):
+        response = {'message': 'Some data is misssing'}
+        return jsonify(response), 400
+    results = blockchain.add_transactions(
+        [Transaction.from_dict(tx) for tx in values['transactions']], is_receiving=True,
+        ttl=request.headers.get(TTL_HEADER, 0, type=int))
+    response = {'results': results}
+    if all(result in (TX_ACCEPTED, TX_DUPLICATE) for result in results):
+        return jsonify(response), 201
+    return jsonify(response), 400
+
+
 @app.route('/broadcast-block', methods=['POST'])
 def broadcast_block():
-    """ Broadcast a block to other nodes when mining coins from open transactions. """
-    values = request.get_json()
+    """ Broadcast a block to other nodes when mining coins from open transactions.
+    The block is sent either as JSON or in the binary encoding of `codec`. In gossip
+    mode a new block is relayed to `--gossip-fanout` random peers while its time to
+    live (the `X-Gossip-TTL` header) lasts. """
+    if request.mimetype == BINARY_MIMETYPE:
+        try:
+            values = {'block': decode_block(request.get_data()).to_dict()}
+        except CodecError:
+            response = {'message': 'Invalid binary data.'}
+            return jsonify(response), 400
+    elif request.is_json:
+        values = request.get_json()
+    else:
+        response = {'message': 'Unsupported content type.'}
+        return jsonify(response), 415
     if not values:
         response = {'message': 'No data found.'}
         return jsonify(response), 400
@@ -122,14 +257,27 @@ def broadcast_block():
         response = {'message': 'Some data is missing.'}
         return jsonify(response), 400
     block = values['block']
-    if block['index'] == blockchain.chain[-1].index + 1:
-        if blockchain.add_block(block):
+    try:
+        converted_block = Block.from_dict(block)
+        if not isinstance(converted_block.index, int):
+            raise TypeError('The block index is not an integer.')
+        # In gossip mode the same block may arrive from several peers
+        known = blockchain.gossip.enabled and blockchain.gossip.has_seen(converted_block.hash)
+    except (KeyError, TypeError, ValueError, struct.error):
+        # Hashing the block packs its header, which fails for malformed fields
+        response = {'message': 'Invalid block.'}
+        return jsonify(response), 400
+    if known:
+        response = {'message': 'Block already known.'}
+        return jsonify(response), 200
+    if block['index'] == blockchain.get_length():
+        if blockchain.add_block(block, request.headers.get(TTL_HEADER, 0, type=int)):
             response = {'message': 'Block added.'}
             return jsonify(response), 201
         else:
             response = {'message': 'Block seems invalid.'}
             return jsonify(response), 409
-    elif block['index'] > blockchain.chain[-1].index:
+    elif block['index'] > blockchain.get_length():
         response = {
             'message': 'Blockchain seems to differ from local blockchain.'}
         blockchain.resolve_conflicts = True
@@ -162,12 +310,18 @@ def add_transaction():
         return jsonify(response), 400
     recipient = values['recipient']
     amount = values['amount']
+    if not is_text(recipient) or not is_amount(amount):
+        response = {
+            'message': 'Invalid recipient or amount.'
+        }
+        return jsonify(response), 400
     signature = wallet.sign_transaction(wallet.public_key, recipient, amount)
-    success = blockchain.add_transaction(
+    result = blockchain.add_transaction(
         wallet.public_key, recipient, signature, amount)
-    if success:
+    if result in (TX_ACCEPTED, TX_DECLINED):
         response = {
-            'message': 'Successfully added transaction.',
+            'message': 'Successfully added transaction.' if result == TX_ACCEPTED else
+                       'Added transaction, but a peer node declined it.',
             'transaction': {
                 'sender': wallet.public_key,
                 'recipient': recipient,
@@ -179,11 +333,97 @@ def add_transaction():
         return jsonify(response), 201
     else:
         response = {
-            'message': 'Creating a transaction failed.'
+            'message': 'Creating a transaction failed.',
+            'result': result
         }
         return jsonify(response), 500
 
 
+def is_amount(value):
+    """ Tells whether a value taken from a JSON body is a number of coins that can be sent. """
+    return Verification.valid_amount(value)
+
+
+def is_text(value):
+    """ Tells whether a value taken from a JSON body is a string, as keys, addresses and
+    signatures are. """
+    return isinstance(value, str)
+
+
+def is_transaction(values):
+    """ Tells whether the fields of a signed transaction taken from a JSON body have the
+    right types. """
+    return (all(is_text(values[key]) for key in ('sender', 'recipient', 'signature')) and
+            is_amount(values['amount']))
+
+
+@app.route('/transactions/batch', methods=['POST'])
+def add_transactions():
+    """ Create many transactions at once.
+
+    Each item holds a `recipient` and an `amount`, and is then signed with the wallet of
+    the node, or is a transaction signed elsewhere (`sender`, `recipient`, `amount` and
+    `signature`). The items are checked together against the running balances, saved
+    once and broadcast to the peer nodes in one message. The response tells the outcome
+    of every item, in the order of the request.
+    """
+    values = request.get_json()
+    if not values or not isinstance(values.get('transactions'), list):
+        response = {
+            'message': 'No data found.'
+        }
+        return jsonify(response), 400
+    items = values['transactions']
+    if len(items) > MAX_BATCH_SIZE:
+        response = {
+            'message': f'At most {MAX_BATCH_SIZE} transactions can be sent at once.'
+        }
+        return jsonify(response), 413
+    # Items which cannot become a transaction are rejected right away
+    results = [{'accepted': False, 'result': 'Required data is missing.'}] * len(items)
+    transactions = []
+    positions = []
+    for position, item in enumerate(items):
+        if not isinstance(item, dict) or 'recipient' not in item or 'amount' not in item:
+            continue
+        if not is_amount(item['amount']):
+            results[position] = {'accepted': False, 'result': TX_INVALID_AMOUNT}
+            continue
+        if 'signature' in item:
+            if 'sender' not in item:
+                continue
+            if not is_transaction(item):
+                results[position] = {'accepted': False, 'result': TX_INVALID_DATA}
+                continue
+            transaction = Transaction.from_dict(item)
+        elif wallet.public_key == None:
+            results[position] = {'accepted': False, 'result': 'No wallet set up.'}
+            continue
+        elif not is_text(item['recipient']):
+            results[position] = {'accepted': False, 'result': TX_INVALID_DATA}
+            continue
+        else:
+            signature = wallet.sign_transaction(wallet.public_key, item['recipient'], item['amount'])
+            transaction = Transaction(wallet.public_key, item['recipient'], signature, item['amount'])
+        transactions.append(transaction)
+        positions.append(position)
+    for position, transaction, result in zip(
+            positions, transactions, blockchain.add_transactions(transactions)):
+        # A duplicate is a transaction signed by another wallet which is open already
+        results[position] = {
+            'accepted': result == TX_ACCEPTED,
+            'result': result,
+            'transaction': transaction.to_dict()
+        }
+    accepted = sum(1 for result in results if result['accepted'])
+    response = {
+        'message': f'Accepted {accepted} of {len(items)} transactions.',
+        'results': results,
+        'funds': blockchain.get_balance()
+    }
+    return jsonify(response), 200
+
+
 @app.route('/mine', methods=['POST'])
 def mine():
     """ Mine coins by putting all open transactions in a block,
@@ -193,13 +433,11 @@ def mine():
         return jsonify(response), 409
     block = blockchain.mine_block()
     if block != None:
-        dict_block = block.__dict__.copy()
-        dict_block['transactions'] = [
-            tx.__dict__ for tx in dict_block['transactions']]
         response = {
             'message': 'Block added successfully',
-            'block': dict_block,
-            'funds': blockchain.get_balance()
+            'block': block.to_dict(),
+            'funds': blockchain.get_balance(),
+            'hash_rate': blockchain.miner.last_hash_rate
         }
         return jsonify(response), 201
     else:
@@ -225,19 +463,86 @@ def resolve_conflicts():
 def get_open_transactions():
     """ Fetch all current open transactions. """
     transactions = blockchain.get_open_transactions()
-    dict_transactions = [tx.__dict__ for tx in transactions]
+    dict_transactions = [tx.to_dict() for tx in transactions]
     return jsonify(dict_transactions), 200
 
 
 @app.route('/chain', methods=['GET'])
 def get_chain():
-    """ Get the entire blockchain. """
-    chain_snapshot = blockchain.chain
-    dict_chain = [block.__dict__.copy() for block in chain_snapshot]
-    for dict_block in dict_chain:
-        dict_block['transactions'] = [
-            tx.__dict__ for tx in dict_block['transactions']]
-    return jsonify(dict_chain), 200
+    """ Get the blockchain, or the range of `limit` blocks starting at index `start`.
+
+    The response carries an ETag derived from the hash of the last block, so clients
+    sending it back in `If-None-Match` get a 304 while the chain has not changed.
+    Clients listing the binary content type of `codec` in `Accept` get the blocks in
+    that encoding instead of JSON.
+    """
+    start = request.args.get('start', 0, type=int)
+    limit = request.args.get('limit', None, type=int)
+    if start < 0 or (limit is not None and limit < 0):
+        response = {'message': 'Invalid start or limit.'}
+        return jsonify(response), 400
+    length = blockchain.get_length()
+    binary = BINARY_MIMETYPE in request.accept_mimetypes.values()
+    tip_hash = blockchain.get_last_blockchain_value().hash
+    etag = f'{tip_hash}-{start}-{"" if limit is None else limit}{"-bin" if binary else ""}'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    stop = length if limit is None else min(start + limit, length)
+    # The blocks are read from the chain chunk by chunk while the response is sent
+    chunks = blockchain.chain.iter_chunks(start, stop, CHAIN_STREAM_CHUNK)
+
+    def generate_binary():
+        for chunk in chunks:
+            yield encode_blocks(chunk)
+
+    def generate():
+        yield '['
+        separator = ''
+        for chunk in chunks:
+            yield separator + ','.join(json.dumps(block.to_dict()) for block in chunk)
+            separator = ','
+        yield ']'
+
+    if binary:
+        response = Response(generate_binary(), status=200, mimetype=BINARY_MIMETYPE)
+    else:
+        response = Response(generate(), status=200, mimetype='application/json')
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    response.headers['X-Chain-Length'] = str(length)
+    return response
+
+
+@app.route('/chain/hashes', methods=['GET'])
+def get_chain_hashes():
+    """ Get the hashes of the blocks at the comma separated block indexes given in `heights`.
+    Peers use it to find the last block their chains share. """
+    try:
+        heights = [int(height)
+                   for height in request.args.get('heights', '').split(',') if height]
+    except ValueError:
+        response = {'message': 'Invalid heights.'}
+        return jsonify(response), 400
+    response = {
+        'length': blockchain.get_length(),
+        'hashes': {str(height): block_hash
+                   for height, block_hash in blockchain.get_block_hashes(heights).items()}
+    }
+    return jsonify(response), 200
+
+
+@app.route('/proof/<tx_id>', methods=['GET'])
+def get_inclusion_proof(tx_id):
+    """ Get the Merkle proof that a transaction is included in a block. The optional `block`
+    argument gives the index of the block, which saves searching the chain for it. """
+    height = request.args.get('block', None, type=int)
+    proof = blockchain.get_merkle_proof(tx_id, height)
+    if proof is None:
+        response = {'message': 'Transaction not found in a block with a Merkle root.'}
+        return jsonify(response), 404
+    return jsonify(proof), 200
 
 
 @app.route('/node', methods=['POST'])
@@ -288,16 +593,64 @@ def get_nodes():
     return jsonify(response), 200
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """ Expose the counters and latency histograms of the node in the Prometheus text format. """
+    if not metrics.enabled:
+        response = {'message': 'Metrics are disabled, start the node with --metrics.'}
+        return jsonify(response), 404
+    # The parsed key caches count their hits and misses themselves
+    for cache, info in Wallet.key_cache_info().items():
+        metrics.set('key_cache_hits_total', info['hits'], cache=cache)
+        metrics.set('key_cache_misses_total', info['misses'], cache=cache)
+        metrics.set('key_cache_size', info['currsize'], cache=cache)
+    return Response(metrics.render(), status=200, content_type=CONTENT_TYPE)
+
+
 if __name__ == '__main__':
     from argparse import ArgumentParser
     parser = ArgumentParser(
         prog="Blockchain Node",
-        usage="python node.py [-p portNum | --port portNum]",
+        usage="python node.py [-p portNum | --port portNum] [-w workers | --workers workers] "
+              "[-m | --metrics] [-d mode | --durability mode] "
+              "[--flush-interval ms] [--flush-changes count] "
+              "[-s server | --server server] [-t threads | --threads threads] "
+              "[--live-blocks count] [--gossip-fanout k] [--gossip-ttl hops]",
     )
     parser.add_argument('-p', '--port', type=int, default=5000)
+    # Number of processes searching proofs of work, 0 means one per CPU core
+    parser.add_argument('-w', '--workers', type=int, default=1)
+    # Record counters and latency histograms and serve them at GET /metrics
+    parser.add_argument('-m', '--metrics', action='store_true')
+    # How the open transactions and peer nodes are written to the hard disk
+    parser.add_argument('-d', '--durability', choices=DURABILITY_MODES, default=DURABILITY_BATCHED)
+    # Longest delay of a batched write and number of changes written without waiting
+    parser.add_argument('--flush-interval', type=int, default=FLUSH_INTERVAL)
+    parser.add_argument('--flush-changes', type=int, default=FLUSH_CHANGES)
+    # Flask's development server or the production-ready waitress server
+    parser.add_argument('-s', '--server', choices=('flask', 'waitress'), default='flask')
+    # Number of threads handling requests with waitress
+    parser.add_argument('-t', '--threads', type=int, default=SERVER_THREADS)
+    # Number of blocks at the tip of the chain kept in memory, older ones stay on disk
+    parser.add_argument('--live-blocks', type=int, default=LIVE_BLOCKS)
+    # Send new transactions and blocks to k random peers which relay them further,
+    # instead of to all peers (0), and the number of hops they may travel
+    parser.add_argument('--gossip-fanout', type=int, default=0)
+    parser.add_argument('--gossip-ttl', type=int, default=GOSSIP_TTL)
     args = parser.parse_args()
+    metrics.enabled = args.metrics
     port = args.port
 
-    wallet = Wallet(port)
-    blockchain = Blockchain(wallet.public_key, port)
-    app.run(host='0.0.0.0', port=port)
+    create_app(port, args.workers, args.durability, args.flush_interval, args.flush_changes,
+               args.live_blocks, args.gossip_fanout, args.gossip_ttl)
+    # Stop like on Ctrl+C, so that the queued changes are written
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if args.server == 'waitress':
+        try:
+            from waitress import serve
+        except ImportError:
+            print('Serving with waitress needs the waitress package (pip install waitress).')
+            sys.exit(1)
+        serve(app, host='0.0.0.0', port=port, threads=args.threads)
+    else:
+        app.run(host='0.0.0.0', port=port, threaded=True)
@@ -1,6 +1,6 @@
 import json
 
-from blockchain import Blockchain
+from blockchain import TX_ACCEPTED, TX_DECLINED, Blockchain
 from utility.verification import Verification
 from wallet import Wallet
 
@@ -17,11 +17,11 @@ class NodeConsole:
             all state of the blockchain and transactions as well as its processing logic methods.
     """
 
-    def __init__(self, port):
+    def __init__(self, port, workers=1):
         self.port = port
         self.wallet = Wallet(port)
         self.wallet.create_keys()
-        self.blockchain = Blockchain(self.wallet.public_key, port)
+        self.blockchain = Blockchain(self.wallet.public_key, port, workers)
 
     def get_transaction_value(self):
         """ Return user input as a tuple. """
@@ -40,7 +40,7 @@ class NodeConsole:
             print(f'{index:>3}>>> {block}')
         else:
             print('_' * 50)
-            print(self.blockchain.chain)
+            print(list(self.blockchain.chain))
             print('_' * 50)
             print('In JSON Format:')
             jsonizeable_chain = [block.to_deep_dict()
@@ -65,10 +65,14 @@ class NodeConsole:
                 recipient, amount = tx_data
                 signature = self.wallet.sign_transaction(
                     self.wallet.public_key, recipient, amount)
-                if self.blockchain.add_transaction(self.wallet.public_key, recipient, signature, amount=amount):
+                result = self.blockchain.add_transaction(
+                    self.wallet.public_key, recipient, signature, amount=amount)
+                if result == TX_ACCEPTED:
                     print('Added transaction!')
+                elif result == TX_DECLINED:
+                    print('Added transaction, but a peer node declined it.')
                 else:
-                    print('Transaction failed!')
+                    print(f'Transaction failed: {result}!')
                 print('_' * 50)
                 print('Current open transactions:')
                 print(self.blockchain.get_open_transactions())
@@ -76,6 +80,8 @@ class NodeConsole:
             elif user_choice == '2':
                 if self.blockchain.mine_block() == None:
                     print('Mining failed. Got no wallet?')
+                else:
+                    print(f'Mined at {self.blockchain.miner.last_hash_rate:,.0f} hashes/s.')
             elif user_choice == '3':
                 self.print_blockchain_elements()
             elif user_choice == '4':
@@ -85,17 +91,17 @@ class NodeConsole:
                     print('There are invalid transactions')
             elif user_choice == '5':
                 self.wallet.create_keys()
-                self.blockchain = Blockchain(self.wallet.public_key, self.port)
+                self.blockchain.public_key = self.wallet.public_key
             elif user_choice == '6':
                 self.wallet.load_keys()
-                self.blockchain = Blockchain(self.wallet.public_key, self.port)
+                self.blockchain.public_key = self.wallet.public_key
             elif user_choice == '7':
                 self.wallet.save_key()
             elif user_choice == 'q':
                 break
             else:
                 print('Invalid option!')
-            if not Verification.verify_chain(self.blockchain.chain):
+            if not self.blockchain.verify_chain():
                 self.print_blockchain_elements()
                 print('Invalid blockchain!')
                 break
@@ -103,6 +109,7 @@ class NodeConsole:
                 f'Balance of {self.wallet.public_key}: {self.blockchain.get_balance():6.2f}')
         else:
             print('User left!')
+        self.blockchain.close()
 
         print('Done!')
 
@@ -111,10 +118,12 @@ if __name__ == '__main__':
     from argparse import ArgumentParser
     parser = ArgumentParser(
         prog="Blockchain NodeConsole",
-        usage="python node.py [-p portNum | --port portNum]",
+        usage="python node.py [-p portNum | --port portNum] [-w workers | --workers workers]",
     )
     parser.add_argument('-p', '--port', type=int, default=5000)
+    # Number of processes searching proofs of work, 0 means one per CPU core
+    parser.add_argument('-w', '--workers', type=int, default=1)
     args = parser.parse_args()
     port = args.port
-    node = NodeConsole(port)
+    node = NodeConsole(port, args.workers)
     node.listen_for_input()
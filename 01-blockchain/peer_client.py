@@ -0,0 +1,146 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from time import perf_counter
+
+from codec import BINARY_MIMETYPE
+from lazy_import import lazy_import
+from metrics import metrics
+
+# The HTTP client is only imported when the first peer is contacted
+requests = lazy_import('requests')
+
+# Seconds allowed for connecting to a peer and for waiting for its response
+CONNECT_TIMEOUT = 2
+READ_TIMEOUT = 5
+# Seconds a whole broadcast may take before peers that have not answered are given up
+BROADCAST_DEADLINE = 10
+# Maximum number of peers contacted at the same time
+MAX_CONCURRENT_REQUESTS = 16
+
+
+class PeerClient:
+    """ Sends HTTP requests to peer nodes.
+
+    Every peer gets its own `requests.Session`, so consecutive requests to the same
+    peer reuse a keep-alive connection. Broadcasts are sent to all peers at once from
+    a thread pool, and every request is bounded by `CONNECT_TIMEOUT` and `READ_TIMEOUT`,
+    so one slow or dead peer cannot hold up the others.
+
+    Payloads are sent in the binary encoding (see `codec`) when one is given. Peers that
+    answer it with `415 Unsupported Media Type` are remembered and get JSON from then on.
+    """
+
+    def __init__(self):
+        self.__sessions = {}
+        self.__json_only_nodes = set()
+        self.__lock = threading.Lock()
+        self.__executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS)
+
+    def __session(self, node):
+        with self.__lock:
+            session = self.__sessions.get(node)
+            if session is None:
+                session = requests.Session()
+                self.__sessions[node] = session
+            return session
+
+    def forget(self, node):
+        """ Closes the connection to a peer which was removed from the network. """
+        with self.__lock:
+            session = self.__sessions.pop(node, None)
+            self.__json_only_nodes.discard(node)
+        if session is not None:
+            session.close()
+
+    @staticmethod
+    def __observe(method, path, started, response):
+        """ Records the duration and the outcome of a request in the metrics. """
+        metrics.observe('peer_request_seconds', perf_counter() - started, method=method,
+                        path=path.split('?')[0],
+                        outcome=response.status_code if response is not None else 'error')
+
+    def get(self, node, path, **kwargs):
+        """ Sends a GET request to a peer.
+
+        Returns:
+            The `requests.Response`, or None if the peer could not be reached in time.
+        """
+        started = perf_counter()
+        try:
+            response = self.__session(node).get(
+                f'http://{node}{path}', timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs)
+        except requests.exceptions.RequestException as error:
+            print(f'Error while sending request GET {path} to {node}: {error}')
+            response = None
+        self.__observe('GET', path, started, response)
+        return response
+
+    def post(self, node, path, payload, data=None, headers=None):
+        """ Sends a payload to a peer with a POST request.
+
+        Arguments:
+            node (`str`): The URL of the peer node.
+            path (`str`): The path of the endpoint to call on the peer.
+            payload (`dict`): The JSON form of the payload.
+            data (`bytes`, optional): The binary form of the same payload, preferred
+                over JSON unless the peer is known not to accept it.
+            headers (`dict`, optional): Additional HTTP headers of the request.
+
+        Returns:
+            The `requests.Response`, or None if the peer could not be reached in time.
+        """
+        started = perf_counter()
+        response = self.__post(node, path, payload, data, headers or {})
+        self.__observe('POST', path, started, response)
+        return response
+
+    def __post(self, node, path, payload, data, headers):
+        session = self.__session(node)
+        url = f'http://{node}{path}'
+        try:
+            if data is not None and node not in self.__json_only_nodes:
+                response = session.post(url, data=data,
+                                        headers={**headers, 'Content-Type': BINARY_MIMETYPE},
+                                        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+                if response.status_code != 415:
+                    return response
+                self.__json_only_nodes.add(node)
+            return session.post(url, json=payload, headers=headers,
+                                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        except requests.exceptions.RequestException as error:
+            print(f'Error while sending request POST {path} to {node}: {error}')
+            return None
+
+    def broadcast(self, nodes, path, payload, data=None, headers=None):
+        """ Sends the same payload to all given peers concurrently.
+
+        Arguments:
+            nodes (iterable of `str`): The URLs of the peer nodes.
+            path (`str`): The path of the endpoint to call on each peer.
+            payload (`dict`): The JSON form of the payload.
+            data (`bytes`, optional): The binary form of the same payload.
+            headers (`dict`, optional): Additional HTTP headers of the requests.
+
+        Returns:
+            A `dict` mapping each node to the HTTP status code of its response,
+            or to None if the node could not be reached within the deadline.
+        """
+        with metrics.timer('peer_broadcast_seconds', path=path):
+            futures = {self.__executor.submit(self.post, node, path, payload, data, headers): node
+                       for node in nodes}
+            done, _ = wait(futures, timeout=BROADCAST_DEADLINE)
+        statuses = {}
+        for future, node in futures.items():
+            response = future.result() if future in done else None
+            statuses[node] = response.status_code if response is not None else None
+        return statuses
+
+    def relay(self, nodes, path, payload, data=None, headers=None):
+        """ Sends the same payload to the given peers in the background.
+
+        Unlike `broadcast` this returns right away without waiting for the answers, so a
+        node relaying a message it received does not hold up the request that brought
+        it (and the node that sent it) while the message travels further.
+        """
+        for node in nodes:
+            self.__executor.submit(self.post, node, path, payload, data, headers)
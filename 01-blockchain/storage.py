@@ -0,0 +1,551 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from time import monotonic
+
+from block import Block
+from codec import CodecError, decode_block, encode_block
+from metrics import metrics
+
+# Number of blocks stored in each segment file of the block log
+SEGMENT_SIZE = 1000
+
+# Every record in a segment is prefixed with its payload length and CRC32 checksum
+RECORD_HEADER = struct.Struct('>II')
+
+# Name of the file holding the offset of every block inside its segment
+INDEX_FILE = 'blocks.idx'
+
+# Name of the ledger snapshot files, by the number of blocks they account for
+SNAPSHOT_FILE = 'ledger-{:010d}.json'
+
+# Number of ledger snapshots kept; older ones are removed
+SNAPSHOTS_KEPT = 2
+
+# Durability modes of the storage (see `ChainStorage`)
+DURABILITY_ALWAYS = 'always-fsync'
+DURABILITY_BATCHED = 'batched'
+DURABILITY_NONE = 'none'
+DURABILITY_MODES = (DURABILITY_ALWAYS, DURABILITY_BATCHED, DURABILITY_NONE)
+
+# Longest time in milliseconds a queued change waits before it is written
+FLUSH_INTERVAL = 100
+
+# Number of queued changes which are written right away without waiting
+FLUSH_CHANGES = 100
+
+
+class ChainStorage:
+    """ Persists the app data of a node in a directory on the hard disk.
+
+    Blocks are never rewritten once saved. Each new block is appended as a
+    length-prefixed, checksummed record to the current segment of the block log
+    (`blocks-<segment>.log`, `SEGMENT_SIZE` blocks per segment). Records hold the
+    binary encoding of the block (see `codec.encode_block`); records written as JSON
+    by earlier versions are still read. The open transactions
+    and the peer nodes are small and live in their own JSON files which are replaced
+    atomically whenever they change.
+
+    How the open transactions and peer nodes reach the disk depends on `durability`:
+
+    * `DURABILITY_ALWAYS`: every change is written and fsynced before the call returns.
+    * `DURABILITY_BATCHED` (default): changes are queued and a background thread writes
+      the latest state of each file at most `flush_interval` milliseconds after the first
+      queued change, or as soon as `flush_changes` changes are queued, then fsyncs it.
+      Many transactions arriving together thus cost a single write. A crash loses at
+      most the changes of the last interval.
+    * `DURABILITY_NONE`: changes are written in batches like `DURABILITY_BATCHED` but
+      nothing is ever fsynced, not even the block log, so an operating system crash may
+      lose data the node believed saved. Killing the process loses at most the changes
+      of the last interval.
+
+    Blocks are always appended to the log before the call returns. `flush` writes the
+    queued changes right away and `close` does so before releasing the storage.
+
+    Snapshots of state derived from the blocks (see `save_snapshot`) are kept in
+    `SNAPSHOT_FILE` files named after the number of blocks they account for, so that
+    starting a node only needs to replay the blocks saved after the newest snapshot.
+
+    The byte offset of every block inside its segment is kept in an index file
+    (`INDEX_FILE`, one little-endian u64 per block), so starting a node does not need
+    to read the block log. Blocks are read on demand from memory-mapped segments.
+
+    A record that was only partially written (e.g. because the process was killed
+    while appending) fails its checksum and is cut off the log when loading. The index
+    is only a cache of the log: entries missing after a crash are recovered by scanning
+    the log from the last indexed block, and a damaged index is rebuilt from scratch.
+
+    Attributes:
+        directory (`str`): The directory holding the data of the node.
+        legacy_file (`str`): The single-file storage used by older versions of the app.
+            It is imported once when the directory does not contain a block log yet.
+        durability (`str`): One of `DURABILITY_MODES`.
+        flush_interval (`int`): The longest delay in milliseconds of a queued change.
+        flush_changes (`int`): The number of queued changes written without waiting.
+        __offsets (`array` of `int`): The byte offset of each stored block inside its segment.
+        __maps (`dict` of `int`: `mmap`): The memory maps of the segments read so far.
+        __map_lock (`threading.Lock`): Lets several threads read blocks at the same time
+            without one of them closing a memory map another one is reading.
+        __pending (`dict` of `str`: `function`): For each file with queued changes, a
+            function returning its latest content.
+        __pending_changes (`int`): The number of changes queued since the last write.
+        __pending_since (`float`): The `monotonic` time of the first queued change.
+        __condition (`threading.Condition`): Guards the queue and wakes the flusher up.
+        __write_lock (`threading.Lock`): Keeps queued changes written in order.
+        __flusher (`threading.Thread`): The background thread writing queued changes,
+            started with the first queued change.
+    """
+
+    def __init__(self, node_id, durability=DURABILITY_BATCHED, flush_interval=FLUSH_INTERVAL,
+                 flush_changes=FLUSH_CHANGES):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f'Unknown durability mode: {durability}')
+        self.directory = f'blockchain-{node_id}'
+        self.legacy_file = f'blockchain-{node_id}.txt'
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self.flush_changes = flush_changes
+        self.__offsets = array('Q')
+        self.__maps = {}
+        self.__map_lock = threading.Lock()
+        self.__pending = {}
+        self.__pending_changes = 0
+        self.__pending_since = None
+        self.__condition = threading.Condition()
+        self.__write_lock = threading.Lock()
+        self.__flusher = None
+        self.__closing = False
+
+    def __len__(self):
+        return len(self.__offsets)
+
+    def __segment_path(self, segment):
+        return os.path.join(self.directory, f'blocks-{segment:06d}.log')
+
+    def __file_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def __write_atomically(self, path, data):
+        """ Replaces the content of `path` so that readers see either the old or
+        the new content, never a partially written file. """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, mode='wb') as f:
+            f.write(data)
+            f.flush()
+            if self.durability != DURABILITY_NONE:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def __read_json(path, default):
+        try:
+            with open(path, mode='r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return default
+
+    @staticmethod
+    def __index_bytes(offsets):
+        offsets = array('Q', offsets)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        return offsets.tobytes()
+
+    @staticmethod
+    def __read_records(path, offset):
+        """ Reads the offsets of the intact records of a segment file from `offset` on.
+
+        Returns:
+            A tuple of the list of record offsets and the offset where the intact
+            part of the file ends.
+        """
+        offsets = []
+        with open(path, mode='rb') as f:
+            f.seek(offset)
+            data = f.read()
+        position = 0
+        while position + RECORD_HEADER.size <= len(data):
+            length, checksum = RECORD_HEADER.unpack_from(data, position)
+            start = position + RECORD_HEADER.size
+            if start + length > len(data) or zlib.crc32(data[start:start + length]) != checksum:
+                break
+            offsets.append(offset + position)
+            position = start + length
+        return offsets, offset + position
+
+    def __read_index(self):
+        """ Reads the index file and checks that its last entry points at an intact record.
+
+        Returns:
+            The offsets of the indexed blocks, or an empty array if the index is missing
+            or damaged (the log is then scanned from the beginning).
+        """
+        offsets = array('Q')
+        try:
+            with open(self.__file_path(INDEX_FILE), mode='rb') as f:
+                data = f.read()
+        except IOError:
+            return offsets
+        offsets.frombytes(data[:len(data) - len(data) % offsets.itemsize])
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        if offsets and self.__record_end(len(offsets) - 1, offsets) is None:
+            print('Block index does not match the block log, rebuilding it.')
+            return array('Q')
+        return offsets
+
+    def __record_end(self, height, offsets):
+        """ Returns the offset right after the intact record of block `height`,
+        or None if there is no intact record at the indexed offset. """
+        path = self.__segment_path(height // SEGMENT_SIZE)
+        try:
+            with open(path, mode='rb') as f:
+                f.seek(offsets[height])
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return None
+                length, checksum = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+        except (IOError, ValueError, OverflowError):
+            return None
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            return None
+        return offsets[height] + RECORD_HEADER.size + length
+
+    @metrics.timed('storage_seconds', operation='load')
+    def load(self):
+        """ Opens the stored app data, recovering from interrupted writes.
+
+        Blocks are not read here; use `read_block` or `iter_blocks` to access them.
+
+        Returns:
+            A tuple of the list of open transaction dictionaries, the number of blocks
+            the chain had when they were saved (None if unknown) and the list of peer nodes.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.__close_maps()
+        if not os.path.exists(self.__segment_path(0)) and os.path.exists(self.legacy_file):
+            self.__import_legacy_file()
+        indexed = self.__read_index()
+        self.__offsets = array('Q', indexed)
+        height = len(self.__offsets)
+        segment = height // SEGMENT_SIZE
+        offset = self.__record_end(height - 1, self.__offsets) if height % SEGMENT_SIZE else 0
+        # Pick up the blocks appended after the last index update
+        while os.path.exists(self.__segment_path(segment)):
+            path = self.__segment_path(segment)
+            offsets, end = self.__read_records(path, offset)
+            self.__offsets.extend(offsets)
+            if end < os.path.getsize(path) or len(self.__offsets) % SEGMENT_SIZE:
+                if end < os.path.getsize(path):
+                    print(f'Recovering block log: dropping a damaged record in {path}.')
+                    with open(path, mode='r+b') as f:
+                        f.truncate(end)
+                self.__remove_segments_from(segment + 1)
+                break
+            segment += 1
+            offset = 0
+        if self.__offsets != indexed:
+            self.__write_atomically(self.__file_path(INDEX_FILE),
+                                    self.__index_bytes(self.__offsets))
+        open_transactions = self.__read_json(
+            self.__file_path('open_transactions.json'), [])
+        height = None
+        if isinstance(open_transactions, dict):
+            height = open_transactions.get('height')
+            open_transactions = open_transactions.get('transactions', [])
+        peer_nodes = self.__read_json(self.__file_path('peer_nodes.json'), [])
+        return open_transactions, height, peer_nodes
+
+    def close(self):
+        """ Writes the queued changes, stops the background writer and releases the
+        memory maps of the block log. """
+        with self.__condition:
+            self.__closing = True
+            self.__condition.notify_all()
+        if self.__flusher is not None:
+            self.__flusher.join()
+            self.__flusher = None
+        self.flush()
+        self.__closing = False
+        self.__close_maps()
+
+    def __close_maps(self):
+        for segment_map in self.__maps.values():
+            segment_map.close()
+        self.__maps = {}
+
+    def __import_legacy_file(self):
+        """ Converts the three-line JSON file of older versions into the block log. """
+        try:
+            with open(self.legacy_file, mode='r') as f:
+                file_content = f.readlines()
+            blocks = [Block.from_dict(block) for block in json.loads(file_content[0])]
+            open_transactions = json.loads(file_content[1])
+            peer_nodes = json.loads(file_content[2])
+        except (IOError, IndexError, KeyError, TypeError, ValueError):
+            print(f'Importing {self.legacy_file} failed.')
+            return
+        self.__offsets = array('Q')
+        try:
+            if not self.append_blocks(blocks):
+                raise IOError('Saving the imported blocks failed.')
+            self.__write_atomically(self.__file_path('open_transactions.json'),
+                                    json.dumps(open_transactions).encode('utf-8'))
+            self.__write_atomically(self.__file_path('peer_nodes.json'),
+                                    json.dumps(peer_nodes).encode('utf-8'))
+        except IOError:
+            # The legacy file is kept, so the import is tried again on the next start
+            print(f'Importing {self.legacy_file} failed.')
+            self.truncate(0)
+            self.__remove_segments_from(0)
+            return
+        os.replace(self.legacy_file, self.legacy_file + '.imported')
+        print(f'Imported {len(blocks)} blocks from {self.legacy_file}.')
+
+    def __remove_segments_from(self, segment):
+        while os.path.exists(self.__segment_path(segment)):
+            segment_map = self.__maps.pop(segment, None)
+            if segment_map is not None:
+                segment_map.close()
+            os.remove(self.__segment_path(segment))
+            segment += 1
+
+    def __map(self, segment, end):
+        """ Returns a memory map of a segment covering at least the first `end` bytes. """
+        segment_map = self.__maps.get(segment)
+        if segment_map is None or len(segment_map) < end:
+            if segment_map is not None:
+                segment_map.close()
+            with open(self.__segment_path(segment), mode='rb') as f:
+                segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.__maps[segment] = segment_map
+        return segment_map
+
+    @staticmethod
+    def __decode_record(payload):
+        if payload[:1] == b'{':
+            return Block.from_dict(json.loads(payload.decode('utf-8')))
+        return decode_block(payload)
+
+    def read_block(self, height):
+        """ Reads and decodes the block at `height` (its index in the chain). """
+        segment = height // SEGMENT_SIZE
+        offset = self.__offsets[height]
+        start = offset + RECORD_HEADER.size
+        with self.__map_lock:
+            segment_map = self.__map(segment, start)
+            length, checksum = RECORD_HEADER.unpack_from(segment_map, offset)
+            segment_map = self.__map(segment, start + length)
+            payload = segment_map[start:start + length]
+        if zlib.crc32(payload) != checksum:
+            raise IOError(f'Block {height} is damaged in the block log.')
+        return self.__decode_record(payload)
+
+    def iter_blocks(self, start=0, stop=None):
+        """ Yields the blocks from height `start` up to (excluding) `stop` in order. """
+        stop = len(self.__offsets) if stop is None else min(stop, len(self.__offsets))
+        for height in range(start, stop):
+            yield self.read_block(height)
+
+    @metrics.timed('storage_seconds', operation='append_blocks')
+    def append_blocks(self, blocks):
+        """ Appends blocks to the end of the block log.
+
+        Either all blocks are saved or none: if writing one of them fails, the records
+        already written are cut off the log again.
+
+        Arguments:
+            blocks (:obj:`list` of `Block`s): The blocks to be saved.
+
+        Returns:
+            True if the blocks were saved, False otherwise.
+        """
+        first_new = len(self.__offsets)
+        try:
+            f = None
+            for block in blocks:
+                height = len(self.__offsets)
+                if f is None or height % SEGMENT_SIZE == 0:
+                    if f is not None:
+                        self.__close_synced(f)
+                    f = open(self.__segment_path(height // SEGMENT_SIZE), mode='ab')
+                payload = encode_block(block)
+                self.__offsets.append(f.tell())
+                f.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+                f.write(payload)
+            if f is not None:
+                self.__close_synced(f)
+            with open(self.__file_path(INDEX_FILE), mode='ab') as f:
+                f.write(self.__index_bytes(self.__offsets[first_new:]))
+            return True
+        except (IOError, struct.error, CodecError):
+            # struct.error and CodecError: a field does not fit the binary encoding
+            print('Saving blocks failed.')
+            if f is not None:
+                f.close()
+            # Each offset is added before its record is written, so this also cuts off
+            # a partially written record
+            self.truncate(first_new)
+            return False
+
+    def __close_synced(self, f):
+        f.flush()
+        if self.durability != DURABILITY_NONE:
+            os.fsync(f.fileno())
+        f.close()
+
+    @metrics.timed('storage_seconds', operation='truncate')
+    def truncate(self, height):
+        """ Removes all blocks from `height` onwards from the block log. """
+        if height >= len(self.__offsets):
+            return
+        segment = height // SEGMENT_SIZE
+        try:
+            segment_map = self.__maps.pop(segment, None)
+            if segment_map is not None:
+                segment_map.close()
+            with open(self.__segment_path(segment), mode='r+b') as f:
+                f.truncate(self.__offsets[height])
+            self.__remove_segments_from(segment + 1)
+            index_path = self.__file_path(INDEX_FILE)
+            # A shorter index (e.g. its last append failed) must not grow with zeros
+            if os.path.exists(index_path) and \
+                    os.path.getsize(index_path) > height * self.__offsets.itemsize:
+                with open(index_path, mode='r+b') as f:
+                    f.truncate(height * self.__offsets.itemsize)
+            # Snapshots of removed blocks no longer describe the chain
+            for snapshot_height in self.__snapshot_heights():
+                if snapshot_height > height:
+                    os.remove(self.__file_path(SNAPSHOT_FILE.format(snapshot_height)))
+        except IOError:
+            print('Truncating the block log failed.')
+        del self.__offsets[height:]
+
+    def __snapshot_heights(self):
+        """ Returns the heights of the saved snapshots, newest first. """
+        prefix, suffix = SNAPSHOT_FILE.split('{:010d}')
+        heights = []
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith(suffix):
+                try:
+                    heights.append(int(name[len(prefix):-len(suffix)]))
+                except ValueError:
+                    continue
+        return sorted(heights, reverse=True)
+
+    @metrics.timed('storage_seconds', operation='save_snapshot')
+    def save_snapshot(self, height, snapshot):
+        """ Saves a snapshot of state derived from the first `height` blocks and removes
+        the snapshots older than the `SNAPSHOTS_KEPT` newest ones.
+
+        Arguments:
+            height (`int`): The number of blocks the snapshot accounts for.
+            snapshot (`dict`): The JSON-serializable state.
+        """
+        try:
+            self.__write_atomically(self.__file_path(SNAPSHOT_FILE.format(height)),
+                                    json.dumps(snapshot).encode('utf-8'))
+            for old_height in self.__snapshot_heights()[SNAPSHOTS_KEPT:]:
+                os.remove(self.__file_path(SNAPSHOT_FILE.format(old_height)))
+        except IOError:
+            print('Saving the ledger snapshot failed.')
+
+    def load_snapshots(self):
+        """ Yields a (height, snapshot) tuple for each readable snapshot, newest first.
+        The caller decides whether a snapshot still matches the blocks. """
+        for height in self.__snapshot_heights():
+            snapshot = self.__read_json(self.__file_path(SNAPSHOT_FILE.format(height)), None)
+            if isinstance(snapshot, dict):
+                yield height, snapshot
+
+    def save_open_transactions(self, open_transactions, height):
+        """ Saves the open transactions.
+
+        Arguments:
+            open_transactions (:obj:`list` of `Transaction`s): The open transactions.
+                The list is serialized when it is written, so it must not be changed
+                afterwards.
+            height (`int`): The number of blocks in the chain, stored alongside so that
+                transactions mined in blocks saved after them can be dropped on loading.
+        """
+        self.__save('open_transactions.json', lambda: {
+            'height': height,
+            'transactions': [tx.to_dict() for tx in open_transactions]
+        })
+
+    def save_peer_nodes(self, peer_nodes):
+        """ Saves the list of peer nodes. """
+        self.__save('peer_nodes.json', lambda: peer_nodes)
+
+    def __save(self, name, content):
+        """ Writes the JSON returned by `content` to the file `name` right away or
+        queues it for the background writer, depending on the durability mode. """
+        metrics.inc('storage_changes_total', file=name)
+        if self.durability == DURABILITY_ALWAYS:
+            with self.__write_lock:
+                self.__write_files({name: content})
+            return
+        with self.__condition:
+            # The flusher sleeps until the first change is queued, then until it is
+            # due or until enough changes are queued
+            wake_flusher = not self.__pending
+            if wake_flusher:
+                self.__pending_since = monotonic()
+            self.__pending[name] = content
+            self.__pending_changes += 1
+            if self.__flusher is None:
+                self.__flusher = threading.Thread(
+                    target=self.__run_flusher, name=f'flusher-{self.directory}', daemon=True)
+                self.__flusher.start()
+            if wake_flusher or self.__pending_changes >= self.flush_changes:
+                self.__condition.notify_all()
+
+    def __take_pending(self):
+        """ Empties the queue. Must be called holding `__condition`. """
+        pending = self.__pending
+        self.__pending = {}
+        self.__pending_changes = 0
+        self.__pending_since = None
+        return pending
+
+    def flush(self):
+        """ Writes the queued changes right away. """
+        with self.__write_lock:
+            with self.__condition:
+                pending = self.__take_pending()
+            self.__write_files(pending)
+
+    def __run_flusher(self):
+        """ Writes the queued changes in batches until the storage is closed. """
+        while True:
+            with self.__condition:
+                while not self.__closing:
+                    if self.__pending_changes >= self.flush_changes:
+                        break
+                    if self.__pending:
+                        remaining = (self.__pending_since + self.flush_interval / 1000
+                                     - monotonic())
+                        if remaining <= 0:
+                            break
+                        self.__condition.wait(remaining)
+                    else:
+                        self.__condition.wait()
+                if self.__closing:
+                    return
+            self.flush()
+
+    @metrics.timed('storage_seconds', operation='write_files')
+    def __write_files(self, pending):
+        for name, content in pending.items():
+            try:
+                self.__write_atomically(self.__file_path(name),
+                                        json.dumps(content()).encode('utf-8'))
+                metrics.inc('storage_writes_total', file=name)
+            except IOError:
+                print(f'Saving {name} failed.')
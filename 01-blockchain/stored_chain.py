@@ -0,0 +1,203 @@
+import threading
+from collections import OrderedDict
+
+# Number of blocks at the tip of the chain kept in memory by default
+LIVE_BLOCKS = 1024
+
+# Number of older blocks kept in memory after being read from disk, so that walking the
+# chain (each block is checked against the blocks before it) decodes every block once
+COLD_CACHE_SIZE = 64
+
+# Number of blocks read at a time when iterating over a `ChainView`
+VIEW_CHUNK_SIZE = 100
+
+
+class StoredChain:
+    """ A list-like view of the blocks saved in a `ChainStorage`.
+
+    Blocks are only decoded when they are accessed. The last `live_blocks` blocks of the
+    chain stay in memory once read or appended; older blocks are left on disk and read
+    again when needed, through a small LRU cache. Memory use therefore does not grow
+    with the length of the chain.
+
+    Several threads may read blocks at the same time; changing the chain must not
+    overlap with reading it (`Blockchain` takes care of that with its lock).
+
+    Attributes:
+        live_blocks (`int`): The number of blocks at the tip of the chain kept in memory.
+        __live (`dict` of `int`: `Block`): The blocks of the tip kept in memory, by height.
+        __cold (`OrderedDict` of `int`: `Block`): The older blocks read most recently.
+        __cache_lock (`threading.Lock`): Guards both caches, which reads also update.
+    """
+
+    def __init__(self, storage, live_blocks=LIVE_BLOCKS):
+        self.__storage = storage
+        self.__live = {}
+        self.__cold = OrderedDict()
+        self.__cache_lock = threading.Lock()
+        self.live_blocks = live_blocks
+
+    def __len__(self):
+        return len(self.__storage)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # Ranges are usually read once (e.g. to serve GET /chain), so they do not
+            # push the hot blocks out of the cache
+            return [self.__peek(height) for height in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('block index out of range')
+        with self.__cache_lock:
+            block = self.__live.get(index)
+            if block is None:
+                block = self.__cold.get(index)
+                if block is not None:
+                    self.__cold.move_to_end(index)
+            if block is not None:
+                return block
+        block = self.__storage.read_block(index)
+        self.__remember(index, block)
+        return block
+
+    def __iter__(self):
+        return self.iter_blocks()
+
+    def iter_blocks(self, start=0):
+        """ Yields the blocks from height `start` on without updating the cache. """
+        for height in range(start, len(self)):
+            yield self.__peek(height)
+
+    def __peek(self, height):
+        """ Returns the block at `height` without updating the cache. """
+        block = self.__live.get(height)
+        if block is None:
+            block = self.__cold.get(height)
+        return block if block is not None else self.__storage.read_block(height)
+
+    def __remember(self, height, block):
+        with self.__cache_lock:
+            if height >= len(self) - self.live_blocks:
+                self.__live[height] = block
+            else:
+                self.__cold[height] = block
+                self.__cold.move_to_end(height)
+                while len(self.__cold) > COLD_CACHE_SIZE:
+                    self.__cold.popitem(last=False)
+
+    def __evict(self):
+        """ Drops the blocks which are no longer among the last `live_blocks` blocks. """
+        floor = len(self) - self.live_blocks
+        with self.__cache_lock:
+            for height in [height for height in self.__live if height < floor]:
+                del self.__live[height]
+
+    def append(self, block):
+        """ Saves a block at the end of the chain.
+
+        Returns:
+            True if the block was saved, False if saving it failed (the chain is unchanged).
+        """
+        return self.extend([block])
+
+    def extend(self, blocks):
+        """ Saves blocks at the end of the chain.
+
+        Returns:
+            True if the blocks were saved, False if saving them failed (the chain is
+            unchanged).
+        """
+        height = len(self)
+        if not self.__storage.append_blocks(blocks):
+            return False
+        self.__evict()
+        floor = len(self) - self.live_blocks
+        with self.__cache_lock:
+            for offset, block in enumerate(blocks):
+                if height + offset >= floor:
+                    self.__live[height + offset] = block
+        return True
+
+    def truncate(self, length):
+        """ Removes all blocks after the first `length` blocks of the chain. """
+        self.__storage.truncate(length)
+        with self.__cache_lock:
+            for cache in (self.__live, self.__cold):
+                for height in [height for height in cache if height >= length]:
+                    del cache[height]
+
+
+class ChainView:
+    """ A read-only, list-like view of the blocks of a `Blockchain`.
+
+    Nothing is copied when the view is made: blocks are read from the chain when they
+    are accessed, holding the read side of the blockchain's lock, and iterating reads
+    `VIEW_CHUNK_SIZE` blocks at a time, so only the blocks in use are kept in memory.
+    The chain may change between two reads. If it was rolled back meanwhile, iterating
+    stops at the last block linking up with the blocks already yielded.
+    """
+
+    def __init__(self, chain, lock):
+        self.__chain = chain
+        self.__lock = lock
+
+    def __len__(self):
+        with self.__lock.read():
+            return len(self.__chain)
+
+    def __getitem__(self, index):
+        with self.__lock.read():
+            return self.__chain[index]
+
+    def __iter__(self):
+        for chunk in self.iter_chunks():
+            yield from chunk
+
+    def iter_chunks(self, start=0, stop=None, size=VIEW_CHUNK_SIZE):
+        """ Yields the blocks from height `start` up to `stop` in lists of up to `size` blocks.
+
+        Arguments:
+            start (`int`, default to 0): The height of the first block.
+            stop (`int`, default to None): The height after the last block, or None to
+                read up to the end of the chain.
+            size (`int`): The number of blocks read at a time.
+        """
+        previous = None
+        height = start
+        while stop is None or height < stop:
+            end = height + size if stop is None else min(height + size, stop)
+            with self.__lock.read():
+                blocks = self.__chain[height:end]
+            if not blocks or (previous is not None and
+                              blocks[0].previous_hash != previous.hash):
+                return
+            yield blocks
+            previous = blocks[-1]
+            height += len(blocks)
+
+    def __repr__(self):
+        return f'<chain of {len(self)} blocks>'
+
+
+class SplicedChain:
+    """ A read-only, list-like view of the first `length` blocks of `chain` followed by
+    `blocks`. It lets blocks received from a peer be validated against the local blocks
+    before them (e.g. for retargeting) without copying the local chain. """
+
+    def __init__(self, chain, length, blocks):
+        self.__chain = chain
+        self.__length = length
+        self.__blocks = blocks
+
+    def __len__(self):
+        return self.__length + len(self.__blocks)
+
+    def __getitem__(self, height):
+        if height < 0:
+            height += len(self)
+        if 0 <= height < self.__length:
+            return self.__chain[height]
+        if height < 0:
+            raise IndexError('block index out of range')
+        return self.__blocks[height - self.__length]
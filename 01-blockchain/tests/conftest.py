@@ -0,0 +1,86 @@
+import pytest
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """ Runs a test inside a temporary directory, where nodes keep their data. """
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+
+class PeerResponse:
+    """ The parts of a `requests.Response` the blockchain reads. """
+
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self.headers = {'Content-Type': 'application/json'}
+        self.__payload = payload
+
+    def json(self):
+        return self.__payload
+
+
+class FakePeers:
+    """ Stands in for `PeerClient`: peer nodes are `Blockchain`s of the same process,
+    answering the requests `resolve` sends, and broadcasts get the status codes in
+    `statuses` (201 for every node by default).
+
+    Attributes:
+        nodes (`dict` of `str`: `Blockchain`): The peer blockchains by node URL.
+        statuses (`dict` of `str`: `int`): The status codes of broadcasts by node URL.
+        sent (`list` of `tuple`): The node URLs, paths, payloads and headers of the
+            broadcasts and relayed messages.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.statuses = {}
+        self.sent = []
+
+    def get(self, node, path, params=None, headers=None):
+        peer = self.nodes.get(node)
+        if peer is None:
+            return None
+        if path == '/chain/hashes':
+            heights = [int(height) for height in params['heights'].split(',')]
+            hashes = peer.get_block_hashes(heights)
+            return PeerResponse(200, {'length': peer.get_length(),
+                                      'hashes': {str(height): block_hash
+                                                 for height, block_hash in hashes.items()}})
+        if path == '/chain':
+            return PeerResponse(200, [block.to_dict()
+                                      for block in peer.chain[params.get('start', 0):]])
+        return PeerResponse(404, {})
+
+    def broadcast(self, nodes, path, payload, data=None, headers=None):
+        statuses = {}
+        for node in nodes:
+            self.sent.append((node, path, payload, headers))
+            statuses[node] = self.statuses.get(node, 201)
+        return statuses
+
+    def relay(self, nodes, path, payload, data=None, headers=None):
+        self.broadcast(nodes, path, payload, data, headers)
+
+    def forget(self, node):
+        pass
+
+
+@pytest.fixture
+def peers(workdir, monkeypatch):
+    """ Makes every `Blockchain` created by the test talk to the same `FakePeers`. """
+    fake_peers = FakePeers()
+    monkeypatch.setattr('blockchain.PeerClient', lambda: fake_peers)
+    return fake_peers
+
+
+@pytest.fixture
+def client(peers):
+    """ A Flask test client of a node with a fresh wallet. """
+    import node
+    node.create_app('test')
+    test_client = node.app.test_client()
+    assert test_client.post('/wallet').status_code == 201
+    yield test_client
+    node.blockchain.close()
@@ -0,0 +1,298 @@
+import json
+import os
+
+import blockchain as blockchain_module
+from blockchain import TX_ACCEPTED, TX_DECLINED, TX_DUPLICATE, TX_INVALID_DATA, Blockchain
+from wallet import Wallet
+
+
+def make_wallet():
+    """ Create a wallet with fresh keys which are not saved. """
+    wallet = Wallet(None)
+    wallet.create_keys()
+    return wallet
+
+
+def send(blockchain, wallet, recipient, amount):
+    signature = wallet.sign_transaction(wallet.public_key, recipient, amount)
+    assert blockchain.add_transaction(wallet.public_key, recipient, signature, amount) == TX_ACCEPTED
+
+
+def make_peer(peers, node, public_key, shared_blocks=()):
+    """ Create the blockchain of a peer node starting with the given blocks. """
+    peer = Blockchain(public_key, node)
+    for block in shared_blocks:
+        assert peer.add_block(block.to_dict())
+    peers.nodes[node] = peer
+    return peer
+
+
+def test_fork_rollback(peers):
+    alice, bob = make_wallet(), make_wallet()
+    local = Blockchain(alice.public_key, 'local')
+    local.mine_block()
+    send(local, alice, bob.public_key, 1.5)
+    local.mine_block()
+    send(local, alice, bob.public_key, 2.5)
+    assert local.get_balance() == 20 - 1.5 - 2.5
+
+    # A longer chain sharing the first block mined by the local node
+    remote = make_peer(peers, 'remote', bob.public_key, local.chain[1:2])
+    for _ in range(3):
+        remote.mine_block()
+    local.add_peer_node('remote')
+
+    assert local.resolve()
+    assert [block.hash for block in local.chain] == [block.hash for block in remote.chain]
+    assert local.verify_chain(full=True)
+    # The payment of the rolled back block is open again, next to the one never mined
+    assert sorted(tx.amount for tx in local.get_open_transactions()) == [1.5, 2.5]
+    assert local.get_balance() == 10 - 1.5 - 2.5
+    assert local.get_balance(bob.public_key) == 30
+
+    # The new chain and the open transactions were saved
+    local.close()
+    reopened = Blockchain(alice.public_key, 'local')
+    assert [block.hash for block in reopened.chain] == [block.hash for block in remote.chain]
+    assert sorted(tx.amount for tx in reopened.get_open_transactions()) == [1.5, 2.5]
+    reopened.close()
+    remote.close()
+
+
+def test_rollback_drops_payments_that_can_no_longer_be_afforded(peers):
+    alice, bob = make_wallet(), make_wallet()
+    local = Blockchain(alice.public_key, 'local')
+    local.mine_block()
+    send(local, alice, bob.public_key, 4)
+    local.mine_block()
+
+    # A longer chain without any block of the local node
+    remote = make_peer(peers, 'remote', bob.public_key)
+    for _ in range(3):
+        remote.mine_block()
+    local.add_peer_node('remote')
+
+    assert local.resolve()
+    assert local.get_length() == 4
+    assert local.get_open_transactions() == []
+    assert local.get_balance() == 0
+    local.close()
+    remote.close()
+
+
+def test_rollback_keeps_payments_confirmed_by_the_new_blocks(peers):
+    alice, bob = make_wallet(), make_wallet()
+    local = Blockchain(alice.public_key, 'local')
+    local.mine_block()
+    send(local, alice, bob.public_key, 3)
+    local.mine_block()
+
+    # The remote node mines the same payment in a block of its own
+    remote = make_peer(peers, 'remote', bob.public_key, local.chain[1:2])
+    send(remote, alice, bob.public_key, 3)
+    for _ in range(2):
+        remote.mine_block()
+    local.add_peer_node('remote')
+
+    assert local.resolve()
+    assert local.get_open_transactions() == []
+    assert local.get_balance() == 10 - 3
+    local.close()
+    remote.close()
+
+
+def test_shorter_or_unrelated_chains_are_not_taken(peers):
+    alice, bob = make_wallet(), make_wallet()
+    local = Blockchain(alice.public_key, 'local')
+    for _ in range(3):
+        local.mine_block()
+    tip = local.chain[-1].hash
+    remote = make_peer(peers, 'remote', bob.public_key)
+    remote.mine_block()
+    local.add_peer_node('remote')
+    local.add_peer_node('unreachable')
+
+    assert not local.resolve()
+    assert local.get_length() == 4 and local.chain[-1].hash == tip
+    local.close()
+    remote.close()
+
+
+def test_transaction_with_malformed_fields_is_not_opened(workdir):
+    alice = make_wallet()
+    local = Blockchain(alice.public_key, 'local')
+    local.mine_block()
+    signature = alice.sign_transaction(alice.public_key, 5, 1)
+    assert local.add_transaction(alice.public_key, 5, signature, 1) == TX_INVALID_DATA
+    assert local.get_open_transactions() == []
+    assert local.mine_block() is not None
+    local.close()
+
+
+def test_repeated_payment_of_the_node_is_queued_again(workdir):
+    alice, bob = make_wallet(), make_wallet()
+    local = Blockchain(alice.public_key, 'local')
+    local.mine_block()
+    send(local, alice, bob.public_key, 2)
+    send(local, alice, bob.public_key, 2)
+    assert len(local.get_open_transactions()) == 2
+    assert local.get_balance() == 10 - 4
+    block = local.mine_block()
+    assert [tx.amount for tx in block.transactions[:-1]] == [2, 2]
+    assert local.get_open_transactions() == []
+    assert local.get_balance(bob.public_key) == 4
+    local.close()
+
+
+def test_received_transaction_is_only_opened_once(workdir):
+    alice, bob = make_wallet(), make_wallet()
+    sender = Blockchain(alice.public_key, 'sender')
+    sender.mine_block()
+    receiver = Blockchain(bob.public_key, 'receiver')
+    assert receiver.add_block(sender.chain[1].to_dict())
+    signature = alice.sign_transaction(alice.public_key, bob.public_key, 2)
+    for outcome in (TX_ACCEPTED, TX_DUPLICATE):
+        assert receiver.add_transaction(alice.public_key, bob.public_key, signature, 2,
+                                        is_receiving=True) == outcome
+    assert len(receiver.get_open_transactions()) == 1
+    sender.close()
+    receiver.close()
+
+
+def test_transaction_declined_by_a_peer_stays_open(peers):
+    alice, bob = make_wallet(), make_wallet()
+    local = Blockchain(alice.public_key, 'local')
+    local.mine_block()
+    local.add_peer_node('remote')
+    peers.statuses['remote'] = 500
+    signature = alice.sign_transaction(alice.public_key, bob.public_key, 3)
+    assert local.add_transaction(alice.public_key, bob.public_key, signature, 3) == TX_DECLINED
+    assert [tx.amount for tx in local.get_open_transactions()] == [3]
+    local.close()
+
+
+def test_repeated_payments_survive_a_restart(workdir):
+    alice, bob = make_wallet(), make_wallet()
+    local = Blockchain(alice.public_key, 'local')
+    local.mine_block()
+    send(local, alice, bob.public_key, 1)
+    send(local, alice, bob.public_key, 1)
+    local.close()
+    reopened = Blockchain(None, 'local')
+    assert [tx.amount for tx in reopened.get_open_transactions()] == [1, 1]
+    reopened.close()
+
+
+def test_rollback_drops_transactions_with_forged_signatures(peers, monkeypatch):
+    alice, bob = make_wallet(), make_wallet()
+    local = Blockchain(alice.public_key, 'local')
+    local.mine_block()
+    # A block of a node which did not check the signatures holds a forged payment
+    signature = alice.sign_transaction(alice.public_key, bob.public_key, 1)
+    with monkeypatch.context() as patched:
+        patched.setattr(Wallet, 'verify_transaction', staticmethod(lambda transaction: True))
+        patched.setattr(Wallet, 'verify_transactions', staticmethod(lambda transactions: True))
+        assert local.add_transaction(alice.public_key, bob.public_key, signature, 5) == TX_ACCEPTED
+        local.mine_block()
+    send(local, alice, bob.public_key, 2)
+    local.mine_block()
+
+    remote = make_peer(peers, 'remote', bob.public_key, local.chain[1:2])
+    for _ in range(3):
+        remote.mine_block()
+    local.add_peer_node('remote')
+
+    assert local.resolve()
+    assert [tx.amount for tx in local.get_open_transactions()] == [2]
+    assert local.mine_block() is not None
+    local.close()
+    remote.close()
+
+
+def test_block_with_a_forged_signature_is_not_added(workdir, monkeypatch):
+    alice, bob = make_wallet(), make_wallet()
+    sender = Blockchain(alice.public_key, 'sender')
+    sender.mine_block()
+    signature = alice.sign_transaction(alice.public_key, bob.public_key, 1)
+    # The sender does not check signatures, e.g. it runs a modified version
+    with monkeypatch.context() as patched:
+        patched.setattr(Wallet, 'verify_transaction', staticmethod(lambda transaction: True))
+        patched.setattr(Wallet, 'verify_transactions', staticmethod(lambda transactions: True))
+        assert sender.add_transaction(alice.public_key, bob.public_key, signature, 5) == TX_ACCEPTED
+        forged_block = sender.mine_block()
+    receiver = Blockchain(bob.public_key, 'receiver')
+    assert receiver.add_block(sender.chain[1].to_dict())
+    assert not receiver.add_block(forged_block.to_dict())
+    assert receiver.get_length() == 2
+    assert receiver.get_balance(alice.public_key) == 10
+    sender.close()
+    receiver.close()
+
+
+def snapshot_paths(node):
+    directory = f'blockchain-{node}'
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.startswith('ledger-'))
+
+
+def test_ledger_is_restored_from_the_newest_snapshot(workdir):
+    alice, bob = make_wallet(), make_wallet()
+    local = Blockchain(alice.public_key, 'local')
+    for _ in range(3):
+        local.mine_block()
+    send(local, alice, bob.public_key, 5)
+    local.mine_block()
+    local.close()
+    newest = snapshot_paths('local')[-1]
+    assert newest.endswith(f'{5:010d}.json')
+
+    # Only the snapshot is read, not the blocks it accounts for
+    with open(newest) as f:
+        snapshot = json.load(f)
+    snapshot['ledger']['received'][bob.public_key] += 100
+    with open(newest, 'w') as f:
+        json.dump(snapshot, f)
+    reopened = Blockchain(alice.public_key, 'local')
+    assert reopened.get_balance() == 35 and reopened.get_balance(bob.public_key) == 105
+    reopened.close()
+
+
+def test_blocks_after_the_snapshot_are_replayed(workdir, monkeypatch):
+    monkeypatch.setattr(blockchain_module, 'SNAPSHOT_INTERVAL', 2)
+    alice, bob = make_wallet(), make_wallet()
+    local = Blockchain(alice.public_key, 'local')
+    for _ in range(4):
+        local.mine_block()
+    send(local, alice, bob.public_key, 5)
+    local.mine_block()
+    local.close()
+    # The snapshot saved on closing is lost, an older one is still there
+    os.remove(snapshot_paths('local')[-1])
+    assert snapshot_paths('local')
+    reopened = Blockchain(alice.public_key, 'local')
+    assert reopened.get_balance() == 45 and reopened.get_balance(bob.public_key) == 5
+    assert reopened.verify_chain(full=True)
+    reopened.close()
+
+
+def test_damaged_or_stale_snapshots_fall_back_to_replaying(workdir):
+    alice, bob = make_wallet(), make_wallet()
+    local = Blockchain(alice.public_key, 'local')
+    local.mine_block()
+    send(local, alice, bob.public_key, 4)
+    local.mine_block()
+    local.close()
+    path = snapshot_paths('local')[-1]
+    with open(path) as f:
+        snapshot = json.load(f)
+
+    for damaged in ('{"height": 3, "ledg', json.dumps(dict(snapshot, tip_hash='ab' * 32)),
+                    json.dumps(dict(snapshot, ledger=None))):
+        with open(path, 'w') as f:
+            f.write(damaged)
+        reopened = Blockchain(alice.public_key, 'local')
+        assert reopened.get_balance() == 16 and reopened.get_balance(bob.public_key) == 4
+        reopened.close()
+        # Closing saved a fresh snapshot over the damaged one
+        with open(path) as f:
+            assert json.load(f)['tip_hash'] == snapshot['tip_hash']
@@ -0,0 +1,93 @@
+import pytest
+
+from block import Block
+from codec import (CodecError, decode_block, decode_blocks, decode_transaction,
+                   encode_block, encode_blocks, encode_transaction)
+from transaction import Transaction
+from utility.merkle import merkle_root
+
+SENDER = 'ab' * 162
+RECIPIENT = 'cd' * 162
+SIGNATURE = 'ef' * 128
+
+
+def make_block(index=1):
+    transactions = [Transaction(SENDER, RECIPIENT, SIGNATURE, 2.5),
+                    Transaction(SENDER, RECIPIENT, SIGNATURE, 3),
+                    Transaction('MINING', RECIPIENT, '', 10)]
+    return Block(index, '12' * 32, transactions, 4242, timestamp=1600000000.5,
+                 target=2 ** 248, merkle_root=merkle_root([tx.tx_id for tx in transactions]))
+
+
+def test_transaction_round_trip_keeps_the_id():
+    for transaction in make_block().transactions:
+        decoded = decode_transaction(encode_transaction(transaction))
+        assert decoded.to_dict() == transaction.to_dict()
+        assert decoded.tx_id == transaction.tx_id
+
+
+def test_integer_and_float_amounts_stay_apart():
+    decoded = decode_transaction(encode_transaction(Transaction(SENDER, RECIPIENT, SIGNATURE, 3)))
+    assert isinstance(decoded.amount, int)
+    decoded = decode_transaction(encode_transaction(Transaction(SENDER, RECIPIENT, SIGNATURE, 3.0)))
+    assert isinstance(decoded.amount, float)
+
+
+def test_block_round_trip_keeps_the_hash():
+    block = make_block()
+    decoded = decode_block(encode_block(block))
+    assert decoded.to_dict() == block.to_dict()
+    assert decoded.hash == block.hash
+
+
+def test_legacy_block_round_trip():
+    block = Block(0, '', [], 100, timestamp=0)
+    decoded = decode_block(encode_block(block))
+    assert decoded.to_dict() == block.to_dict()
+    assert decoded.target is None and decoded.merkle_root is None
+
+
+def test_block_list_round_trip():
+    blocks = [make_block(index) for index in range(1, 4)]
+    decoded = decode_blocks(encode_blocks(blocks))
+    assert [block.hash for block in decoded] == [block.hash for block in blocks]
+
+
+@pytest.mark.parametrize('encode, decode, value', [
+    (encode_transaction, decode_transaction, make_block().transactions[0]),
+    (encode_block, decode_block, make_block()),
+])
+def test_truncated_data_is_rejected(encode, decode, value):
+    data = encode(value)
+    for length in range(len(data)):
+        with pytest.raises(CodecError):
+            decode(data[:length])
+
+
+def test_truncated_block_list_is_rejected():
+    blocks = [make_block(1), make_block(2)]
+    data = encode_blocks(blocks)
+    first_length = len(encode_blocks(blocks[:1]))
+    for length in range(len(data)):
+        if length in (0, first_length):
+            # Cut between two blocks: a shorter but complete list
+            assert len(decode_blocks(data[:length])) == (1 if length else 0)
+        else:
+            with pytest.raises(CodecError):
+                decode_blocks(data[:length])
+
+
+def test_trailing_data_and_unknown_versions_are_rejected():
+    data = encode_block(make_block())
+    with pytest.raises(CodecError):
+        decode_block(data + b'\x00')
+    with pytest.raises(CodecError):
+        decode_block(b'\xff' + data[1:])
+
+
+def test_values_of_the_wrong_type_are_not_encoded():
+    for transaction in (Transaction(SENDER, 5, SIGNATURE, 1),
+                        Transaction(SENDER, RECIPIENT, None, 1),
+                        Transaction(b'sender', RECIPIENT, SIGNATURE, 1)):
+        with pytest.raises(CodecError):
+            encode_transaction(transaction)
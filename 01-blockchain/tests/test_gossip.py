@@ -0,0 +1,66 @@
+import random
+
+from blockchain import TX_ACCEPTED, TX_DUPLICATE, Blockchain
+from gossip import TTL_HEADER, GossipRelay
+from wallet import Wallet
+
+PEERS = [f'localhost:{port}' for port in range(5001, 5011)]
+
+
+def test_without_fanout_only_new_messages_go_to_every_peer():
+    relay = GossipRelay()
+    assert not relay.enabled
+    assert relay.targets(PEERS) == (PEERS, None)
+    assert relay.targets(PEERS, ttl=5) == ([], None)
+
+
+def test_fanout_picks_random_peers_and_counts_down_the_ttl():
+    relay = GossipRelay(fanout=3, ttl=4, rng=random.Random(7))
+    nodes, ttl = relay.targets(PEERS)
+    assert len(set(nodes)) == 3 and set(nodes) <= set(PEERS) and ttl == 4
+    nodes, ttl = relay.targets(PEERS, ttl=4)
+    assert len(nodes) == 3 and ttl == 3
+    assert relay.targets(PEERS[:2], ttl=2) == (PEERS[:2], 1)
+    # A message which used up its hops is not sent on
+    assert relay.targets(PEERS, ttl=1) == ([], None)
+    assert relay.targets(PEERS, ttl=0) == ([], None)
+
+
+def test_seen_messages_are_recognized_until_forgotten():
+    relay = GossipRelay(fanout=2, seen_ids=3)
+    assert relay.see('a') and relay.see('b') and relay.see('c')
+    assert not relay.see('a')
+    assert relay.has_seen('a')
+    # 'b' was seen least recently, so it makes room for 'd'
+    assert relay.see('d')
+    assert not relay.has_seen('b')
+    assert relay.has_seen('a') and relay.has_seen('c') and relay.has_seen('d')
+
+
+def test_received_transaction_is_relayed_once(peers):
+    alice, bob = Wallet(None), Wallet(None)
+    alice.create_keys()
+    bob.create_keys()
+    sender = Blockchain(alice.public_key, 'sender')
+    sender.mine_block()
+    receiver = Blockchain(bob.public_key, 'receiver', gossip_fanout=2, gossip_ttl=4)
+    assert receiver.add_block(sender.chain[1].to_dict())
+    for node in PEERS:
+        receiver.add_peer_node(node)
+    peers.sent.clear()
+
+    signature = alice.sign_transaction(alice.public_key, bob.public_key, 2)
+    for outcome in (TX_ACCEPTED, TX_DUPLICATE):
+        assert receiver.add_transaction(alice.public_key, bob.public_key, signature, 2,
+                                        is_receiving=True, ttl=3) == outcome
+    assert len(peers.sent) == 2
+    assert all(headers == {TTL_HEADER: '2'} for _, _, _, headers in peers.sent)
+
+    # Mining the transaction does not make it new again
+    receiver.mine_block()
+    peers.sent.clear()
+    assert receiver.add_transaction(alice.public_key, bob.public_key, signature, 2,
+                                    is_receiving=True, ttl=3) == TX_DUPLICATE
+    assert peers.sent == []
+    sender.close()
+    receiver.close()
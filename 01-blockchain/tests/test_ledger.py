@@ -0,0 +1,76 @@
+import json
+
+from block import Block
+from ledger import Ledger
+from transaction import Transaction
+
+ALICE = 'ab' * 8
+BOB = 'cd' * 8
+
+
+def make_blocks():
+    return [
+        Block(1, '', [Transaction('MINING', ALICE, '', 10)], 0, timestamp=1),
+        Block(2, '', [Transaction(ALICE, BOB, 'ef', 4), Transaction('MINING', BOB, '', 10)],
+              0, timestamp=2),
+        Block(3, '', [Transaction(BOB, ALICE, 'ef', 1.5), Transaction('MINING', ALICE, '', 10)],
+              0, timestamp=3),
+    ]
+
+
+def balances(ledger):
+    return ledger.get_balance(ALICE), ledger.get_balance(BOB)
+
+
+def test_blocks_are_applied_and_reverted():
+    ledger = Ledger()
+    blocks = make_blocks()
+    for block in blocks:
+        ledger.apply_block(block)
+    assert balances(ledger) == (17.5, 12.5)
+    ledger.revert_block(blocks[-1])
+    assert balances(ledger) == (6, 14)
+    ledger.revert_block(blocks[-2])
+    assert balances(ledger) == (10, 0)
+    assert ledger.get_balance('unknown') == 0
+
+
+def test_open_transactions_reserve_their_amounts():
+    ledger = Ledger()
+    ledger.apply_block(make_blocks()[0])
+    first, second = Transaction(ALICE, BOB, 'ef', 3), Transaction(ALICE, BOB, 'ef', 2)
+    ledger.add_open_transaction(first)
+    ledger.add_open_transaction(second)
+    # The recipient only gets the amounts once they are mined
+    assert balances(ledger) == (5, 0)
+    ledger.remove_open_transaction(first)
+    assert balances(ledger) == (8, 0)
+    ledger.clear_open_transactions()
+    assert balances(ledger) == (10, 0)
+
+
+def test_rebuild_matches_incremental_updates():
+    blocks = make_blocks()
+    open_transaction = Transaction(BOB, ALICE, 'ef', 2)
+    incremental = Ledger()
+    for block in blocks:
+        incremental.apply_block(block)
+    incremental.add_open_transaction(open_transaction)
+    rebuilt = Ledger()
+    rebuilt.add_open_transaction(Transaction(ALICE, BOB, 'ef', 100))
+    rebuilt.rebuild(blocks, [open_transaction])
+    assert balances(rebuilt) == balances(incremental) == (17.5, 10.5)
+
+
+def test_snapshot_restores_confirmed_totals_only():
+    ledger = Ledger()
+    for block in make_blocks():
+        ledger.apply_block(block)
+    snapshot = json.loads(json.dumps(ledger.snapshot()))
+    ledger.add_open_transaction(Transaction(ALICE, BOB, 'ef', 5))
+    restored = Ledger()
+    restored.restore(snapshot)
+    assert balances(restored) == (17.5, 12.5)
+    # The restored ledger keeps being updated
+    restored.revert_block(make_blocks()[-1])
+    assert balances(restored) == (6, 14)
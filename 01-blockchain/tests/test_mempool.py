@@ -0,0 +1,37 @@
+from mempool import Mempool
+from transaction import Transaction
+
+
+def make_transaction(amount):
+    return Transaction('ab' * 8, 'cd' * 8, 'ef' * 8, amount)
+
+
+def test_transactions_keep_their_order():
+    transactions = [make_transaction(amount) for amount in (1, 2, 3)]
+    pool = Mempool(transactions)
+    assert pool.get_transactions() == transactions
+    assert list(pool) == transactions
+    assert len(pool) == 3
+
+
+def test_same_transaction_is_added_once():
+    pool = Mempool()
+    assert pool.add(make_transaction(1))
+    assert not pool.add(make_transaction(1))
+    assert len(pool) == 1
+
+
+def test_repeated_copies_are_removed_oldest_first():
+    first, second, other = make_transaction(1), make_transaction(1), make_transaction(2)
+    pool = Mempool()
+    pool.add(first)
+    pool.add(other)
+    assert pool.add(second, repeat=True)
+    assert len(pool) == 3 and first.tx_id in pool
+    assert pool.remove(first.tx_id) is first
+    assert first.tx_id in pool
+    assert pool.get_transactions() == [other, second]
+    assert pool.remove(first.tx_id) is second
+    assert first.tx_id not in pool
+    assert pool.remove(first.tx_id) is None
+    assert pool.get_transactions() == [other]
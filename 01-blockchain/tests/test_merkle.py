@@ -0,0 +1,45 @@
+import hashlib
+
+from utility.merkle import merkle_proof, merkle_root, verify_merkle_proof
+
+
+def make_ids(count):
+    return [hashlib.sha256(str(index).encode()).hexdigest() for index in range(count)]
+
+
+def test_every_transaction_has_a_valid_proof():
+    for count in (1, 2, 3, 5, 8, 13):
+        tx_ids = make_ids(count)
+        root = merkle_root(tx_ids)
+        for index, tx_id in enumerate(tx_ids):
+            proof = merkle_proof(tx_ids, index)
+            assert len(proof) <= max(count - 1, 0).bit_length()
+            assert verify_merkle_proof(tx_id, proof, root)
+
+
+def test_single_transaction_has_an_empty_proof():
+    tx_ids = make_ids(1)
+    assert merkle_proof(tx_ids, 0) == []
+    assert verify_merkle_proof(tx_ids[0], [], merkle_root(tx_ids))
+
+
+def test_proof_does_not_fit_other_transactions_or_roots():
+    tx_ids = make_ids(6)
+    root = merkle_root(tx_ids)
+    proof = merkle_proof(tx_ids, 2)
+    assert not verify_merkle_proof(tx_ids[3], proof, root)
+    assert not verify_merkle_proof(tx_ids[2], proof, merkle_root(make_ids(7)))
+
+
+def test_tampered_proofs_are_rejected():
+    tx_ids = make_ids(6)
+    root = merkle_root(tx_ids)
+    proof = merkle_proof(tx_ids, 2)
+    flipped = [dict(step) for step in proof]
+    flipped[0]['position'] = 'left' if proof[0]['position'] == 'right' else 'right'
+    assert not verify_merkle_proof(tx_ids[2], flipped, root)
+    assert not verify_merkle_proof(tx_ids[2], proof[:-1], root)
+    assert not verify_merkle_proof(tx_ids[2], [{'hash': 'zz', 'position': 'left'}], root)
+    assert not verify_merkle_proof(tx_ids[2], [{'position': 'left'}], root)
+    assert not verify_merkle_proof(tx_ids[2], [{'hash': proof[0]['hash'], 'position': 'up'}], root)
+    assert not verify_merkle_proof('not hex', proof, root)
@@ -0,0 +1,21 @@
+from block import Block
+from transaction import Transaction
+from utility.merkle import merkle_root
+from utility.mining import ProofOfWorkMiner
+from utility.verification import Verification
+
+
+def make_block(target):
+    transactions = [Transaction('MINING', 'cd' * 10, '', 10)]
+    return Block(1, 'ab' * 32, transactions, 0, timestamp=1600000000, target=target,
+                 merkle_root=merkle_root([tx.tx_id for tx in transactions]))
+
+
+def test_worker_processes_find_a_valid_proof():
+    block = make_block(2 ** 244)
+    miner = ProofOfWorkMiner(workers=2)
+    proof = miner.find_header_proof(block.header_prefix(), block.target)
+    mined = Block(1, block.previous_hash, block.transactions, proof, block.timestamp,
+                  block.target, block.merkle_root)
+    assert Verification.valid_header_proof(mined.header(), block.target)
+    assert miner.last_hashes > 0
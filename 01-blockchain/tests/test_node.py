@@ -0,0 +1,122 @@
+from block import Block
+from codec import BINARY_MIMETYPE, decode_blocks
+from metrics import metrics
+from node import MAX_BATCH_SIZE
+
+
+def test_transaction_with_a_malformed_recipient_is_rejected(client):
+    client.post('/mine')
+    response = client.post('/transaction', json={'recipient': 5, 'amount': 1})
+    assert response.status_code == 400
+    assert client.get('/balance').get_json()['funds'] == 10
+    assert client.get('/transactions').get_json() == []
+    assert client.post('/mine').status_code == 201
+
+
+def test_broadcast_transaction_with_malformed_fields_is_rejected(client):
+    transaction = {'sender': 'ab' * 8, 'recipient': 5, 'amount': 1, 'signature': 'cd' * 8}
+    assert client.post('/broadcast-transaction', json=transaction).status_code == 400
+    transaction = {'sender': 'ab' * 8, 'recipient': 'ef' * 8, 'amount': 1, 'signature': [1]}
+    response = client.post('/broadcast-transactions', json={'transactions': [transaction]})
+    assert response.status_code == 400
+    assert client.get('/transactions').get_json() == []
+
+
+def test_batch_items_with_malformed_fields_are_rejected(client):
+    client.post('/mine')
+    response = client.post('/transactions/batch', json={'transactions': [
+        {'recipient': 5, 'amount': 1},
+        {'sender': 'ab' * 8, 'recipient': 'cd' * 8, 'amount': 1, 'signature': None},
+        {'recipient': 'Bob', 'amount': 1},
+    ]})
+    results = response.get_json()['results']
+    assert [result['result'] for result in results] == ['invalid data', 'invalid data', 'accepted']
+    assert client.post('/mine').status_code == 201
+
+
+def test_paying_the_same_amount_twice_queues_two_payments(client):
+    client.post('/mine')
+    for _ in range(2):
+        response = client.post('/transaction', json={'recipient': 'Bob', 'amount': 1})
+        assert response.status_code == 201
+    assert len(client.get('/transactions').get_json()) == 2
+    assert client.get('/balance').get_json()['funds'] == 8
+
+
+def test_payment_declined_by_a_peer_is_reported_as_added(client, peers):
+    client.post('/mine')
+    client.post('/node', json={'node': 'remote'})
+    peers.statuses['remote'] = 500
+    response = client.post('/transaction', json={'recipient': 'Bob', 'amount': 1})
+    assert response.status_code == 201
+    assert 'declined' in response.get_json()['message']
+    assert len(client.get('/transactions').get_json()) == 1
+
+
+def test_metrics_include_the_key_caches(client, monkeypatch):
+    assert client.get('/metrics').status_code == 404
+    monkeypatch.setattr(metrics, 'enabled', True)
+    client.post('/mine')
+    client.post('/transaction', json={'recipient': 'Bob', 'amount': 1})
+    try:
+        text = client.get('/metrics').get_data(as_text=True)
+    finally:
+        metrics.reset()
+    assert '# TYPE key_cache_hits_total counter' in text
+    assert 'key_cache_misses_total{cache="signers"}' in text
+    assert 'key_cache_size{cache="verifiers"}' in text
+
+
+def test_chain_is_served_in_ranges_with_an_etag(client):
+    for _ in range(3):
+        client.post('/mine')
+    response = client.get('/chain')
+    assert response.status_code == 200
+    assert response.headers['X-Chain-Length'] == '4'
+    blocks = response.get_json()
+    assert [block['index'] for block in blocks] == [0, 1, 2, 3]
+    response = client.get('/chain?start=1&limit=2')
+    assert response.get_json() == blocks[1:3]
+    assert client.get('/chain?start=3&limit=5').get_json() == blocks[3:]
+    assert client.get('/chain?start=-1').status_code == 400
+
+    etag = client.get('/chain').headers['ETag']
+    assert client.get('/chain', headers={'If-None-Match': etag}).status_code == 304
+    # Another range or encoding has an ETag of its own
+    assert client.get('/chain?start=1', headers={'If-None-Match': etag}).status_code == 200
+    response = client.get('/chain', headers={'If-None-Match': etag,
+                                             'Accept': BINARY_MIMETYPE})
+    assert response.status_code == 200
+    assert [block.hash for block in decode_blocks(response.data)] == \
+        [Block.from_dict(block).hash for block in blocks]
+    client.post('/mine')
+    assert client.get('/chain', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_batch_reports_every_item_and_is_broadcast_once(client, peers):
+    client.post('/mine')
+    client.post('/node', json={'node': 'remote'})
+    sender = client.get('/wallet').get_json()['public_key']
+    response = client.post('/transactions/batch', json={'transactions': [
+        {'recipient': 'Bob', 'amount': 4},
+        {'recipient': 'Carol'},
+        {'recipient': 'Bob', 'amount': -1},
+        {'sender': sender, 'recipient': 'Eve', 'amount': 1, 'signature': 'ab' * 128},
+        {'recipient': 'Dave', 'amount': 5},
+        {'recipient': 'Bob', 'amount': 4},
+    ]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [result['result'] for result in body['results']] == [
+        'accepted', 'Required data is missing.', 'invalid amount', 'invalid signature',
+        'accepted', 'insufficient funds']
+    assert body['funds'] == 1
+    assert [tx['amount'] for tx in client.get('/transactions').get_json()] == [4, 5]
+    assert [path for _, path, _, _ in peers.sent] == ['/broadcast-transactions']
+    assert len(peers.sent[0][2]['transactions']) == 2
+
+
+def test_batch_size_is_limited(client):
+    items = [{'recipient': 'Bob', 'amount': 1}] * (MAX_BATCH_SIZE + 1)
+    assert client.post('/transactions/batch', json={'transactions': items}).status_code == 413
+    assert client.post('/transactions/batch', json={'items': []}).status_code == 400
@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from utility.rwlock import ReadWriteLock
+
+
+def test_read_side_is_reentrant():
+    lock = ReadWriteLock()
+    with lock.read():
+        with lock.read():
+            pass
+    # Fully released: a writer gets in right away
+    with lock.write():
+        pass
+
+
+def test_write_side_is_reentrant_and_may_read():
+    lock = ReadWriteLock()
+    with lock.write():
+        with lock.write():
+            with lock.read():
+                pass
+        with lock.read():
+            pass
+    with lock.read():
+        pass
+
+
+def test_read_lock_cannot_be_upgraded():
+    lock = ReadWriteLock()
+    with lock.read():
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+    # The failed upgrade left the lock usable
+    with lock.write():
+        pass
+
+
+def test_readers_share_the_lock():
+    lock = ReadWriteLock()
+    barrier = threading.Barrier(3, timeout=5)
+
+    def read():
+        with lock.read():
+            # Only passes if all readers hold the read side at once
+            barrier.wait()
+
+    threads = [threading.Thread(target=read) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not barrier.broken
+
+
+def test_writer_waits_for_readers_and_blocks_new_ones():
+    lock = ReadWriteLock()
+    events = []
+    writer_waiting = threading.Event()
+
+    def write():
+        writer_waiting.set()
+        with lock.write():
+            events.append('write')
+
+    def late_read():
+        with lock.read():
+            events.append('late read')
+
+    with lock.read():
+        writer = threading.Thread(target=write)
+        writer.start()
+        writer_waiting.wait(5)
+        # Give the writer time to queue up behind the reader
+        writer.join(0.2)
+        assert events == []
+        reader = threading.Thread(target=late_read)
+        reader.start()
+        reader.join(0.2)
+        # Writers are preferred, so the new reader waits as well
+        assert events == []
+    writer.join(5)
+    reader.join(5)
+    assert events == ['write', 'late read']
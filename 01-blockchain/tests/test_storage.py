@@ -0,0 +1,236 @@
+import json
+import os
+import time
+
+import pytest
+
+import storage as storage_module
+from block import Block
+from codec import CodecError
+from storage import (DURABILITY_ALWAYS, DURABILITY_BATCHED, DURABILITY_NONE, INDEX_FILE,
+                     SEGMENT_SIZE, ChainStorage)
+from transaction import Transaction
+
+
+def make_blocks(count):
+    return [Block(index, 'ab' * 32, [Transaction('MINING', 'cd' * 10, '', 10)], index,
+                  timestamp=index) for index in range(count)]
+
+
+def save_blocks(blocks):
+    storage = ChainStorage('test')
+    storage.load()
+    storage.append_blocks(blocks)
+    storage.close()
+    return storage
+
+
+def load():
+    storage = ChainStorage('test')
+    storage.load()
+    return storage
+
+
+def assert_blocks(storage, blocks):
+    assert len(storage) == len(blocks)
+    assert [block.hash for block in storage.iter_blocks()] == [block.hash for block in blocks]
+
+
+def test_blocks_survive_reopening(workdir):
+    blocks = make_blocks(SEGMENT_SIZE + 5)
+    save_blocks(blocks)
+    storage = load()
+    assert_blocks(storage, blocks)
+    assert storage.read_block(SEGMENT_SIZE + 2).proof == SEGMENT_SIZE + 2
+    storage.close()
+
+
+def test_torn_record_is_dropped(workdir):
+    blocks = make_blocks(5)
+    storage = save_blocks(blocks)
+    segment = os.path.join(storage.directory, 'blocks-000000.log')
+    size = os.path.getsize(segment)
+    # The process died while appending a sixth block
+    with open(segment, 'ab') as f:
+        f.write(b'\x00\x00\x01\x00partial')
+    storage = load()
+    assert_blocks(storage, blocks)
+    assert os.path.getsize(segment) == size
+    # New blocks go right after the last intact record
+    storage.append_blocks(make_blocks(6)[5:])
+    storage.close()
+    assert_blocks(load(), make_blocks(6))
+
+
+def test_corrupted_last_record_is_dropped(workdir):
+    blocks = make_blocks(5)
+    storage = save_blocks(blocks)
+    segment = os.path.join(storage.directory, 'blocks-000000.log')
+    with open(segment, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xff]))
+    storage = load()
+    assert_blocks(storage, blocks[:4])
+    storage.close()
+
+
+def test_missing_index_entries_are_recovered(workdir):
+    blocks = make_blocks(SEGMENT_SIZE + 10)
+    storage = save_blocks(blocks)
+    index = os.path.join(storage.directory, INDEX_FILE)
+    # The index update was lost, e.g. the process died right after appending
+    with open(index, 'r+b') as f:
+        f.truncate(8 * 500 + 3)
+    storage = load()
+    assert_blocks(storage, blocks)
+    assert os.path.getsize(index) == 8 * len(blocks)
+    storage.close()
+
+
+def test_damaged_index_is_rebuilt(workdir):
+    blocks = make_blocks(20)
+    storage = save_blocks(blocks)
+    index = os.path.join(storage.directory, INDEX_FILE)
+    with open(index, 'wb') as f:
+        f.write(b'\xff' * 80)
+    storage = load()
+    assert_blocks(storage, blocks)
+    storage.close()
+    os.remove(index)
+    assert_blocks(load(), blocks)
+
+
+def test_truncate_removes_later_segments(workdir):
+    blocks = make_blocks(2 * SEGMENT_SIZE + 5)
+    storage = save_blocks(blocks)
+    storage = load()
+    storage.truncate(SEGMENT_SIZE - 1)
+    assert not os.path.exists(os.path.join(storage.directory, 'blocks-000002.log'))
+    storage.append_blocks(blocks[SEGMENT_SIZE - 1:SEGMENT_SIZE + 1])
+    storage.close()
+    assert_blocks(load(), blocks[:SEGMENT_SIZE + 1])
+
+
+def test_failed_append_leaves_the_log_unchanged(workdir, monkeypatch):
+    blocks = make_blocks(SEGMENT_SIZE + 5)
+    storage = save_blocks(blocks[:SEGMENT_SIZE - 2])
+    sizes = {name: os.path.getsize(os.path.join(storage.directory, name))
+             for name in os.listdir(storage.directory)}
+    storage = load()
+    encode_block = storage_module.encode_block
+
+    def fail_on_proof(block):
+        if block.proof == SEGMENT_SIZE + 1:
+            raise CodecError('Value does not fit.')
+        return encode_block(block)
+
+    # The third block goes to a new segment, the fourth cannot be encoded
+    monkeypatch.setattr(storage_module, 'encode_block', fail_on_proof)
+    assert not storage.append_blocks(blocks[SEGMENT_SIZE - 2:SEGMENT_SIZE + 2])
+    assert len(storage) == SEGMENT_SIZE - 2
+    assert {name: os.path.getsize(os.path.join(storage.directory, name))
+            for name in os.listdir(storage.directory)} == sizes
+    monkeypatch.setattr(storage_module, 'encode_block', encode_block)
+    assert storage.append_blocks(blocks[SEGMENT_SIZE - 2:])
+    storage.close()
+    assert_blocks(load(), blocks)
+
+
+def test_legacy_file_is_kept_if_the_import_fails(workdir):
+    block_dicts = [block.to_dict() for block in make_blocks(3)]
+    block_dicts[2]['transactions'][0]['recipient'] = 5
+    with open('blockchain-test.txt', mode='w') as f:
+        f.write(json.dumps(block_dicts) + '\n[]\n[]')
+    storage = load()
+    assert len(storage) == 0
+    assert os.path.exists('blockchain-test.txt')
+    assert not os.path.exists('blockchain-test.txt.imported')
+    storage.close()
+
+    block_dicts[2]['transactions'][0]['recipient'] = 'cd' * 10
+    with open('blockchain-test.txt', mode='w') as f:
+        f.write(json.dumps(block_dicts) + '\n[]\n[]')
+    assert_blocks(load(), make_blocks(3))
+    assert os.path.exists('blockchain-test.txt.imported')
+
+
+def open_transactions_file(storage):
+    path = os.path.join(storage.directory, 'open_transactions.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def count_fsyncs(monkeypatch):
+    calls = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: calls.append(fd) or fsync(fd))
+    return calls
+
+
+def test_always_fsync_writes_every_change_right_away(workdir, monkeypatch):
+    storage = ChainStorage('test', DURABILITY_ALWAYS)
+    storage.load()
+    fsyncs = count_fsyncs(monkeypatch)
+    transactions = [Transaction('ab' * 8, 'cd' * 8, 'ef' * 8, 1)]
+    storage.save_open_transactions(transactions, 3)
+    assert open_transactions_file(storage) == {
+        'height': 3, 'transactions': [tx.to_dict() for tx in transactions]}
+    assert len(fsyncs) == 1
+    storage.close()
+
+
+def test_batched_changes_are_written_together(workdir):
+    storage = ChainStorage('test', DURABILITY_BATCHED, flush_interval=60000, flush_changes=1000)
+    storage.load()
+    for height in range(1, 6):
+        storage.save_open_transactions([], height)
+    # Nothing is due yet; flush writes the latest state only
+    assert open_transactions_file(storage) is None
+    storage.flush()
+    assert open_transactions_file(storage) == {'height': 5, 'transactions': []}
+    storage.save_peer_nodes(['localhost:5001'])
+    storage.close()
+    assert ChainStorage('test').load() == ([], 5, ['localhost:5001'])
+
+
+def test_flusher_writes_when_enough_changes_are_queued(workdir):
+    storage = ChainStorage('test', DURABILITY_BATCHED, flush_interval=60000, flush_changes=3)
+    storage.load()
+    for height in range(1, 4):
+        storage.save_open_transactions([], height)
+    deadline = time.monotonic() + 5
+    while open_transactions_file(storage) is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert open_transactions_file(storage) == {'height': 3, 'transactions': []}
+    storage.close()
+
+
+def test_flusher_writes_when_the_interval_is_over(workdir):
+    storage = ChainStorage('test', DURABILITY_BATCHED, flush_interval=20, flush_changes=1000)
+    storage.load()
+    storage.save_open_transactions([], 1)
+    deadline = time.monotonic() + 5
+    while open_transactions_file(storage) is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert open_transactions_file(storage) == {'height': 1, 'transactions': []}
+    storage.close()
+
+
+def test_durability_none_never_fsyncs(workdir, monkeypatch):
+    storage = ChainStorage('test', DURABILITY_NONE)
+    storage.load()
+    fsyncs = count_fsyncs(monkeypatch)
+    storage.append_blocks(make_blocks(3))
+    storage.save_open_transactions([], 3)
+    storage.close()
+    assert fsyncs == []
+    assert ChainStorage('test').load() == ([], 3, [])
+
+
+def test_unknown_durability_mode_is_rejected():
+    with pytest.raises(ValueError):
+        ChainStorage('test', 'sometimes')
@@ -0,0 +1,30 @@
+from metrics import metrics
+from transaction import Transaction
+from wallet import PARALLEL_VERIFY_THRESHOLD, Wallet
+
+
+def make_transactions(count):
+    wallet = Wallet(None)
+    wallet.create_keys()
+    transactions = []
+    for amount in range(1, count + 1):
+        signature = wallet.sign_transaction(wallet.public_key, 'cd' * 10, amount)
+        transactions.append(Transaction(wallet.public_key, 'cd' * 10, signature, amount))
+    return transactions
+
+
+def test_worker_processes_verify_large_batches(monkeypatch):
+    transactions = make_transactions(PARALLEL_VERIFY_THRESHOLD + 6)
+    forged = transactions[-3]
+    transactions[-3] = Transaction(forged.sender, forged.recipient, forged.signature, 1000)
+    monkeypatch.setattr(metrics, 'enabled', True)
+    metrics.reset()
+    try:
+        valid = Wallet.verify_each(transactions)
+        assert valid == [True] * (len(transactions) - 3) + [False, True, True]
+        # The verifications done by the workers are recorded by this process
+        assert f'signature_verify_seconds_count {len(transactions)}' in metrics.render()
+        assert not Wallet.verify_transactions(transactions)
+        assert Wallet.verify_transactions(transactions[:-3])
+    finally:
+        metrics.reset()
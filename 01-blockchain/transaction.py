@@ -1,11 +1,23 @@
+import json
+import sys
 from collections import OrderedDict
 
+from utility.hash_util import hash_string_256
 from utility.printable import Printable
 
 
+def _intern(value):
+    # Data received from other nodes is not guaranteed to hold strings
+    return sys.intern(value) if type(value) is str else value
+
+
 class Transaction(Printable):
     """ Represent each transaction of sending/receiving coins. """
 
+    # Transactions are the most numerous objects of a node, so they keep their
+    # attributes in slots instead of a per-object `__dict__`
+    __slots__ = ('sender', 'recipient', 'amount', 'signature', '__tx_id')
+
     def __init__(self, sender, recipient, signature, amount):
         """ Constructor.
 
@@ -15,10 +27,22 @@ class Transaction(Printable):
             signature (`str`): The signature of the transaction.
             amount (`float`): The amount of coins sent with the transaction.
         """
-        self.sender = sender
-        self.recipient = recipient
+        # The same few public keys appear in many transactions. Interning them lets all
+        # transactions share one copy of each key instead of one copy per transaction.
+        self.sender = _intern(sender)
+        self.recipient = _intern(recipient)
         self.amount = amount
         self.signature = signature
+        self.__tx_id = None
+
+    @property
+    def tx_id(self):
+        """ The id of the transaction: the hash of all its fields including the signature.
+        It is calculated the first time it is needed. """
+        if self.__tx_id is None:
+            self.__tx_id = hash_string_256(
+                json.dumps(self.to_dict(), sort_keys=True).encode('utf-8'))
+        return self.__tx_id
 
     def to_ordered_dict(self):
         """ Convert the transaction object into an `OrderedDict`.
@@ -37,3 +61,18 @@ class Transaction(Printable):
             ('recipient', self.recipient),
             ('amount', self.amount)
         ])
+
+    def to_dict(self):
+        """ Convert the transaction object into a JSON-serializable dictionary
+        including its signature. """
+        return {
+            'sender': self.sender,
+            'recipient': self.recipient,
+            'amount': self.amount,
+            'signature': self.signature
+        }
+
+    @classmethod
+    def from_dict(cls, tx):
+        """ Create a transaction object from a dictionary made by `to_dict`. """
+        return cls(tx['sender'], tx['recipient'], tx['signature'], tx['amount'])
@@ -1,5 +1,9 @@
 from utility.hash_util import hash_block, hash_string_256
+from utility.merkle import merkle_proof, merkle_root, verify_merkle_proof
+from utility.mining import ProofOfWorkMiner
 from utility.printable import Printable
+from utility.rwlock import ReadWriteLock
 from utility.verification import Verification
 
-__all__ = ['hash_block', 'hash_string_256', 'Printable', 'Verification']
+__all__ = ['hash_block', 'hash_string_256', 'merkle_proof', 'merkle_root', 'verify_merkle_proof',
+           'ProofOfWorkMiner', 'Printable', 'ReadWriteLock', 'Verification']
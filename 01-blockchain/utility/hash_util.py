@@ -12,13 +12,24 @@ def hash_string_256(string):
 def hash_block(block):
     """ Hash the given :block: and return that hash value.
 
+    Blocks with a Merkle root are identified by the hash of their fixed-size header,
+    which commits to the transactions through the Merkle root.
+
     Arguments:
         :block: the block to be hashed
     """
-    # Get a dictionary whose key-value pairs are attributes and values of the 'block' object.
-    # Then copy that dictionary so that the hash function later on will not cause any affects
-    # to the original 'block' object
-    hashable_block = block.__dict__.copy()
-    hashable_block['transactions'] = [tx.to_ordered_dict()
-                                      for tx in hashable_block['transactions']]
+    if block.merkle_root is not None:
+        return hash_string_256(block.header())
+    # Build a dictionary out of the attributes that make up the 'block' (any cached or
+    # helper attributes of the object are deliberately left out of the hash)
+    hashable_block = {
+        'index': block.index,
+        'previous_hash': block.previous_hash,
+        'timestamp': block.timestamp,
+        'transactions': [tx.to_ordered_dict() for tx in block.transactions],
+        'proof': block.proof
+    }
+    # Blocks mined before targets were introduced keep their original hash
+    if block.target is not None:
+        hashable_block['target'] = block.target
     return hash_string_256(json.dumps(hashable_block, sort_keys=True).encode('utf-8'))
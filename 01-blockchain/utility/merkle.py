@@ -0,0 +1,79 @@
+import hashlib
+
+__all__ = ['merkle_root', 'merkle_proof', 'verify_merkle_proof']
+
+# Prefix of the data hashed for inner nodes, so that no inner node can be passed off as a
+# transaction id (transaction ids are hashes of JSON text, which never starts with it)
+_NODE_PREFIX = b'\x01'
+
+
+def _parent(left, right):
+    return hashlib.sha256(_NODE_PREFIX + left + right).digest()
+
+
+def _levels(tx_ids):
+    """ Build the levels of the Merkle tree of the given transaction ids, from the leaves
+    up to the root. A node without a sibling is moved up to the next level unchanged. """
+    levels = [[bytes.fromhex(tx_id) for tx_id in tx_ids]]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [_parent(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def merkle_root(tx_ids):
+    """ Calculate the Merkle root of a list of transaction ids.
+
+    Arguments:
+        tx_ids (:obj:`list` of `str`): The hex encoded ids of the transactions, in block order.
+
+    Returns:
+        The hex encoded root (the SHA256 of nothing for an empty list).
+    """
+    if not tx_ids:
+        return hashlib.sha256(b'').hexdigest()
+    return _levels(tx_ids)[-1][0].hex()
+
+
+def merkle_proof(tx_ids, index):
+    """ Build the inclusion proof of the transaction at :index: of :tx_ids:.
+
+    Returns:
+        A list with one step per tree level, each a `dict` with the hex encoded `hash`
+        of the sibling node and its `position` (`'left'` or `'right'`) relative to the
+        node being proven. The list has about log2(len(tx_ids)) steps.
+    """
+    proof = []
+    for level in _levels(tx_ids)[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append({
+                'hash': level[sibling].hex(),
+                'position': 'left' if sibling < index else 'right'
+            })
+        index //= 2
+    return proof
+
+
+def verify_merkle_proof(tx_id, proof, root):
+    """ Check that a proof made by `merkle_proof` links the transaction id to the root.
+
+    Returns:
+        True if the proof is valid, False otherwise.
+    """
+    try:
+        node = bytes.fromhex(tx_id)
+        for step in proof:
+            sibling = bytes.fromhex(step['hash'])
+            if step['position'] == 'left':
+                node = _parent(sibling, node)
+            elif step['position'] == 'right':
+                node = _parent(node, sibling)
+            else:
+                return False
+        return node.hex() == root
+    except (KeyError, TypeError, ValueError):
+        return False
@@ -0,0 +1,113 @@
+import os
+from time import perf_counter
+
+from lazy_import import lazy_import
+from utility.verification import Verification
+
+__all__ = ['ProofOfWorkMiner']
+
+# Worker processes are only needed when mining on several CPU cores
+multiprocessing = lazy_import('multiprocessing')
+
+# Number of proofs each worker tries between two checks of the stop signal
+CHECK_INTERVAL = 1000
+
+
+def _search_proof(prefix, target_bytes, start, step, found, results):
+    """ Tries the proofs `start`, `start + step`, `start + 2 * step`, ... until one of them
+    is valid or another worker signals that it has found a valid proof.
+
+    The outcome is put into the `results` queue as a tuple of the valid proof found by this
+    worker (or `None`) and the number of proofs tried. """
+    hasher = Verification.proof_hasher(prefix)
+    proof = start
+    tried = 0
+    while not found.is_set():
+        for _ in range(CHECK_INTERVAL):
+            tried += 1
+            if Verification.valid_proof_from_hasher(hasher, proof, target_bytes, header=True):
+                found.set()
+                results.put((proof, tried))
+                return
+            proof += step
+    results.put((None, tried))
+
+
+class ProofOfWorkMiner:
+    """ Searches for 'proof-of-work' numbers, optionally on several CPU cores.
+
+    The block header without its proof is hashed only once per search; each tried proof
+    continues from a copy of that SHA256 midstate.
+
+    With more than one worker the nonce space is split across worker processes:
+    worker `i` of `n` tries the proofs `i`, `i + n`, `i + 2n`, ... and all workers stop
+    as soon as one of them finds a valid proof.
+
+    Attributes:
+        workers (`int`): The number of worker processes. 1 mines in the calling process,
+            0 (or `None`) uses one worker per CPU core.
+        last_hashes (`int`): The number of proofs tried by the last search.
+        last_hash_rate (`float`): The hashes per second achieved by the last search.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers or os.cpu_count() or 1
+        self.last_hashes = 0
+        self.last_hash_rate = 0.0
+
+    def find_header_proof(self, header_prefix, target):
+        """ Finds a proof that completes a block header so that the hash of the header
+        is lower than the target (see `Verification.valid_header_proof`).
+
+        Arguments:
+            header_prefix (`bytes`): The header of the block to be mined without its proof
+                (see `Block.header_prefix`).
+            target (`int`): The target of the block to be mined.
+
+        Returns:
+            The found proof of work number.
+        """
+        return self.__search(header_prefix, target)
+
+    def __search(self, prefix, target):
+        started = perf_counter()
+        target_bytes = Verification.target_bytes(target)
+        if self.workers <= 1:
+            hasher = Verification.proof_hasher(prefix)
+            proof = 0
+            while not Verification.valid_proof_from_hasher(hasher, proof, target_bytes,
+                                                           header=True):
+                proof += 1
+            hashes = proof + 1
+        else:
+            proof, hashes = self.__find_proof_in_parallel(prefix, target_bytes)
+        elapsed = perf_counter() - started
+        self.last_hashes = hashes
+        self.last_hash_rate = hashes / elapsed if elapsed > 0 else 0.0
+        return proof
+
+    def __find_proof_in_parallel(self, prefix, target_bytes):
+        # A forked worker would inherit the locks held by the other threads of the node
+        # (e.g. one serving a request), so the workers start from a fresh interpreter
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() \
+            else 'spawn'
+        context = multiprocessing.get_context(method)
+        found = context.Event()
+        results = context.Queue()
+        processes = [context.Process(
+            target=_search_proof,
+            args=(prefix, target_bytes, start, self.workers, found, results),
+            daemon=True) for start in range(self.workers)]
+        for process in processes:
+            process.start()
+        proof = None
+        hashes = 0
+        # Every worker reports exactly once, either with its proof or after being stopped
+        for _ in processes:
+            worker_proof, tried = results.get()
+            hashes += tried
+            if proof is None and worker_proof is not None:
+                proof = worker_proof
+        for process in processes:
+            process.join()
+        return proof, hashes
@@ -1,6 +1,19 @@
 class Printable:
     """ A general class for other child class to inherit and
-    get printed out as dictionaries. """
+    get printed out as dictionaries.
+
+    Child classes may declare `__slots__` instead of keeping their attributes in
+    a `__dict__`; the printed data is then taken from the slots.
+    """
+
+    __slots__ = ()
 
     def __repr__(self):
-        return str(self.__dict__)
+        attributes = dict(getattr(self, '__dict__', {}))
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if hasattr(self, name):
+                    attributes[name] = getattr(self, name)
+        # Private attributes (e.g. cached values) are not part of the printed data
+        return str({key: value for key, value in attributes.items()
+                    if not key.startswith('_')})
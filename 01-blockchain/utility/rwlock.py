@@ -0,0 +1,103 @@
+import threading
+from contextlib import contextmanager
+
+__all__ = ['ReadWriteLock']
+
+
+class ReadWriteLock:
+    """ A lock letting any number of readers in at the same time, or a single writer.
+
+    Writers are preferred: once a writer waits, new readers wait until it is done, so a
+    steady stream of reads cannot starve writes. Both sides are re-entrant for the thread
+    holding them, and the writer may also take the read side, so locked methods can call
+    each other. A reader cannot become a writer (that would deadlock two such readers)
+    and gets a `RuntimeError` instead.
+
+    Use it through the `read` and `write` context managers:
+
+        with lock.read():
+            ...
+        with lock.write():
+            ...
+
+    Attributes:
+        __condition (`threading.Condition`): Guards the counters below.
+        __readers (`int`): The number of threads holding the read side.
+        __writer (`int`): The identifier of the thread holding the write side, or None.
+        __writer_depth (`int`): How many times the writer took the write side.
+        __waiting_writers (`int`): The number of threads waiting for the write side.
+        __local (`threading.local`): How many times the current thread took the read
+            side (`depth`) and whether it counts among the `__readers` (`counted`).
+    """
+
+    def __init__(self):
+        self.__condition = threading.Condition(threading.Lock())
+        self.__readers = 0
+        self.__writer = None
+        self.__writer_depth = 0
+        self.__waiting_writers = 0
+        self.__local = threading.local()
+
+    def acquire_read(self):
+        depth = getattr(self.__local, 'depth', 0)
+        if depth == 0:
+            if self.__writer == threading.get_ident():
+                # Reading inside our own write needs no further locking
+                self.__local.counted = False
+            else:
+                with self.__condition:
+                    while self.__writer is not None or self.__waiting_writers:
+                        self.__condition.wait()
+                    self.__readers += 1
+                self.__local.counted = True
+        self.__local.depth = depth + 1
+
+    def release_read(self):
+        self.__local.depth -= 1
+        if self.__local.depth == 0 and self.__local.counted:
+            with self.__condition:
+                self.__readers -= 1
+                if self.__readers == 0:
+                    self.__condition.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        if self.__writer == me:
+            self.__writer_depth += 1
+            return
+        if getattr(self.__local, 'depth', 0):
+            raise RuntimeError('A read lock cannot be upgraded to a write lock.')
+        with self.__condition:
+            self.__waiting_writers += 1
+            try:
+                while self.__writer is not None or self.__readers:
+                    self.__condition.wait()
+            finally:
+                self.__waiting_writers -= 1
+            self.__writer = me
+            self.__writer_depth = 1
+
+    def release_write(self):
+        self.__writer_depth -= 1
+        if self.__writer_depth == 0:
+            with self.__condition:
+                self.__writer = None
+                self.__condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        """ Holds the read side inside a `with` block. """
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        """ Holds the write side inside a `with` block. """
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
@@ -1,13 +1,146 @@
-from utility.hash_util import hash_block, hash_string_256
+import hashlib
+import math
+import statistics
+import struct
+from time import time
+
+from utility.merkle import merkle_root
 from wallet import Wallet
 
+# A proof is valid when the SHA256 digest of the guess, read as a big-endian number, is
+# lower than the target of the block. The largest possible target accepts any digest.
+MAX_TARGET = 2 ** 256 - 1
+# The target of blocks which do not state one (the genesis block and blocks mined by
+# older versions): digests starting with a zero byte, i.e. hex digests starting with '00'
+DEFAULT_TARGET = 2 ** 248
+# The difficulty is adjusted every `RETARGET_INTERVAL` blocks so that blocks are mined
+# every `TARGET_BLOCK_TIME` seconds on average
+RETARGET_INTERVAL = 10
+TARGET_BLOCK_TIME = 10
+# One adjustment changes the target by at most this factor in either direction
+MAX_RETARGET_FACTOR = 4
+# A block must be newer than the median timestamp of the last `MEDIAN_TIME_BLOCKS` blocks
+# and at most `MAX_FUTURE_DRIFT` seconds ahead of the clock of the node checking it, so
+# that a miner cannot stretch a retarget interval with made up timestamps
+MEDIAN_TIME_BLOCKS = 11
+MAX_FUTURE_DRIFT = 2 * TARGET_BLOCK_TIME
+# Size in bytes of the proof at the end of a block header (see `Block.header`)
+HEADER_PROOF_SIZE = 8
+# Largest number of coins a transaction may send, the largest integer the binary
+# encoding of transactions holds (see `codec`)
+MAX_AMOUNT = 2 ** 63 - 1
+# Signatures of a chain are verified in batches of about this many transactions, so that
+# verifying a long chain only holds one batch of transactions in memory
+SIGNATURE_BATCH_SIZE = 10000
+
 
 class Verification:
     """ Provide utility methods for verifying the integrity of
     `block`s, `transaction`s and the whole `blockchain`. """
 
     @staticmethod
-    def valid_proof(transactions, last_hash, proof):
+    def proof_prefix(transactions, last_hash):
+        """ Serialize the part of a proof-of-work guess that does not depend on the proof.
+
+        Arguments:
+            transactions (:obj:`list` of `Transaction`s): The transactions of the new block
+                to be validated (excluding the MINING block).
+            last_hash (`str`): The hash of the previous (last) block.
+
+        Returns:
+            The UTF-8 encoded bytes every guess for these transactions starts with.
+        """
+        return (str([tx.to_ordered_dict() for tx in transactions]) +
+                str(last_hash)).encode('utf-8')
+
+    @staticmethod
+    def proof_hasher(prefix):
+        """ Return a SHA256 object that has already consumed the given :prefix:
+        (see `proof_prefix`). Copies of it can be completed with different proofs
+        without hashing the prefix again. """
+        return hashlib.sha256(prefix)
+
+    @staticmethod
+    def target_bytes(target):
+        """ Return the 32 bytes big-endian form of a numeric :target:. Comparing a raw
+        digest with it byte by byte is the same as comparing the numbers. """
+        return target.to_bytes(32, 'big')
+
+    @staticmethod
+    def valid_proof_from_hasher(hasher, proof, target_bytes=DEFAULT_TARGET.to_bytes(32, 'big'),
+                                header=False):
+        """ Validate a proof against a prefix hasher made by `proof_hasher`.
+
+        The difficulty criteria requires the raw digest to be lower than the target
+        given in the form made by `target_bytes`. The guess is completed with the proof
+        as text, or as the fixed-size number ending a block header if :header: is True
+        (the prefix then being `Block.header_prefix`).
+        """
+        guess_hash = hasher.copy()
+        if header:
+            guess_hash.update(proof.to_bytes(HEADER_PROOF_SIZE, 'big'))
+        else:
+            guess_hash.update(str(proof).encode('utf-8'))
+        return guess_hash.digest() < target_bytes
+
+    @staticmethod
+    def valid_header_proof(header, target):
+        """ Validate the proof of work of a block with a header: the SHA256 of the whole
+        header (which is also the hash of the block) must be lower than the :target:. """
+        return hashlib.sha256(header).digest() < target.to_bytes(32, 'big')
+
+    @staticmethod
+    def block_target(block):
+        """ Return the target a :block: was mined for (`DEFAULT_TARGET` if it does not state one). """
+        return DEFAULT_TARGET if block.target is None else block.target
+
+    @classmethod
+    def next_target(cls, blockchain, height):
+        """ Calculate the target of the block at :height: from the blocks before it.
+
+        The target is the one of the previous block, except at every `RETARGET_INTERVAL`
+        blocks: there it is scaled by the time the last `RETARGET_INTERVAL` blocks actually
+        took compared to `TARGET_BLOCK_TIME` per block, limited to `MAX_RETARGET_FACTOR`.
+        The first interval is skipped since the genesis block has a fixed timestamp.
+
+        Arguments:
+            blockchain (:obj:`list` of `Block`s): A chain holding at least the blocks
+                before :height:.
+            height (`int`): The index of the block whose target is calculated.
+
+        Returns:
+            The target as an `int`.
+        """
+        previous_target = cls.block_target(blockchain[height - 1])
+        if height % RETARGET_INTERVAL != 0 or height <= RETARGET_INTERVAL:
+            return previous_target
+        expected = TARGET_BLOCK_TIME * (RETARGET_INTERVAL - 1)
+        actual = blockchain[height - 1].timestamp - blockchain[height - RETARGET_INTERVAL].timestamp
+        actual = min(max(actual, expected / MAX_RETARGET_FACTOR), expected * MAX_RETARGET_FACTOR)
+        # Work in whole milliseconds so that every node calculates the same integer
+        target = previous_target * round(actual * 1000) // round(expected * 1000)
+        return min(max(target, 1), MAX_TARGET)
+
+    @staticmethod
+    def median_time_past(blockchain, height):
+        """ Return the median timestamp of the (up to) `MEDIAN_TIME_BLOCKS` blocks before
+        :height: in :blockchain:. """
+        return statistics.median(blockchain[index].timestamp
+                                 for index in range(max(height - MEDIAN_TIME_BLOCKS, 0), height))
+
+    @classmethod
+    def valid_timestamp(cls, blockchain, block, height):
+        """ Check whether the timestamp of a block at :height: is a number later than the
+        median time of the blocks before it and not beyond `MAX_FUTURE_DRIFT` seconds from
+        now. """
+        timestamp = block.timestamp
+        if not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool):
+            return False
+        return (math.isfinite(timestamp) and
+                cls.median_time_past(blockchain, height) < timestamp <= time() + MAX_FUTURE_DRIFT)
+
+    @classmethod
+    def valid_proof(cls, transactions, last_hash, proof, target=DEFAULT_TARGET):
         """ Validate whether a new block fulfills the difficulty criteria.
 
         Arguments:
@@ -17,31 +150,99 @@ class Verification:
             proof (`int`): A number (also call a 'proof-of-work number' or a 'nonce') used
                 together with the :transactions: and :last_hash: to yield a new hash
                 that suffices a condition defined by the creator(s) of the blockchain.
+            target (`int`, default to `DEFAULT_TARGET`): The target the hash must be lower than.
 
         Returns:
             True if the difficulty criteria satify, Fals otherwise.
         """
-        guess = (str([tx.to_ordered_dict() for tx in transactions]) +
-                 str(last_hash) + str(proof)).encode('utf-8')
-        guess_hash = hash_string_256(guess)
-        return guess_hash[0:2] == '00'
+        hasher = cls.proof_hasher(cls.proof_prefix(transactions, last_hash))
+        return cls.valid_proof_from_hasher(hasher, proof, cls.target_bytes(target))
 
     @classmethod
-    def verify_chain(cls, blockchain):
+    def verify_block(cls, blockchain, block, height):
+        """ Check whether a block fits at :height: on top of the blocks before it: it must
+        point at the hash of the previous block, have a timestamp accepted by
+        `valid_timestamp`, claim the target calculated by `next_target` and have a proof
+        meeting that target.
+
+        Blocks with a header must also claim the Merkle root of their transactions; their
+        proof of work covers the header only. Blocks without a header (or without a target)
+        were mined by older versions and are only accepted on top of blocks of the same
+        kind; blocks without a target are checked against `DEFAULT_TARGET`.
+
+        Returns:
+            True if the block is consistent with the chain, False otherwise.
+        """
+        previous_block = blockchain[height - 1]
+        if block.index != height or block.previous_hash != previous_block.hash:
+            return False
+        if not all(cls.valid_fields(tx) and cls.valid_amount(tx.amount)
+                   for tx in block.transactions):
+            return False
+        if not cls.valid_timestamp(blockchain, block, height):
+            return False
+        if block.target is None:
+            if previous_block.target is not None or block.merkle_root is not None:
+                return False
+        elif block.target != cls.next_target(blockchain, height):
+            return False
+        if block.merkle_root is None:
+            if previous_block.merkle_root is not None:
+                return False
+            return cls.valid_proof(block.transactions[:-1], block.previous_hash, block.proof,
+                                   cls.block_target(block))
+        if block.merkle_root != merkle_root([tx.tx_id for tx in block.transactions]):
+            return False
+        try:
+            return cls.valid_header_proof(block.header(), block.target)
+        except (ValueError, OverflowError, TypeError, struct.error):
+            # Fields which do not fit the header (e.g. a malformed hash or a negative
+            # proof sent by a peer)
+            return False
+
+    @classmethod
+    def verify_chain(cls, blockchain, start=0, check_signatures=False):
         """ Check whether all blocks contain consistent data.
 
         Arguments:
             blockchain (:obj:`list` of `Block`s): The `blockchain` to be verified.
+            start (`int`, default to 0): The index of the first block to be checked. Blocks
+                before it are known to be valid already (each block is still checked
+                against the hash of the block before it).
+            check_signatures (`bool`, default to False): Whether the signatures of the
+                transactions in the checked blocks are verified too (in batches of about
+                `SIGNATURE_BATCH_SIZE` transactions).
 
         Returns:
-            True if all blocks' data is consistent, False otherwise.
+            True if all checked blocks' data is consistent, False otherwise.
         """
-        for index, block in enumerate(blockchain):
-            if index >= 1 and block.previous_hash != hash_block(blockchain[index - 1]):
-                return False
-            if index >= 1 and not cls.valid_proof(block.transactions[:-1], block.previous_hash, block.proof):
+        signed_transactions = []
+        for index in range(max(start, 1), len(blockchain)):
+            block = blockchain[index]
+            if not cls.verify_block(blockchain, block, index):
                 return False
-        return True
+            if check_signatures:
+                # The last transaction of each block is the unsigned MINING reward
+                signed_transactions.extend(block.transactions[:-1])
+                if len(signed_transactions) >= SIGNATURE_BATCH_SIZE:
+                    if not Wallet.verify_transactions(signed_transactions):
+                        return False
+                    signed_transactions = []
+        return not signed_transactions or Wallet.verify_transactions(signed_transactions)
+
+    @staticmethod
+    def valid_fields(transaction):
+        """ Check whether the sender, recipient and signature of a transaction are strings,
+        as keys, addresses and signatures are (data from other nodes may hold anything). """
+        return all(isinstance(value, str) for value in
+                   (transaction.sender, transaction.recipient, transaction.signature))
+
+    @staticmethod
+    def valid_amount(amount):
+        """ Check whether an amount of coins can be sent: it must be a positive number
+        no larger than `MAX_AMOUNT`. """
+        return (isinstance(amount, (int, float)) and not isinstance(amount, bool) and
+                math.isfinite(amount) and 0 < amount <= MAX_AMOUNT)
 
     @staticmethod
     def verify_transaction(transaction, get_balance, check_funds=True):
@@ -59,6 +260,9 @@ class Verification:
         """
         # Note that, we can just call get_balance() without passing the transaciton.sender
         # argument as that is the default case when the sender is the user of this hosting node.
+        if not (Verification.valid_fields(transaction) and
+                Verification.valid_amount(transaction.amount)):
+            return False
         if check_funds:
             return get_balance(transaction.sender) >= transaction.amount and Wallet.verify_transaction(transaction)
         else:
@@ -75,4 +279,4 @@ class Verification:
         Returns:
             True if all transactions are valid, False otherwise.
         """
-        return all([cls.verify_transaction(tx, get_balance, False) for tx in open_transactions])
+        return Wallet.verify_transactions(open_transactions)
@@ -1,8 +1,105 @@
-from Crypto.PublicKey import RSA
-from Crypto.Signature import PKCS1_v1_5
-from Crypto.Hash import SHA256
-import Crypto.Random
 import binascii
+import concurrent.futures
+import threading
+from functools import lru_cache
+from time import perf_counter
+
+from lazy_import import lazy_import
+from metrics import metrics
+
+# The cryptography modules are only imported when keys are first used
+RSA = lazy_import('Crypto.PublicKey.RSA')
+PKCS1_v1_5 = lazy_import('Crypto.Signature.PKCS1_v1_5')
+SHA256 = lazy_import('Crypto.Hash.SHA256')
+Random = lazy_import('Crypto.Random')
+multiprocessing = lazy_import('multiprocessing')
+
+# Batches with fewer transactions are verified in the calling process
+PARALLEL_VERIFY_THRESHOLD = 64
+# Number of transactions sent to a worker process at once
+VERIFY_CHUNK_SIZE = 32
+
+# Number of parsed keys kept by each of the signer and verifier caches
+KEY_CACHE_SIZE = 1024
+
+# Worker processes shared by all batch verifications (created on first use, guarded
+# by the lock since several request threads may verify at the same time)
+_verify_executor = None
+_verify_executor_lock = threading.Lock()
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def _signer_for(private_key):
+    """ Return a ready PKCS#1 v1.5 signer for a hex encoded private key.
+    Parsed keys are cached so repeated signing skips the DER parsing. """
+    return PKCS1_v1_5.new(RSA.importKey(binascii.unhexlify(private_key)))
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def _verifier_for(public_key):
+    """ Return a ready PKCS#1 v1.5 verifier for a hex encoded public key.
+    Parsed keys are cached so repeated senders skip the DER parsing. """
+    return PKCS1_v1_5.new(RSA.importKey(binascii.unhexlify(public_key)))
+
+
+def _verify_signature(transaction):
+    """ Verify the signature of a transaction, see `Wallet.verify_transaction`. """
+    try:
+        # transaction.sender is the public_key of that sender
+        verifier = _verifier_for(transaction.sender)
+        h = SHA256.new((str(transaction.sender) + str(transaction.recipient) +
+                        str(transaction.amount)).encode('utf8'))
+        return bool(verifier.verify(h, binascii.unhexlify(transaction.signature)))
+    except (ValueError, TypeError, IndexError):
+        return False
+
+
+def _timed_verify(transactions, stop_at_invalid):
+    """ Verify the transactions of a chunk in a worker process.
+
+    The workers do not share the metrics of the node, so the time taken by every
+    verification is sent back for the calling process to record.
+
+    Returns:
+        A tuple of the list of booleans, one per verified transaction, and the list of
+        the seconds each verification took.
+    """
+    results = []
+    durations = []
+    for tx in transactions:
+        started = perf_counter()
+        results.append(_verify_signature(tx))
+        durations.append(perf_counter() - started)
+        if stop_at_invalid and not results[-1]:
+            break
+    return results, durations
+
+
+def _verify_chunk(transactions):
+    """ Verify a chunk of transactions up to the first invalid one. """
+    return _timed_verify(transactions, stop_at_invalid=True)
+
+
+def _verify_each(transactions):
+    """ Verify each transaction of a chunk. """
+    return _timed_verify(transactions, stop_at_invalid=False)
+
+
+def _get_verify_executor():
+    """ Return the pool of worker processes, creating it on first use.
+
+    The workers are started from a fresh interpreter rather than forked: forking the
+    multi-threaded node copies the locks other threads hold at that moment, which a
+    worker could then wait on forever.
+    """
+    global _verify_executor
+    with _verify_executor_lock:
+        if _verify_executor is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() \
+                else 'spawn'
+            _verify_executor = concurrent.futures.ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context(method))
+        return _verify_executor
 
 
 class Wallet:
@@ -71,7 +168,7 @@ class Wallet:
     def generate_keys(self):
         """ Generate and return a tuple of private and public keys (both are in string).
         RSA is the algorithm used in here for generating the keys. """
-        private_key = RSA.generate(1024, Crypto.Random.new().read)
+        private_key = RSA.generate(1024, Random.new().read)
         public_key = private_key.publickey()
         return binascii.hexlify(private_key.exportKey(format='DER')).decode('ascii'), binascii.hexlify(public_key.exportKey(format='DER')).decode('ascii')
 
@@ -88,14 +185,14 @@ class Wallet:
             recipient (`str`): The recipient of the transaction.
             amount (`float`): The amount of coins sent with the transaction.
         """
-        signer = PKCS1_v1_5.new(RSA.importKey(
-            binascii.unhexlify(self.private_key)))
+        signer = _signer_for(self.private_key)
         h = SHA256.new((str(sender) + str(recipient) +
                         str(amount)).encode('utf8'))
         signature = signer.sign(h)
         return binascii.hexlify(signature).decode('ascii')
 
     @staticmethod
+    @metrics.timed('signature_verify_seconds')
     def verify_transaction(transaction):
         """ Verify whether a signed transaction was not modified (tampered).
 
@@ -103,11 +200,85 @@ class Wallet:
             transaction (:obj:`Transaction`): The transaction to be verified.
 
         Returns:
-            True if the transaction content was preserved, False if its content was changed.
+            True if the transaction content was preserved, False if its content was changed
+            or its sender (public key) or signature is malformed.
         """
-        # transaction.sender is the public_key of that sender
-        public_key = RSA.importKey(binascii.unhexlify(transaction.sender))
-        verifier = PKCS1_v1_5.new(public_key)
-        h = SHA256.new((str(transaction.sender) + str(transaction.recipient) +
-                        str(transaction.amount)).encode('utf8'))
-        return verifier.verify(h, binascii.unhexlify(transaction.signature))
+        return _verify_signature(transaction)
+
+    @staticmethod
+    def key_cache_info():
+        """ Return the hits, misses and sizes of the parsed key caches of this process. """
+        return {
+            'signers': _signer_for.cache_info()._asdict(),
+            'verifiers': _verifier_for.cache_info()._asdict()
+        }
+
+    @staticmethod
+    def verify_transactions(transactions):
+        """ Verify the signatures of a batch of transactions.
+
+        Large batches are split into chunks which are verified by a pool of worker
+        processes. As soon as any chunk turns out to contain a tampered transaction
+        the chunks which have not been started yet are cancelled.
+
+        Arguments:
+            transactions (:obj:`list` of `Transaction`s): The signed transactions to be verified.
+
+        Returns:
+            True if all transactions are unmodified, False otherwise.
+        """
+        metrics.inc('signatures_verified_total', len(transactions))
+        with metrics.timer('signature_batch_verify_seconds'):
+            if len(transactions) < PARALLEL_VERIFY_THRESHOLD:
+                return all(Wallet.verify_transaction(tx) for tx in transactions)
+            futures = Wallet.__submit_chunks(_verify_chunk, transactions)
+            for future in concurrent.futures.as_completed(futures):
+                if not all(Wallet.__collect(future)):
+                    for pending in futures:
+                        pending.cancel()
+                    return False
+            return True
+
+    @staticmethod
+    def verify_each(transactions):
+        """ Verify the signatures of a batch of transactions one by one.
+
+        Unlike `verify_transactions` the result of every transaction is returned, so that
+        the valid transactions of a batch can be accepted and the others rejected. Large
+        batches are verified by the same pool of worker processes.
+
+        Arguments:
+            transactions (:obj:`list` of `Transaction`s): The signed transactions to be verified.
+
+        Returns:
+            A list with one boolean per transaction, True if its signature is valid.
+        """
+        metrics.inc('signatures_verified_total', len(transactions))
+        with metrics.timer('signature_batch_verify_seconds'):
+            if len(transactions) < PARALLEL_VERIFY_THRESHOLD:
+                return [Wallet.verify_transaction(tx) for tx in transactions]
+            futures = Wallet.__submit_chunks(_verify_each, transactions)
+            return [valid for future in futures for valid in Wallet.__collect(future)]
+
+    @staticmethod
+    def __collect(future):
+        """ Return the results of a verified chunk, recording how long each took. """
+        results, durations = future.result()
+        for seconds in durations:
+            metrics.observe('signature_verify_seconds', seconds)
+        return results
+
+    @staticmethod
+    def __submit_chunks(verify, transactions):
+        """ Submit chunks of `VERIFY_CHUNK_SIZE` transactions to the worker processes.
+
+        Arguments:
+            verify (`function`): `_verify_chunk` or `_verify_each`, run on every chunk.
+            transactions (:obj:`list` of `Transaction`s): The signed transactions.
+
+        Returns:
+            The list of futures of the chunks, in the order of the transactions.
+        """
+        executor = _get_verify_executor()
+        return [executor.submit(verify, transactions[i:i + VERIFY_CHUNK_SIZE])
+                for i in range(0, len(transactions), VERIFY_CHUNK_SIZE)]